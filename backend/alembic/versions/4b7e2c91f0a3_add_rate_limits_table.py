@@ -0,0 +1,40 @@
+"""Add rate_limits table for long-window quotas
+
+Revision ID: 4b7e2c91f0a3
+Revises: da4be93b5995
+Create Date: 2026-10-19 10:12:41.318207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b7e2c91f0a3'
+down_revision: Union[str, Sequence[str], None] = 'da4be93b5995'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('rate_limits',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('user_id', sa.UUID(), nullable=False),
+        sa.Column('endpoint', sa.String(length=255), nullable=False),
+        sa.Column('period', sa.String(length=10), nullable=False),
+        sa.Column('request_count', sa.Integer(), nullable=False),
+        sa.Column('window_start', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('tier_limit', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        # Also serves quota lookups for a user on an endpoint, and the batched upserts
+        sa.UniqueConstraint('user_id', 'endpoint', 'period', 'window_start', name='uq_rate_limits_user_endpoint_window')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('rate_limits')
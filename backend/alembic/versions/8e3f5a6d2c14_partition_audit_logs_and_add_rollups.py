@@ -0,0 +1,138 @@
+"""Partition audit_logs by day and add hourly rollup tables
+
+Revision ID: 8e3f5a6d2c14
+Revises: 4b7e2c91f0a3
+Create Date: 2026-10-19 14:03:27.552190
+
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e3f5a6d2c14'
+down_revision: Union[str, Sequence[str], None] = '4b7e2c91f0a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Partitions are created this far ahead; the maintenance job keeps it that way
+PARTITIONS_AHEAD_DAYS = 7
+
+# Actions counted per source IP, as in app/audit_maintenance.py at this revision
+FAILURE_ACTIONS = ["LOGIN_FAILURE", "PROJECT_ACCESS_DENIED", "RATE_LIMIT_EXCEEDED", "QUOTA_EXCEEDED"]
+
+
+def _create_day_partition(day: date) -> None:
+    """Creates the partition for one UTC day."""
+    op.execute(
+        f"CREATE TABLE IF NOT EXISTS audit_logs_p{day:%Y%m%d} PARTITION OF audit_logs "
+        f"FOR VALUES FROM ('{day.isoformat()} 00:00:00+00') TO ('{(day + timedelta(days=1)).isoformat()} 00:00:00+00')"
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("ALTER TABLE audit_logs RENAME TO audit_logs_legacy")
+    op.execute("ALTER INDEX audit_logs_pkey RENAME TO audit_logs_legacy_pkey")
+    op.execute("ALTER INDEX ix_audit_logs_action RENAME TO ix_audit_logs_legacy_action")
+    op.execute("ALTER INDEX ix_audit_logs_user_id RENAME TO ix_audit_logs_legacy_user_id")
+
+    # The partition key has to be part of the primary key
+    op.execute("""
+        CREATE TABLE audit_logs (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY,
+            user_id UUID REFERENCES users(id),
+            action VARCHAR NOT NULL,
+            resource_type VARCHAR,
+            resource_id UUID,
+            details JSON,
+            ip_address VARCHAR,
+            timestamp TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+    op.create_index('ix_audit_logs_timestamp', 'audit_logs', ['timestamp'], unique=False)
+    op.create_index('ix_audit_logs_action_timestamp', 'audit_logs', ['action', 'timestamp'], unique=False)
+    op.create_index('ix_audit_logs_user_id', 'audit_logs', ['user_id'], unique=False)
+    # Catches rows outside every daily partition (e.g. a badly skewed clock)
+    op.execute("CREATE TABLE audit_logs_default PARTITION OF audit_logs DEFAULT")
+
+    # One partition per day, from the oldest existing row until a week from now
+    connection = op.get_bind()
+    oldest = connection.execute(sa.text("SELECT (min(timestamp) AT TIME ZONE 'UTC')::date FROM audit_logs_legacy")).scalar()
+    today = datetime.now(timezone.utc).date()
+    day = min(oldest, today) if oldest else today
+    while day <= today + timedelta(days=PARTITIONS_AHEAD_DAYS):
+        _create_day_partition(day)
+        day += timedelta(days=1)
+
+    op.execute("""
+        INSERT INTO audit_logs (id, user_id, action, resource_type, resource_id, details, ip_address, timestamp)
+        SELECT id, user_id, action, resource_type, resource_id, details, ip_address, timestamp
+        FROM audit_logs_legacy
+    """)
+    op.execute("SELECT setval(pg_get_serial_sequence('audit_logs', 'id'), coalesce((SELECT max(id) FROM audit_logs), 0) + 1, false)")
+    op.drop_table('audit_logs_legacy')
+
+    op.create_table('audit_action_rollups',
+        sa.Column('bucket_start', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('action', sa.String(), nullable=False),
+        sa.Column('event_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('bucket_start', 'action')
+    )
+    op.create_table('audit_ip_failure_rollups',
+        sa.Column('bucket_start', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('action', sa.String(), nullable=False),
+        sa.Column('ip_address', sa.String(), nullable=False),
+        sa.Column('failure_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('bucket_start', 'action', 'ip_address')
+    )
+
+    # Roll up the copied history too, so reports cover it from the first run;
+    # the maintenance job only refreshes the most recent hours
+    op.execute("""
+        INSERT INTO audit_action_rollups (bucket_start, action, event_count)
+        SELECT date_trunc('hour', timestamp), action, count(*) FROM audit_logs
+        GROUP BY 1, 2
+    """)
+    op.execute(f"""
+        INSERT INTO audit_ip_failure_rollups (bucket_start, action, ip_address, failure_count)
+        SELECT date_trunc('hour', timestamp), action, ip_address, count(*) FROM audit_logs
+        WHERE action IN ({", ".join(f"'{action}'" for action in FAILURE_ACTIONS)}) AND ip_address IS NOT NULL
+        GROUP BY 1, 2, 3
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('audit_ip_failure_rollups')
+    op.drop_table('audit_action_rollups')
+
+    op.execute("ALTER TABLE audit_logs RENAME TO audit_logs_partitioned")
+    op.execute("ALTER INDEX audit_logs_pkey RENAME TO audit_logs_partitioned_pkey")
+    op.execute("ALTER INDEX ix_audit_logs_user_id RENAME TO ix_audit_logs_partitioned_user_id")
+    op.create_table('audit_logs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.UUID(), nullable=True),
+        sa.Column('action', sa.String(), nullable=False),
+        sa.Column('resource_type', sa.String(), nullable=True),
+        sa.Column('resource_id', sa.UUID(), nullable=True),
+        sa.Column('details', sa.JSON(), nullable=True),
+        sa.Column('ip_address', sa.String(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_audit_logs_action'), 'audit_logs', ['action'], unique=False)
+    op.create_index(op.f('ix_audit_logs_user_id'), 'audit_logs', ['user_id'], unique=False)
+    op.execute("""
+        INSERT INTO audit_logs (id, user_id, action, resource_type, resource_id, details, ip_address, timestamp)
+        SELECT id, user_id, action, resource_type, resource_id, details, ip_address, timestamp
+        FROM audit_logs_partitioned
+    """)
+    op.execute("SELECT setval(pg_get_serial_sequence('audit_logs', 'id'), coalesce((SELECT max(id) FROM audit_logs), 0) + 1, false)")
+    # Dropping the parent drops every partition with it
+    op.execute("DROP TABLE audit_logs_partitioned")
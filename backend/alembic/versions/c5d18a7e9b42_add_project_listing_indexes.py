@@ -0,0 +1,30 @@
+"""Add indexes for the keyset-paginated project listing
+
+Revision ID: c5d18a7e9b42
+Revises: 8e3f5a6d2c14
+Create Date: 2026-10-19 17:41:08.316524
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d18a7e9b42'
+down_revision: Union[str, Sequence[str], None] = '8e3f5a6d2c14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_project_members_user_id'), 'project_members', ['user_id'], unique=False)
+    op.create_index('ix_projects_created_at_id', 'projects', ['created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_projects_created_at_id', table_name='projects')
+    op.drop_index(op.f('ix_project_members_user_id'), table_name='project_members')
@@ -1,12 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from typing import List
 import uuid
 from . import schemas
 from sqlalchemy.ext.asyncio import AsyncSession
 
 # --- CORRECTED IMPORTS ---
-from . import models, schemas, crud, permissions
+from . import models, schemas, crud, permissions, security, db_metrics
 from .database import get_db # The get_db function comes from database.py
+from . import cache_manager
 
 
 router = APIRouter()
@@ -100,4 +101,42 @@ async def broadcast_system_message(
         "level": message.level.value,
         "text": message.text
     })
-    return {"status": "Message broadcast scheduled."}
\ No newline at end of file
+    return {"status": "Message broadcast scheduled."}
+
+
+@router.get("/cache/stats", response_model=dict)
+async def get_cache_report(
+    top: int = Query(20, ge=1, le=200),
+    current_user: models.User = Depends(permissions.is_admin)
+):
+    """
+    Reports cache hit ratios, latencies, bytes stored and evictions per key
+    prefix and per route, plus the `top` hottest and largest keys.
+    Counters cover the API process that serves the request. Admin only.
+    """
+    return await cache_manager.get_cache_report(top_n=top)
+
+
+@router.get("/auth/stats", response_model=dict)
+async def get_password_hash_report(
+    current_user: models.User = Depends(permissions.is_admin)
+):
+    """
+    Reports the password hashing pool: pending calls, completed and shed
+    calls, and queue-wait and hashing latencies for this API process. Admin only.
+    """
+    return security.get_password_hash_report()
+
+
+@router.get("/db/stats", response_model=dict)
+async def get_query_report(
+    top: int = Query(20, ge=1, le=200),
+    current_user: models.User = Depends(permissions.is_admin)
+):
+    """
+    Reports statements, database time and rows per route, with the statements
+    most often repeated within one request (likely N+1 queries), for the `top`
+    routes by total database time. Counters cover the API process that serves
+    the request. Admin only.
+    """
+    return db_metrics.get_query_report(top_n=top)
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response, Cookie
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Cookie
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
@@ -9,6 +9,7 @@ from . import crud, schemas, security, models
 from .database import get_db
 from .dependencies import get_current_user
 from .rate_limiter import rate_limit
+from .audit_logger import log_event
 
 router = APIRouter()
 
@@ -23,10 +24,10 @@ async def register_new_user(user_in: schemas.UserCreate, db: AsyncSession = Depe
 
 
 @router.post("/login", response_model=schemas.Token, dependencies=[Depends(rate_limit("login"))])
-async def login_for_access_token(response: Response, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+async def login_for_access_token(request: Request, response: Response, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     user = await crud.get_user_by_email(db, email=form_data.username)
-    if not user or not security.verify_password(form_data.password, user.password_hash):
-        await crud.create_audit_log(db, action="LOGIN_FAILURE", details={"email": form_data.username})
+    if not user or not await security.verify_password_async(form_data.password, user.password_hash):
+        await log_event(action="LOGIN_FAILURE", user=None, request=request, details={"email": form_data.username})
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email or password", headers={"WWW-Authenticate": "Bearer"})
 
     access_token = security.create_access_token(data={"user_id": str(user.id), "role": user.role.value})
@@ -57,8 +58,11 @@ async def refresh_access_token(refresh_token: Optional[str] = Cookie(None), db:
         payload = jwt.decode(refresh_token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
         user_id_str = payload.get("user_id")
         if user_id_str is None: raise HTTPException(status_code=401, detail="Invalid refresh token")
-        
+
         user_id = uuid.UUID(user_id_str)
+        db_token = await crud.get_valid_refresh_token(db, token=refresh_token)
+        if not db_token or db_token.user_id != user_id: raise HTTPException(status_code=401, detail="Invalid refresh token")
+
         user = await crud.get_user_by_id(db, user_id=user_id)
         if not user: raise HTTPException(status_code=401, detail="User not found")
 
@@ -96,7 +100,7 @@ async def confirm_password_reset(reset_data: schemas.PasswordResetConfirm, db: A
 
 @router.post("/password/change", status_code=status.HTTP_200_OK)
 async def change_user_password(password_data: schemas.PasswordChange, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    if not security.verify_password(password_data.current_password, current_user.password_hash):
+    if not await security.verify_password_async(password_data.current_password, current_user.password_hash):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Incorrect current password.")
     await crud.update_user_password(db, user=current_user, new_password=password_data.new_password)
     return {"message": "Your password has been successfully changed."}
\ No newline at end of file
@@ -1,16 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response, File, UploadFile
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request, Response, File, UploadFile
+from typing import List, Optional, Set, Tuple
+from datetime import datetime
+import base64
 import uuid
 import os
 from sqlalchemy.ext.asyncio import AsyncSession
 from arq.connections import ArqRedis
 
-from . import crud, models, schemas
-from .dependencies import get_current_user, verify_csrf_token
+from . import crud, models, schemas, etags
+from .cache_manager import project_tag, user_tag
+from .dependencies import get_current_principal, verify_csrf_token
+from .principal_cache import Principal
 from .database import get_db
-from .permissions import require_project_role
+from .permissions import require_project_role, require_project_access
 from .project_roles import ProjectRole
 from .rate_limiter import rate_limit
+from .quotas import quota
 from .redis_manager import get_redis_pool
 from .user_roles import UserRole
 from .upload_config import ALLOWED_FILE_TYPES, MAX_FILE_SIZE_BYTES
@@ -19,33 +24,106 @@ from .websocket_manager import manager as ws_manager
 
 router = APIRouter()
 
+# Page size of the project listing
+PROJECT_PAGE_DEFAULT_LIMIT = 50
+PROJECT_PAGE_MAX_LIMIT = 200
+
+
+def _encode_project_cursor(created_at: datetime, project_id: uuid.UUID) -> str:
+    """An opaque cursor for the listing position right after this project."""
+    raw = f"{created_at.isoformat()}|{project_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_project_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, _, project_id = raw.partition("|")
+        return datetime.fromisoformat(created_at), uuid.UUID(project_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+
+def _parse_project_fields(fields: str) -> Set[str]:
+    selected = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = selected - set(schemas.ProjectListItem.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}.")
+    # Always returned: it identifies the item, and cached listings are tagged by it
+    return selected | {"id"}
+
 
 @router.post("/", response_model=schemas.ProjectRead, status_code=status.HTTP_201_CREATED, dependencies=[Depends(rate_limit())])
-async def create_new_project(project_in: schemas.ProjectCreate, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def create_new_project(project_in: schemas.ProjectCreate, current_user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_db)):
     return await crud.create_project_with_owner(db=db, project_in=project_in, owner_id=current_user.id)
 
 
 @router.post("/from-template", response_model=schemas.ProjectRead, dependencies=[Depends(rate_limit())])
-async def create_project_from_template(template_in: schemas.ProjectCreateFromTemplate, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def create_project_from_template(template_in: schemas.ProjectCreateFromTemplate, current_user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_db)):
     template_project = await crud.get_project_by_id(db, project_id=template_in.template_project_id)
     if not template_project:
         raise HTTPException(status_code=404, detail="Template project not found.")
     return await crud.create_project_from_template(db, template_project, template_in.new_project_name, current_user)
 
 
-@router.get("/", response_model=List[schemas.ProjectRead])
-async def list_user_projects(current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    return await crud.get_projects_for_user(db=db, user_id=current_user.id)
+@router.get("/", response_model=schemas.ProjectPage)
+async def list_user_projects(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = Query(None, description="The `next_cursor` of the previous page."),
+    limit: int = Query(PROJECT_PAGE_DEFAULT_LIMIT, ge=1, le=PROJECT_PAGE_MAX_LIMIT),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return; `id` is always included."),
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Lists the caller's projects, newest first, one page at a time. Each item
+    carries the caller's role and a member count instead of the member list,
+    so a page costs the same however many projects and members there are.
+    """
+    after = _decode_project_cursor(cursor) if cursor else None
+    selected_fields = _parse_project_fields(fields) if fields else None
+
+    # One row past the page tells us whether there is a next one
+    rows = await crud.get_project_page_for_user(db, user_id=current_user.id, limit=limit + 1, after=after)
+    page = rows[:limit]
+
+    # The ETag depends on the page's projects and on the query (cursor, limit, fields)
+    etag = await etags.build_etag_from_tags(request, [user_tag(current_user.id)] + [project_tag(row["id"]) for row in page])
+    if etag:
+        etag = etags.build_etag(etag, str(request.url.query))
+    if etags.etag_matches(request, etag):
+        return etags.not_modified(etag)
+    if etag:
+        response.headers["ETag"] = etag
+
+    return {
+        "items": [
+            schemas.ProjectListItem.model_validate(row).model_dump(mode="json", include=selected_fields)
+            for row in page
+        ],
+        "next_cursor": _encode_project_cursor(page[-1]["created_at"], page[-1]["id"]) if len(rows) > limit else None,
+    }
 
 
 @router.get("/{project_id}", response_model=schemas.ProjectRead)
-async def get_project_details(project: models.Project = Depends(require_project_role([ProjectRole.VIEWER, ProjectRole.EDITOR, ProjectRole.OWNER]))):
+async def get_project_details(request: Request, response: Response, project_id: uuid.UUID = Depends(require_project_access([ProjectRole.VIEWER, ProjectRole.EDITOR, ProjectRole.OWNER])), db: AsyncSession = Depends(get_db)):
+    etag = await etags.build_etag_from_tags(request, [project_tag(project_id)])
+    if etags.etag_matches(request, etag):
+        return etags.not_modified(etag)
+    project = await crud.get_project_by_id(db, project_id=project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found.")
+    if etag:
+        response.headers["ETag"] = etag
     return project
 
 
 @router.put("/{project_id}", response_model=schemas.ProjectRead)
 async def update_existing_project(project_in: schemas.ProjectUpdate, project: models.Project = Depends(require_project_role([ProjectRole.EDITOR, ProjectRole.OWNER])), db: AsyncSession = Depends(get_db)):
-    return await crud.update_project(db=db, project=project, project_in=project_in)
+    project = await crud.update_project(db=db, project=project, project_in=project_in)
+    # The response includes the members, which the permission check doesn't load
+    return await crud.get_project_by_id(db, project_id=project.id)
 
 
 @router.delete("/{project_id}", status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(verify_csrf_token)])
@@ -55,8 +133,8 @@ async def delete_existing_project(project: models.Project = Depends(require_proj
 
 
 @router.get("/{project_id}/members", response_model=List[schemas.ProjectMemberRead])
-async def get_project_members(project: models.Project = Depends(require_project_role([ProjectRole.VIEWER, ProjectRole.EDITOR, ProjectRole.OWNER]))):
-    return project.member_associations
+async def get_project_members(project_id: uuid.UUID = Depends(require_project_access([ProjectRole.VIEWER, ProjectRole.EDITOR, ProjectRole.OWNER])), db: AsyncSession = Depends(get_db)):
+    return await crud.get_project_members(db, project_id=project_id)
 
 
 @router.post("/{project_id}/members", response_model=schemas.ProjectMemberRead, status_code=201)
@@ -64,7 +142,7 @@ async def invite_project_member(invite_in: schemas.ProjectMemberInvite, project:
     user_to_invite = await crud.get_user_by_email(db, email=invite_in.email)
     if not user_to_invite:
         raise HTTPException(status_code=404, detail="User with that email not found.")
-    if any(m.user_id == user_to_invite.id for m in project.member_associations):
+    if await crud.get_project_member(db, project_id=project.id, user_id=user_to_invite.id):
         raise HTTPException(status_code=400, detail="User is already a member of this project.")
     new_member = await crud.add_project_member(db, project, user_to_invite, invite_in.role)
     await ws_manager.broadcast_to_user(user_id=user_to_invite.id, message={"type": "project_invitation", "text": f"You have been invited to the project '{project.name}' as an {invite_in.role.value}.", "project_id": str(project.id)})
@@ -72,18 +150,18 @@ async def invite_project_member(invite_in: schemas.ProjectMemberInvite, project:
 
 
 @router.put("/{project_id}/members/{user_id}", response_model=schemas.ProjectMemberRead)
-async def update_project_member(user_id: uuid.UUID, update_in: schemas.ProjectMemberUpdate, project: models.Project = Depends(require_project_role([ProjectRole.OWNER])), db: AsyncSession = Depends(get_db)):
-    member_to_update = next((m for m in project.member_associations if m.user_id == user_id), None)
+async def update_project_member(user_id: uuid.UUID, update_in: schemas.ProjectMemberUpdate, project_id: uuid.UUID = Depends(require_project_access([ProjectRole.OWNER])), db: AsyncSession = Depends(get_db)):
+    member_to_update = await crud.get_project_member(db, project_id=project_id, user_id=user_id)
     if not member_to_update:
         raise HTTPException(status_code=404, detail="User is not a member of this project.")
     return await crud.update_project_member_role(db, member_to_update, update_in.role)
 
 
 @router.delete("/{project_id}/members/{user_id}", status_code=204)
-async def remove_project_member(user_id: uuid.UUID, project: models.Project = Depends(require_project_role([ProjectRole.OWNER])), db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def remove_project_member(user_id: uuid.UUID, project_id: uuid.UUID = Depends(require_project_access([ProjectRole.OWNER])), db: AsyncSession = Depends(get_db), current_user: Principal = Depends(get_current_principal)):
     if user_id == current_user.id:
         raise HTTPException(status_code=400, detail="Owner cannot remove themselves from a project.")
-    member_to_remove = next((m for m in project.member_associations if m.user_id == user_id), None)
+    member_to_remove = await crud.get_project_member(db, project_id=project_id, user_id=user_id)
     if not member_to_remove:
         raise HTTPException(status_code=404, detail="User is not a member of this project.")
     await crud.remove_project_member(db, member_to_remove)
@@ -96,12 +174,12 @@ async def update_project_settings_endpoint(settings_in: schemas.ProjectSettings,
 
 
 @router.get("/{project_id}/stats", response_model=schemas.ProjectStats)
-async def get_project_stats_endpoint(project: models.Project = Depends(require_project_role([ProjectRole.VIEWER, ProjectRole.EDITOR, ProjectRole.OWNER])), db: AsyncSession = Depends(get_db)):
-    return await crud.get_project_stats(db, project_id=project.id)
+async def get_project_stats_endpoint(project_id: uuid.UUID = Depends(require_project_access([ProjectRole.VIEWER, ProjectRole.EDITOR, ProjectRole.OWNER])), db: AsyncSession = Depends(get_db)):
+    return await crud.get_project_stats(db, project_id=project_id)
 
 
 @router.post("/{project_id}/snippets/upload", response_model=schemas.CodeSnippetRead, status_code=201)
-async def upload_code_snippet_file(project: models.Project = Depends(require_project_role([ProjectRole.EDITOR, ProjectRole.OWNER])), upload_file: UploadFile = File(...), current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def upload_code_snippet_file(project_id: uuid.UUID = Depends(require_project_access([ProjectRole.EDITOR, ProjectRole.OWNER])), upload_file: UploadFile = File(...), current_user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_db)):
     max_size = MAX_FILE_SIZE_BYTES.get(current_user.role, MAX_FILE_SIZE_BYTES[UserRole.FREE_USER])
     file_contents = await upload_file.read()
     if len(file_contents) > max_size:
@@ -112,14 +190,11 @@ async def upload_code_snippet_file(project: models.Project = Depends(require_pro
     is_safe, message = scan_for_malware(file_contents)
     if not is_safe:
         raise HTTPException(status_code=400, detail=f"Malware scan failed: {message}")
-    return await crud.create_code_snippet(db=db, project_id=project.id, filename=upload_file.filename, content=file_contents.decode('utf-8'))
+    return await crud.create_code_snippet(db=db, project_id=project_id, filename=upload_file.filename, content=file_contents.decode('utf-8'))
 
 
-@router.post("/{project_id}/snippets/{snippet_id}/review", status_code=status.HTTP_202_ACCEPTED)
-async def submit_snippet_for_review(project_id: uuid.UUID, snippet_id: uuid.UUID, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db), redis: ArqRedis = Depends(get_redis_pool)):
-    project = await crud.get_project_by_id(db, project_id=project_id)
-    if not project or not any(member.user_id == current_user.id for member in project.member_associations):
-        raise HTTPException(status_code=403, detail="User is not a member of this project")
+@router.post("/{project_id}/snippets/{snippet_id}/review", status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(quota("reviews"))])
+async def submit_snippet_for_review(snippet_id: uuid.UUID, project_id: uuid.UUID = Depends(require_project_access([ProjectRole.VIEWER, ProjectRole.EDITOR, ProjectRole.OWNER])), current_user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_db), redis: ArqRedis = Depends(get_redis_pool)):
     snippet = await crud.get_snippet_by_id(db, snippet_id=snippet_id)
     if not snippet or snippet.project_id != project_id:
         raise HTTPException(status_code=404, detail="Snippet not found in this project")
@@ -131,7 +206,7 @@ async def submit_snippet_for_review(project_id: uuid.UUID, snippet_id: uuid.UUID
 @router.post("/{project_id}/snippets/bulk-delete", status_code=status.HTTP_200_OK, dependencies=[Depends(verify_csrf_token)])
 async def bulk_delete_snippets(
     delete_in: schemas.SnippetBulkDelete,
-    project: models.Project = Depends(require_project_role([ProjectRole.OWNER])),
+    project_id: uuid.UUID = Depends(require_project_access([ProjectRole.OWNER])),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -143,7 +218,7 @@ async def bulk_delete_snippets(
 
     deleted_count = await crud.delete_snippets_in_bulk(
         db=db,
-        project_id=project.id,
+        project_id=project_id,
         snippet_ids=delete_in.snippet_ids
     )
 
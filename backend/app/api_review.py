@@ -3,7 +3,8 @@ import uuid
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from . import crud, models, schemas
-from .dependencies import get_current_user
+from .dependencies import get_current_principal
+from .principal_cache import Principal
 from .database import get_db
 
 router = APIRouter()
@@ -13,7 +14,7 @@ async def submit_review_feedback(
     review_id: uuid.UUID,
     feedback_in: schemas.FeedbackCreate,
     db: AsyncSession = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """
     Allows a user to submit feedback for an AI-generated review.
@@ -1,15 +1,25 @@
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, status, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict
 
-from . import crud, models, schemas
-from .dependencies import get_current_user
-from .database import get_db
+from . import crud, models, schemas, etags, quotas
+from .dependencies import get_current_user, get_current_principal
+from .principal_cache import Principal
+from .database import get_db, AsyncSessionLocal
+from .cache_manager import get_or_compute, user_tag
 
 router = APIRouter()
 
 @router.get("/me", response_model=schemas.UserRead)
-async def get_own_profile(current_user: models.User = Depends(get_current_user)):
-    """Get the profile of the currently authenticated user."""
+async def get_own_profile(request: Request, response: Response, current_user: models.User = Depends(get_current_user)):
+    """
+    Get the profile of the currently authenticated user.
+    Supports If-None-Match: every profile change bumps `updated_at`, which the ETag is built from.
+    """
+    etag = etags.build_etag(str(current_user.id), current_user.updated_at.isoformat())
+    if etags.etag_matches(request, etag):
+        return etags.not_modified(etag)
+    response.headers["ETag"] = etag
     return current_user
 
 @router.get("/me/preferences", response_model=schemas.UserPreferences)
@@ -30,12 +40,29 @@ async def update_own_preferences(
 
 @router.get("/me/stats", response_model=schemas.UserStats)
 async def get_own_stats(
-    current_user: models.User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Get usage statistics for the currently authenticated user."""
-    stats = await crud.get_user_stats(db, user_id=current_user.id)
-    return stats
+    async def load_stats():
+        # Runs in its own session: a background refresh can outlive this request
+        async with AsyncSessionLocal() as session:
+            return await crud.get_user_stats(session, user_id=current_user.id)
+
+    # Single-flight + stale-while-revalidate, so TTL expiry doesn't stampede the DB
+    return await get_or_compute(
+        f"data_cache:user_stats:{current_user.id}",
+        load_stats,
+        ttl_seconds=300,
+        tags=[user_tag(current_user.id)],
+    )
+
+@router.get("/me/usage", response_model=Dict[str, Dict[str, schemas.QuotaWindowUsage]])
+async def get_own_usage(
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get the current daily and monthly quota usage of the authenticated user, per endpoint."""
+    return await quotas.get_usage(db, current_user)
 
 @router.delete("/me", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_own_account(
@@ -1,60 +1,63 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-import asyncio
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query
+from typing import Optional
+import re
 import uuid
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from . import models, crud
-from .dependencies import get_current_user_from_websocket
+from . import membership_cache
+from .dependencies import get_user_id_from_websocket
 from .websocket_manager import manager
 from .database import get_db
 
 router = APIRouter()
 
+# Redis Stream IDs look like "<milliseconds>-<sequence>"
+STREAM_EVENT_ID_PATTERN = re.compile(r"^\d+(-\d+)?$")
+
 
 @router.websocket("/ws/review/{review_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
     review_id: uuid.UUID,
+    last_event_id: Optional[str] = Query(None),
     db: AsyncSession = Depends(get_db),
-    current_user: models.User = Depends(get_current_user_from_websocket)
+    user_id: uuid.UUID = Depends(get_user_id_from_websocket)
 ):
     """
     Handles secure WebSocket connections for a specific code review.
     Now registers the connection for both review-specific and user-specific notifications.
+    Clients resuming after a reconnect pass `last_event_id` (the `event_id` of the
+    last update they saw) to replay only what they missed; fresh clients get the
+    review's full history before live updates.
     """
-    review = await crud.get_review_by_id(db, review_id=review_id)
-    if not review or not review.code_snippet:
+    # Both lookups are served from Redis in the common case, so a reconnect
+    # storm after a deploy doesn't turn into a flood of Postgres queries.
+    project_id = await membership_cache.get_review_project_id(db, review_id=review_id)
+    if project_id is None:
         await websocket.close(code=1011, reason="Review not found.")
         return
 
-    project = review.code_snippet.project
-    is_member = any(member.user_id == current_user.id for member in project.member_associations)
-    
-    if not is_member:
+    role = await membership_cache.get_project_role(db, project_id=project_id, user_id=user_id)
+    if role is None:
         await websocket.close(code=1008, reason="Not authorized")
         return
 
+    # On a cache miss the session checked out a pooled connection; hand it back
+    # now rather than holding it for the lifetime of the socket.
+    await db.close()
+
     # --- THIS IS THE KEY CHANGE ---
     # We now pass the user_id to the connect and disconnect methods.
-    await manager.connect(websocket, user_id=current_user.id, review_id=review_id)
-    
-    # Heartbeat mechanism to keep the connection alive and detect disconnects
-    async def pinger():
+    if last_event_id and not STREAM_EVENT_ID_PATTERN.match(last_event_id):
+        last_event_id = None
+    await manager.connect(websocket, user_id=user_id, review_id=review_id, last_event_id=last_event_id)
+
+    # Heartbeats are handled by the manager's shared sweeper; all this connection
+    # has to do is read until the socket closes. Client frames are ignored.
+    try:
         while True:
-            await asyncio.sleep(15)
-            await websocket.send_text("ping")
-
-    async def receiver():
-        await websocket.receive_text() # This will block until a message is received or connection closes
-
-    pinger_task = asyncio.create_task(pinger())
-    receiver_task = asyncio.create_task(receiver())
-
-    done, pending = await asyncio.wait(
-        [pinger_task, receiver_task], return_when=asyncio.FIRST_COMPLETED
-    )
-    for task in pending:
-        task.cancel()
-        
-    manager.disconnect(websocket, user_id=current_user.id, review_id=review_id)
-    # --- END OF KEY CHANGE -
\ No newline at end of file
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        manager.disconnect(websocket, user_id=user_id, review_id=review_id)
@@ -1,16 +1,37 @@
 # File: apex/backend/app/audit_logger.py
 
+import asyncio
+from collections import deque
+from datetime import datetime, timezone
 from fastapi import Request
-from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Optional, Dict, Any
+from sqlalchemy import insert
+from typing import Optional, Dict, Any, Deque, Union
 import uuid
 
-from . import crud, models
+from . import models
+from .database import AsyncSessionLocal
+from .principal_cache import Principal
+
+# Audit events are buffered in memory and written by a background flusher in
+# multi-row inserts, so logging a rejected request (failed login, 429, access
+# denied) costs an append instead of a database transaction.
+AUDIT_LOG_BUFFER_SIZE = 10_000
+AUDIT_LOG_BATCH_SIZE = 500
+AUDIT_LOG_FLUSH_INTERVAL_SECONDS = 1.0
+
+_buffer: Deque[Dict[str, Any]] = deque()
+# Created with the flusher, inside the running event loop
+_buffer_not_empty: Optional[asyncio.Event] = None
+flush_task: Optional[asyncio.Task] = None
+
+# Events dropped because the buffer was full (e.g. during a flood while the
+# database is down), and events written so far, for this process
+audit_stats: Dict[str, int] = {"written": 0, "dropped": 0}
+
 
 async def log_event(
-    db: AsyncSession,
     action: str,
-    user: Optional[models.User],
+    user: Optional[Union[models.User, Principal]],
     request: Optional[Request] = None,
     details: Optional[Dict[str, Any]] = None,
     resource_type: Optional[str] = None,
@@ -18,14 +39,80 @@ async def log_event(
 ):
     """
     A centralized function to create an audit log entry.
+    The entry is queued and written to the database in the next batch.
     """
-    user_id = user.id if user else None
-    await crud.create_audit_log(
-        db=db,
-        action=action,
-        user_id=user_id,
-        request=request,
-        details=details,
-        resource_type=resource_type,
-        resource_id=resource_id
-    )
\ No newline at end of file
+    if len(_buffer) >= AUDIT_LOG_BUFFER_SIZE:
+        audit_stats["dropped"] += 1
+        return
+    _buffer.append({
+        "user_id": user.id if user else None,
+        "action": action,
+        "ip_address": request.client.host if request and request.client else None,
+        "details": details,
+        "resource_type": resource_type,
+        "resource_id": resource_id,
+        # Taken now, not when the batch is written
+        "timestamp": datetime.now(timezone.utc),
+    })
+    if _buffer_not_empty is not None:
+        _buffer_not_empty.set()
+
+
+async def flush_audit_log() -> int:
+    """Writes up to one batch of buffered events in a single insert. Returns how many were written."""
+    batch = [_buffer.popleft() for _ in range(min(len(_buffer), AUDIT_LOG_BATCH_SIZE))]
+    if not batch:
+        return 0
+    try:
+        async with AsyncSessionLocal() as session:
+            await session.execute(insert(models.AuditLog), batch)
+            await session.commit()
+    except Exception:
+        # Put the batch back (oldest first) so the next flush retries it
+        _buffer.extendleft(reversed(batch))
+        while len(_buffer) > AUDIT_LOG_BUFFER_SIZE:
+            _buffer.pop()
+            audit_stats["dropped"] += 1
+        raise
+    audit_stats["written"] += len(batch)
+    return len(batch)
+
+
+async def _flush_loop():
+    while True:
+        await _buffer_not_empty.wait()
+        # Let a burst accumulate so it goes out as a few large inserts
+        await asyncio.sleep(AUDIT_LOG_FLUSH_INTERVAL_SECONDS)
+        _buffer_not_empty.clear()
+        try:
+            while await flush_audit_log():
+                pass
+        except Exception as e:
+            print(f"Error writing audit log batch: {e}")
+            _buffer_not_empty.set()
+
+
+async def start_audit_log_writer():
+    global flush_task, _buffer_not_empty
+    if flush_task is None:
+        _buffer_not_empty = asyncio.Event()
+        if _buffer:
+            _buffer_not_empty.set()
+        flush_task = asyncio.create_task(_flush_loop())
+
+
+async def stop_audit_log_writer():
+    """Stops the flusher and writes whatever is still buffered."""
+    global flush_task
+    if flush_task is not None:
+        flush_task.cancel()
+        try:
+            await flush_task
+        except asyncio.CancelledError:
+            pass
+        flush_task = None
+    try:
+        while await flush_audit_log():
+            pass
+    except Exception as e:
+        print(f"Error writing audit log on shutdown: {e}")
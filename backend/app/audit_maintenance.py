@@ -0,0 +1,158 @@
+# File: apex/backend/app/audit_maintenance.py
+
+# audit_logs is range-partitioned by UTC day (audit_logs_pYYYYMMDD), so old
+# history is dropped a whole partition at a time instead of with a DELETE,
+# and queries over a time window only touch the days they cover.
+# Security reports read hourly rollups instead of scanning raw events.
+
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import List
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import AsyncSessionLocal
+
+# Raw events are kept this long; rollups (a few rows per hour) much longer.
+AUDIT_LOG_RETENTION_DAYS = 90
+AUDIT_ROLLUP_RETENTION_DAYS = 400
+
+# Partitions always exist this far ahead, so inserts never land in the default partition.
+AUDIT_LOG_PARTITIONS_AHEAD_DAYS = 7
+
+# Each run recomputes this many of the most recent hourly buckets, which
+# covers events written late by the buffered audit log writer.
+AUDIT_ROLLUP_REFRESH_HOURS = 2
+
+# Actions counted per source IP in audit_ip_failure_rollups
+FAILURE_ACTIONS = ["LOGIN_FAILURE", "PROJECT_ACCESS_DENIED", "RATE_LIMIT_EXCEEDED", "QUOTA_EXCEEDED"]
+
+PARTITION_NAME_PATTERN = re.compile(r"^audit_logs_p(\d{8})$")
+
+AUDIT_LOG_COLUMNS = "id, user_id, action, resource_type, resource_id, details, ip_address, timestamp"
+
+
+def partition_name(day: date) -> str:
+    return f"audit_logs_p{day:%Y%m%d}"
+
+
+async def ensure_partitions(db: AsyncSession, today: date):
+    """
+    Creates the daily partitions from today until AUDIT_LOG_PARTITIONS_AHEAD_DAYS
+    from now. Postgres won't create a partition while the default partition
+    holds rows for its range, so any such rows are moved into the new partition
+    first. A day that still fails is logged and skipped; the next run retries it.
+    """
+    for offset in range(AUDIT_LOG_PARTITIONS_AHEAD_DAYS + 1):
+        day = today + timedelta(days=offset)
+        name = partition_name(day)
+        if await db.scalar(text("SELECT to_regclass(:name)"), {"name": name}) is not None:
+            continue
+        try:
+            async with db.begin_nested():
+                await _create_partition(db, day)
+        except SQLAlchemyError as e:
+            print(f"   -> ❌ Could not create audit log partition {name}: {e}")
+
+
+async def _create_partition(db: AsyncSession, day: date):
+    start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    bounds = {"start": start, "end": start + timedelta(days=1)}
+    in_range = "timestamp >= :start AND timestamp < :end"
+    stranded = await db.scalar(text(f"SELECT count(*) FROM audit_logs_default WHERE {in_range}"), bounds)
+    if stranded:
+        # Detached, the default partition no longer conflicts, and the rows
+        # copied back through the parent are routed to the new partition
+        await db.execute(text("ALTER TABLE audit_logs DETACH PARTITION audit_logs_default"))
+    await db.execute(text(
+        f"CREATE TABLE {partition_name(day)} PARTITION OF audit_logs "
+        f"FOR VALUES FROM ('{day.isoformat()} 00:00:00+00') TO ('{(day + timedelta(days=1)).isoformat()} 00:00:00+00')"
+    ))
+    if stranded:
+        await db.execute(text(
+            f"INSERT INTO audit_logs ({AUDIT_LOG_COLUMNS}) SELECT {AUDIT_LOG_COLUMNS} FROM audit_logs_default WHERE {in_range}"
+        ), bounds)
+        await db.execute(text(f"DELETE FROM audit_logs_default WHERE {in_range}"), bounds)
+        await db.execute(text("ALTER TABLE audit_logs ATTACH PARTITION audit_logs_default DEFAULT"))
+        print(f"   -> Moved {stranded} audit log rows from the default partition into {partition_name(day)}")
+
+
+async def drop_expired_partitions(db: AsyncSession, today: date) -> List[str]:
+    """Drops the daily partitions older than the retention period. Returns their names."""
+    result = await db.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "WHERE parent.relname = 'audit_logs'"
+    ))
+    cutoff = today - timedelta(days=AUDIT_LOG_RETENTION_DAYS)
+    dropped = []
+    for (name,) in result.all():
+        match = PARTITION_NAME_PATTERN.match(name)
+        if match and datetime.strptime(match.group(1), "%Y%m%d").date() < cutoff:
+            await db.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    await db.execute(
+        text("DELETE FROM audit_action_rollups WHERE bucket_start < :cutoff"),
+        {"cutoff": datetime.now(timezone.utc) - timedelta(days=AUDIT_ROLLUP_RETENTION_DAYS)},
+    )
+    await db.execute(
+        text("DELETE FROM audit_ip_failure_rollups WHERE bucket_start < :cutoff"),
+        {"cutoff": datetime.now(timezone.utc) - timedelta(days=AUDIT_ROLLUP_RETENTION_DAYS)},
+    )
+    return dropped
+
+
+async def refresh_rollups(db: AsyncSession, since: datetime, until: datetime):
+    """
+    Recomputes the hourly rollup buckets in [since, until) from the raw events.
+    Rebuilding whole buckets makes this idempotent, and partition pruning
+    keeps the cost proportional to the hours refreshed, not the table size.
+    """
+    window = {"since": since, "until": until}
+    await db.execute(text("DELETE FROM audit_action_rollups WHERE bucket_start >= :since AND bucket_start < :until"), window)
+    await db.execute(text(
+        "INSERT INTO audit_action_rollups (bucket_start, action, event_count) "
+        "SELECT date_trunc('hour', timestamp), action, count(*) FROM audit_logs "
+        "WHERE timestamp >= :since AND timestamp < :until "
+        "GROUP BY 1, 2"
+    ), window)
+    await db.execute(text("DELETE FROM audit_ip_failure_rollups WHERE bucket_start >= :since AND bucket_start < :until"), window)
+    await db.execute(text(
+        "INSERT INTO audit_ip_failure_rollups (bucket_start, action, ip_address, failure_count) "
+        "SELECT date_trunc('hour', timestamp), action, ip_address, count(*) FROM audit_logs "
+        "WHERE timestamp >= :since AND timestamp < :until "
+        "AND action = ANY(:actions) AND ip_address IS NOT NULL "
+        "GROUP BY 1, 2, 3"
+    ), {**window, "actions": FAILURE_ACTIONS})
+
+
+def current_hour() -> datetime:
+    return datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+async def refresh_recent_rollups():
+    """Brings the most recent hourly buckets, including the current one, up to date."""
+    until = current_hour() + timedelta(hours=1)
+    async with AsyncSessionLocal() as db:
+        await refresh_rollups(db, until - timedelta(hours=AUDIT_ROLLUP_REFRESH_HOURS), until)
+        await db.commit()
+
+
+async def run_audit_maintenance():
+    """
+    The hourly job: keeps partitions created ahead, drops expired ones, and
+    refreshes the recent rollups. Each step commits on its own.
+    """
+    today = datetime.now(timezone.utc).date()
+    async with AsyncSessionLocal() as db:
+        await ensure_partitions(db, today)
+        await db.commit()
+    async with AsyncSessionLocal() as db:
+        dropped = await drop_expired_partitions(db, today)
+        await db.commit()
+    if dropped:
+        print(f"   -> Dropped expired audit log partitions: {', '.join(dropped)}")
+    await refresh_recent_rollups()
@@ -0,0 +1,90 @@
+# File: apex/backend/app/cache_codecs.py
+
+# Encoding and compression for values stored in the Redis cache.
+#
+# Values are serialized as JSON (with orjson when it's installed) rather than a
+# binary format like msgpack, because the HTTP response cache serves stored
+# bodies straight to clients: JSON bytes can go out as-is, msgpack would have
+# to be re-encoded on every hit.
+#
+# Stored values start with a one-byte codec marker so any node can decode what
+# any other node wrote, whichever compression libraries each one has installed.
+
+import json
+import zlib
+from typing import Any, Callable, Dict, Tuple
+
+from .cache_config import CACHE_COMPRESSION_MIN_BYTES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+# --- JSON ---
+
+if orjson is not None:
+    def dumps_json(data: Any) -> bytes:
+        return orjson.dumps(data)
+
+    loads_json = orjson.loads
+else:
+    def dumps_json(data: Any) -> bytes:
+        return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+    loads_json = json.loads
+
+
+# --- Compression ---
+
+RAW = b"\x00"
+ZSTD = b"\x01"
+LZ4 = b"\x02"
+ZLIB = b"\x03"
+
+CODECS: Dict[bytes, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    ZLIB: (lambda data: zlib.compress(data, 6), zlib.decompress),
+}
+if lz4 is not None:
+    CODECS[LZ4] = (lz4.frame.compress, lz4.frame.decompress)
+if zstandard is not None:
+    _zstd_compressor = zstandard.ZstdCompressor(level=3)
+    _zstd_decompressor = zstandard.ZstdDecompressor()
+    CODECS[ZSTD] = (_zstd_compressor.compress, _zstd_decompressor.decompress)
+
+# The best codec available on this node is used for writing
+PREFERRED_CODEC = next(codec for codec in (ZSTD, LZ4, ZLIB) if codec in CODECS)
+
+
+def encode_payload(payload: bytes) -> bytes:
+    """Adds the codec marker, compressing payloads above the size threshold."""
+    if len(payload) >= CACHE_COMPRESSION_MIN_BYTES:
+        compress, _ = CODECS[PREFERRED_CODEC]
+        compressed = compress(payload)
+        if len(compressed) < len(payload):
+            return PREFERRED_CODEC + compressed
+    return RAW + payload
+
+
+def decode_payload(stored: bytes) -> bytes:
+    """Reverses encode_payload. Values written before codecs existed are plain JSON."""
+    marker, body = stored[:1], stored[1:]
+    if marker == RAW:
+        return body
+    if marker in CODECS:
+        _, decompress = CODECS[marker]
+        return decompress(body)
+    if marker in (ZSTD, LZ4):
+        raise ValueError("Cached value was compressed with a codec that isn't installed on this node")
+    return stored
@@ -0,0 +1,109 @@
+# File: apex/backend/app/cache_config.py
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ==============================================================================
+# 1. In-Process (Local) Cache Tier
+# ==============================================================================
+# An optional LRU in front of Redis for very hot keys. Entries only live for a
+# few seconds and are evicted on every node through a Redis pub/sub channel
+# whenever they are invalidated, so staleness stays bounded even if a message
+# is missed.
+LOCAL_CACHE_ENABLED = os.getenv("LOCAL_CACHE_ENABLED", "true").lower() == "true"
+
+# Bounds on the local tier, by entry count and by total (approximate) bytes.
+LOCAL_CACHE_MAX_ENTRIES = 10_000
+LOCAL_CACHE_MAX_BYTES = 32 * 1024 * 1024  # 32 MB
+
+# How long a value may be served from process memory.
+LOCAL_CACHE_TTL_SECONDS = 5
+
+# Channel used to tell every API process to drop its local copies.
+CACHE_INVALIDATION_CHANNEL = "cache_invalidation"
+
+
+# ==============================================================================
+# 2. Stampede Protection (get_or_compute)
+# ==============================================================================
+# Values stay in Redis for this long past their logical expiry, so an expired
+# value can still be served while a single worker recomputes it.
+STALE_WHILE_REVALIDATE_SECONDS = 60
+
+# Probabilistic early refresh ("XFetch"): the closer a value is to expiry, and
+# the longer it took to compute, the more likely a request refreshes it early.
+# 1.0 is the usual setting; higher values refresh earlier.
+EARLY_REFRESH_BETA = 1.0
+
+# Only one worker across all nodes recomputes a missing key. Others wait for
+# its result, and give up and compute it themselves after the wait timeout.
+COMPUTE_LOCK_TIMEOUT_SECONDS = 30
+COMPUTE_LOCK_WAIT_SECONDS = 5
+COMPUTE_LOCK_POLL_INTERVAL_SECONDS = 0.05
+
+
+# ==============================================================================
+# 3. Value Encoding
+# ==============================================================================
+# Cached values at least this large are compressed (zstd, then lz4, then
+# zlib, depending on what's installed). Smaller ones aren't worth the CPU.
+CACHE_COMPRESSION_MIN_BYTES = 1024
+
+
+# ==============================================================================
+# 4. HTTP Response Cache
+# ==============================================================================
+# Responses smaller than this go out uncompressed (shared with GZipMiddleware).
+RESPONSE_COMPRESSION_MIN_BYTES = 1000
+
+# Compressed variants of a cached response are built once per miss, in a
+# worker thread, and then served on every hit. Moderate levels keep a miss
+# cheap: brotli 11 / gzip 9 cost many times more CPU for a few percent smaller
+# JSON, and can take hundreds of ms on a large body.
+RESPONSE_GZIP_LEVEL = 6
+RESPONSE_BROTLI_QUALITY = 5
+
+
+# ==============================================================================
+# 5. Memory Budget and Admission
+# ==============================================================================
+# Redis runs with `noeviction` because db 0 holds the arq job queue, whose
+# payloads carry TTLs and must never be evicted. The cache keeps its own
+# entries within this budget instead.
+CACHE_MAX_BYTES = 96 * 1024 * 1024  # 96 MB
+
+# Memory Redis must have beyond CACHE_MAX_BYTES for everything the budget
+# doesn't count: the queue, tag sets and versions, authz entries, frequency
+# sketches, rate limit and quota counters, and review event streams. The API
+# checks maxmemory (and the eviction policy) against this on startup.
+CACHE_REDIS_HEADROOM_BYTES = 128 * 1024 * 1024  # 128 MB
+
+# When the budget is full, a new entry only displaces the least recently used
+# entries if it has been requested more often than each of them (TinyLFU).
+# These bound how much work a single write can do.
+CACHE_EVICTION_MAX_VICTIMS = 16
+CACHE_EVICTION_MAX_SCAN = 64
+
+# Request frequencies are counted in a count-min sketch. Counts from the
+# previous window are halved, so old popularity fades out.
+CACHE_FREQUENCY_SKETCH_DEPTH = 4
+CACHE_FREQUENCY_SKETCH_WIDTH = 16_384
+CACHE_FREQUENCY_WINDOW_SECONDS = 60 * 10
+
+
+# ==============================================================================
+# 6. Metrics
+# ==============================================================================
+# Upper bounds (in milliseconds) of the latency histogram buckets. Anything
+# slower lands in a final overflow bucket.
+CACHE_LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Hot keys are found by counting a random sample of reads, which keeps the
+# cost off most requests. The counter keeps roughly this many keys.
+CACHE_HOT_KEY_SAMPLE_RATE = 0.05
+CACHE_HOT_KEY_CAPACITY = 1000
+
+# The largest keys are found from a random sample of the tracked entries.
+CACHE_LARGEST_KEY_SAMPLE_SIZE = 1000
@@ -1,24 +1,49 @@
 # File: apex/backend/app/cache_manager.py
 import redis
+import redis.asyncio as aioredis
 import json
 import os
 from dotenv import load_dotenv
-from typing import Optional, Dict # <-- ADDED IMPORTS
+from typing import Optional, Dict, Iterable, Any, List, Tuple, Callable, Awaitable, Set # <-- ADDED IMPORTS
+from collections import OrderedDict
+import asyncio
+import math
+import random
+import time
+import uuid
+
+from .cache_config import (
+    LOCAL_CACHE_ENABLED, LOCAL_CACHE_MAX_ENTRIES, LOCAL_CACHE_MAX_BYTES,
+    LOCAL_CACHE_TTL_SECONDS, CACHE_INVALIDATION_CHANNEL,
+    STALE_WHILE_REVALIDATE_SECONDS, EARLY_REFRESH_BETA,
+    COMPUTE_LOCK_TIMEOUT_SECONDS, COMPUTE_LOCK_WAIT_SECONDS, COMPUTE_LOCK_POLL_INTERVAL_SECONDS,
+    CACHE_MAX_BYTES, CACHE_REDIS_HEADROOM_BYTES, CACHE_EVICTION_MAX_VICTIMS, CACHE_EVICTION_MAX_SCAN,
+    CACHE_FREQUENCY_SKETCH_DEPTH, CACHE_FREQUENCY_SKETCH_WIDTH, CACHE_FREQUENCY_WINDOW_SECONDS,
+)
+from .cache_codecs import dumps_json, loads_json, encode_payload, decode_payload
+from .cache_config import CACHE_LARGEST_KEY_SAMPLE_SIZE
+from .cache_metrics import key_prefix, prefix_metrics, route_metrics, hot_keys
 
 # Load environment variables
 load_dotenv()
 
 # Connect to the Redis Cache Database (db=1)
 REDIS_CACHE_URL = os.getenv("REDIS_CACHE_URL", "redis://localhost:6379/1")
-redis_client = redis.from_url(REDIS_CACHE_URL, decode_responses=True)
+# Cached values are stored as codec-encoded bytes (see cache_codecs.py)
+redis_client = redis.from_url(REDIS_CACHE_URL)
+
+# Async clients on the same cache database, for use inside the event loop:
+# one for cached values (bytes), one for bookkeeping like tags, versions and locks (strings)
+async_redis_bytes_client = aioredis.from_url(REDIS_CACHE_URL)
+async_redis_client = aioredis.from_url(REDIS_CACHE_URL, decode_responses=True)
 
 
 def set_cache(key: str, data: Dict, ttl_seconds: int = 3600):
     """
-    Stores data in the Redis cache as a JSON string with a TTL.
+    Stores data in the Redis cache as encoded JSON with a TTL.
     """
     try:
-        value = json.dumps(data)
+        value = encode_payload(dumps_json(data))
         redis_client.set(key, value, ex=ttl_seconds)
     except redis.exceptions.RedisError as e:
         print(f"Error setting cache for key {key}: {e}")
@@ -34,7 +59,7 @@ def get_cache(key: str) -> Optional[Dict]:
     try:
         cached_value = redis_client.get(key)
         if cached_value:
-            return json.loads(cached_value)
+            return loads_json(decode_payload(cached_value))
         return None
     except redis.exceptions.RedisError as e:
         print(f"Error getting cache for key {key}: {e}")
@@ -59,4 +84,769 @@ def invalidate_cache_by_pattern(pattern: str):
         for key in redis_client.scan_iter(match=pattern):
             redis_client.delete(key)
     except redis.exceptions.RedisError as e:
-        print(f"Error invalidating cache with pattern {pattern}: {e}")
\ No newline at end of file
+        print(f"Error invalidating cache with pattern {pattern}: {e}")
+
+
+# --- Async API (for use inside request handlers and middleware) ---
+# Entries can be tagged (e.g. "project:{id}", "user:{id}"). Each tag is a Redis
+# set of the keys that carry it, so a write can invalidate exactly the affected
+# entries without a SCAN over the keyspace.
+
+TAG_KEY_PREFIX = "cache_tag"
+
+# Every invalidation of a tag also rotates that tag's version token. ETags are
+# derived from these tokens, so "has this changed?" is a single MGET.
+TAG_VERSION_KEY_PREFIX = "cache_version"
+TAG_VERSION_TTL_SECONDS = 60 * 60 * 24 * 7
+
+# Version tokens are values of one global invalidation sequence, so a writer
+# can tell whether any tag was invalidated after a given point
+# (get_invalidation_seq) without knowing its tags in advance.
+CACHE_INVALIDATION_SEQ_KEY = "cache_meta:invalidation_seq"
+
+
+class LocalCache:
+    """
+    A small in-process LRU of cached values, bounded by entry count and by
+    total size. Values are the decoded (uncompressed) JSON bytes.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self.total_bytes = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            self.pop(key)
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: bytes, ttl_seconds: float):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        self.pop(key)
+        self.entries[key] = (value, time.monotonic() + min(ttl_seconds, self.ttl_seconds))
+        self.total_bytes += size
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            _, (evicted, _) = self.entries.popitem(last=False)
+            self.total_bytes -= len(evicted)
+
+    def pop(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= len(entry[0])
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+
+local_cache: Optional[LocalCache] = (
+    LocalCache(LOCAL_CACHE_MAX_ENTRIES, LOCAL_CACHE_MAX_BYTES, LOCAL_CACHE_TTL_SECONDS)
+    if LOCAL_CACHE_ENABLED else None
+)
+
+# Per-tier hit/miss counters for this process
+cache_stats: Dict[str, int] = {
+    "local_hits": 0, "local_misses": 0, "redis_hits": 0, "redis_misses": 0,
+    "admitted": 0, "rejected": 0, "evicted": 0, "stale_writes_discarded": 0,
+}
+
+invalidation_listener_task: Optional[asyncio.Task] = None
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Returns the per-tier counters along with hit rates and local tier usage."""
+    def hit_rate(hits: int, misses: int) -> Optional[float]:
+        total = hits + misses
+        return round(hits / total, 4) if total else None
+
+    return {
+        **cache_stats,
+        "local_hit_rate": hit_rate(cache_stats["local_hits"], cache_stats["local_misses"]),
+        "redis_hit_rate": hit_rate(cache_stats["redis_hits"], cache_stats["redis_misses"]),
+        "local_entries": len(local_cache.entries) if local_cache else 0,
+        "local_bytes": local_cache.total_bytes if local_cache else 0,
+    }
+
+
+# --- Memory budget ---
+# Every entry written through the async API is tracked in cache_meta:sizes
+# (key -> bytes), cache_meta:lru (key -> last access time) and the
+# cache_meta:bytes total. Admission and eviction run inside Lua scripts so
+# concurrent writers on different nodes can't overshoot the budget.
+# Only keys in this namespace are ever tracked, so nothing else in Redis can
+# be chosen as a victim.
+
+CACHE_META_KEY_PREFIX = "cache_meta"
+CACHE_SIZES_KEY = f"{CACHE_META_KEY_PREFIX}:sizes"
+CACHE_LRU_KEY = f"{CACHE_META_KEY_PREFIX}:lru"
+CACHE_BYTES_KEY = f"{CACHE_META_KEY_PREFIX}:bytes"
+
+_SKETCH_LUA = """
+local function sketch_fields(key, depth, width)
+    local digest = redis.sha1hex(key)
+    local fields = {}
+    for row = 0, depth - 1 do
+        local index = tonumber(string.sub(digest, row * 8 + 1, row * 8 + 8), 16) % width
+        fields[row + 1] = row .. ':' .. index
+    end
+    return fields
+end
+
+local function estimate(key, current, previous, depth, width)
+    local best = nil
+    for _, field in ipairs(sketch_fields(key, depth, width)) do
+        local count = tonumber(redis.call('hget', current, field) or 0)
+            + math.floor(tonumber(redis.call('hget', previous, field) or 0) / 2)
+        if best == nil or count < best then
+            best = count
+        end
+    end
+    return best
+end
+
+local function untrack(entry, sizes, lru, total)
+    local entry_size = redis.call('hget', sizes, entry)
+    if entry_size then
+        redis.call('decrby', total, entry_size)
+        redis.call('hdel', sizes, entry)
+    end
+    redis.call('zrem', lru, entry)
+end
+"""
+
+# Counts a request for a key and refreshes its recency if it's stored.
+# KEYS: entry, lru, current sketch   ARGV: now, depth, width, sketch ttl
+_touch_script = async_redis_bytes_client.register_script(_SKETCH_LUA + """
+local depth, width = tonumber(ARGV[2]), tonumber(ARGV[3])
+for _, field in ipairs(sketch_fields(KEYS[1], depth, width)) do
+    redis.call('hincrby', KEYS[3], field, 1)
+end
+redis.call('expire', KEYS[3], ARGV[4])
+redis.call('zadd', KEYS[2], 'XX', ARGV[1], KEYS[1])
+return 1
+""")
+
+# Stores an entry if it fits in the budget, or if it is requested more often
+# than each of the least recently used entries it would displace.
+# Returns {admitted, evicted keys...}.
+# KEYS: entry, sizes, lru, total, current sketch, previous sketch
+# ARGV: value, ttl, now, budget, depth, width, max victims, max scan
+_admit_script = async_redis_bytes_client.register_script(_SKETCH_LUA + """
+local key, sizes, lru, total = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local size = string.len(ARGV[1]) + string.len(key)
+local budget = tonumber(ARGV[4])
+local depth, width = tonumber(ARGV[5]), tonumber(ARGV[6])
+local max_victims, max_scan = tonumber(ARGV[7]), tonumber(ARGV[8])
+
+local used = tonumber(redis.call('get', total) or 0)
+local needed = used - tonumber(redis.call('hget', sizes, key) or 0) + size - budget
+local admitted = size <= budget
+local victims = {}
+
+if admitted and needed > 0 then
+    local frequency = estimate(key, KEYS[5], KEYS[6], depth, width)
+    for _, candidate in ipairs(redis.call('zrange', lru, 0, max_scan - 1)) do
+        if needed <= 0 then
+            break
+        end
+        if candidate ~= key then
+            local candidate_size = tonumber(redis.call('hget', sizes, candidate) or 0)
+            if redis.call('exists', candidate) == 0 then
+                -- Expired or invalidated, so its space can be reclaimed outright
+                untrack(candidate, sizes, lru, total)
+            elseif #victims < max_victims and estimate(candidate, KEYS[5], KEYS[6], depth, width) < frequency then
+                table.insert(victims, candidate)
+            else
+                admitted = false
+                break
+            end
+            needed = needed - candidate_size
+        end
+    end
+    admitted = admitted and needed <= 0
+end
+
+-- Whatever happens, an older value of this key must not outlive the write
+untrack(key, sizes, lru, total)
+if not admitted then
+    redis.call('del', key)
+    return {0}
+end
+
+for _, victim in ipairs(victims) do
+    redis.call('del', victim)
+    untrack(victim, sizes, lru, total)
+end
+redis.call('set', key, ARGV[1], 'EX', ARGV[2])
+redis.call('hset', sizes, key, size)
+redis.call('incrby', total, size)
+redis.call('zadd', lru, ARGV[3], key)
+table.insert(victims, 1, 1)
+return victims
+""")
+
+# Moves tags to the next value of the invalidation sequence.
+# KEYS: sequence, tag versions...   ARGV: version ttl
+_bump_tag_versions_script = async_redis_client.register_script("""
+local seq = redis.call('incr', KEYS[1])
+for i = 2, #KEYS do
+    redis.call('set', KEYS[i], seq, 'EX', ARGV[1])
+end
+return seq
+""")
+
+# Returns tag versions, seeding missing ones with the current sequence value.
+# KEYS: sequence, tag versions...   ARGV: version ttl
+_seed_tag_versions_script = async_redis_client.register_script("""
+local seq = redis.call('get', KEYS[1]) or '0'
+local versions = {}
+for i = 2, #KEYS do
+    redis.call('set', KEYS[i], seq, 'EX', ARGV[1], 'NX')
+    versions[i - 1] = redis.call('get', KEYS[i])
+end
+return versions
+""")
+
+# Stops tracking keys that were deleted outside the admission script.
+# KEYS: sizes, lru, total   ARGV: the deleted keys
+_untrack_script = async_redis_client.register_script(_SKETCH_LUA + """
+for _, entry in ipairs(ARGV) do
+    untrack(entry, KEYS[1], KEYS[2], KEYS[3])
+end
+return #ARGV
+""")
+
+
+def _sketch_keys() -> Tuple[str, str]:
+    """The frequency sketches for the current and previous windows."""
+    window = int(time.time() // CACHE_FREQUENCY_WINDOW_SECONDS)
+    return f"{CACHE_META_KEY_PREFIX}:freq:{window}", f"{CACHE_META_KEY_PREFIX}:freq:{window - 1}"
+
+
+async def get_cache_budget_usage() -> Optional[Dict[str, int]]:
+    """Returns the bytes and entries currently tracked against the budget."""
+    try:
+        pipe = async_redis_client.pipeline(transaction=False)
+        pipe.get(CACHE_BYTES_KEY)
+        pipe.zcard(CACHE_LRU_KEY)
+        used_bytes, entries = await pipe.execute()
+        return {"budget_bytes": CACHE_MAX_BYTES, "used_bytes": int(used_bytes or 0), "entries": entries}
+    except redis.exceptions.RedisError as e:
+        print(f"Error reading cache budget usage: {e}")
+        return None
+
+
+async def sample_largest_keys(top_n: int) -> List[Dict[str, Any]]:
+    """
+    The largest entries in a random sample of the tracked keys. Sampling keeps
+    this to a single bounded HRANDFIELD, however many keys there are.
+    """
+    try:
+        sample = await async_redis_client.hrandfield(CACHE_SIZES_KEY, CACHE_LARGEST_KEY_SAMPLE_SIZE, withvalues=True)
+    except redis.exceptions.RedisError as e:
+        print(f"Error sampling cache key sizes: {e}")
+        return []
+    sizes = [(key, int(size)) for key, size in zip(sample[::2], sample[1::2])]
+    sizes.sort(key=lambda item: item[1], reverse=True)
+    return [{"key": key, "bytes": size} for key, size in sizes[:top_n]]
+
+
+async def get_cache_report(top_n: int = 20) -> Dict[str, Any]:
+    """
+    Everything needed to tune TTLs and memory: hit ratios, latencies and
+    write/eviction counts per key prefix and per route, budget usage, and
+    the hottest and largest keys. Counters are for this process only.
+    """
+    return {
+        "totals": get_cache_stats(),
+        "budget": await get_cache_budget_usage(),
+        "prefixes": prefix_metrics.snapshot(),
+        "routes": route_metrics.snapshot(),
+        "hottest_keys": hot_keys.top(top_n),
+        "largest_keys": await sample_largest_keys(top_n),
+    }
+
+
+def project_tag(project_id: uuid.UUID) -> str:
+    return f"project:{project_id}"
+
+
+def user_tag(user_id: uuid.UUID) -> str:
+    return f"user:{user_id}"
+
+
+def _tag_key(tag: str) -> str:
+    return f"{TAG_KEY_PREFIX}:{tag}"
+
+
+def _tag_version_key(tag: str) -> str:
+    return f"{TAG_VERSION_KEY_PREFIX}:{tag}"
+
+
+async def get_cache_bytes_async(key: str) -> Optional[bytes]:
+    """
+    Returns the stored payload for a key, decompressed but not parsed.
+    Checks the in-process tier first, then Redis.
+    Returns None if the key does not exist or an error occurs.
+    """
+    started = time.perf_counter()
+    cached_value, outcome = await _read_cache_bytes(key)
+    prefix = key_prefix(key)
+    prefix_metrics.increment(prefix, outcome)
+    prefix_metrics.increment(prefix, "hits" if cached_value is not None else "misses")
+    prefix_metrics.observe(prefix, "read", (time.perf_counter() - started) * 1000)
+    hot_keys.record(key)
+    return cached_value
+
+
+async def _read_cache_bytes(key: str) -> Tuple[Optional[bytes], str]:
+    """Returns the payload (or None) and which tier answered: local_hits, redis_hits, redis_misses or errors."""
+    if local_cache is not None:
+        cached_value = local_cache.get(key)
+        if cached_value is not None:
+            cache_stats["local_hits"] += 1
+            return cached_value, "local_hits"
+        cache_stats["local_misses"] += 1
+
+    try:
+        current_sketch, _ = _sketch_keys()
+        pipe = async_redis_bytes_client.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.pttl(key)
+        await _touch_script(
+            keys=[key, CACHE_LRU_KEY, current_sketch],
+            args=[time.time(), CACHE_FREQUENCY_SKETCH_DEPTH, CACHE_FREQUENCY_SKETCH_WIDTH, 2 * CACHE_FREQUENCY_WINDOW_SECONDS],
+            client=pipe,
+        )
+        stored_value, ttl_millis, _ = await pipe.execute()
+        if stored_value:
+            cache_stats["redis_hits"] += 1
+            cached_value = decode_payload(stored_value)
+            if local_cache is not None and ttl_millis and ttl_millis > 0:
+                local_cache.set(key, cached_value, ttl_millis / 1000)
+            return cached_value, "redis_hits"
+        cache_stats["redis_misses"] += 1
+        return None, "redis_misses"
+    except redis.exceptions.RedisError as e:
+        print(f"Error getting cache for key {key}: {e}")
+        return None, "errors"
+
+
+async def get_cache_async(key: str) -> Optional[Any]:
+    """
+    Async version of get_cache.
+    Returns None if the key does not exist or an error occurs.
+    """
+    cached_value = await get_cache_bytes_async(key)
+    if cached_value is None:
+        return None
+    return loads_json(cached_value)
+
+
+async def set_cache_async(key: str, data: Any, ttl_seconds: int = 3600, tags: Iterable[str] = ()):
+    """
+    Async version of set_cache that also records the key under each tag.
+    """
+    await set_cache_bytes_async(key, dumps_json(data), ttl_seconds=ttl_seconds, tags=tags)
+
+
+async def set_cache_bytes_async(key: str, payload: bytes, ttl_seconds: int = 3600, tags: Iterable[str] = ()):
+    """
+    Stores an already-serialized payload (compressed above the size threshold)
+    and records the key under each tag.
+    """
+    await set_many_cache_bytes_async({key: payload}, ttl_seconds=ttl_seconds, tags=tags)
+
+
+async def set_many_cache_bytes_async(
+    payloads: Dict[str, bytes],
+    ttl_seconds: int = 3600,
+    tags: Iterable[str] = (),
+    unchanged_since: Optional[int] = None,
+):
+    """
+    Stores several already-serialized payloads that share a TTL and tags in
+    one round trip, and records every key under each tag.
+    Each payload goes through admission against the cache's memory budget,
+    so a payload may not be stored at all.
+    Tag sets expire with the entries they point at, so they never outlive them.
+    With `unchanged_since` (from get_invalidation_seq, read before the payloads
+    were computed), the entries are dropped again if any of their tags was
+    invalidated since, so a value computed before a write is never served after it.
+    """
+    tags = list(tags)
+    try:
+        current_sketch, previous_sketch = _sketch_keys()
+        now = time.time()
+        pipe = async_redis_bytes_client.pipeline(transaction=True)
+        for key, payload in payloads.items():
+            await _admit_script(
+                keys=[key, CACHE_SIZES_KEY, CACHE_LRU_KEY, CACHE_BYTES_KEY, current_sketch, previous_sketch],
+                args=[
+                    encode_payload(payload), ttl_seconds, now, CACHE_MAX_BYTES,
+                    CACHE_FREQUENCY_SKETCH_DEPTH, CACHE_FREQUENCY_SKETCH_WIDTH,
+                    CACHE_EVICTION_MAX_VICTIMS, CACHE_EVICTION_MAX_SCAN,
+                ],
+                client=pipe,
+            )
+        for tag in tags:
+            tag_key = _tag_key(tag)
+            pipe.sadd(tag_key, *payloads)
+            pipe.expire(tag_key, ttl_seconds, gt=True)
+            pipe.expire(tag_key, ttl_seconds, nx=True)
+        results = await pipe.execute()
+
+        evicted = []
+        for (key, payload), (admitted, *victims) in zip(payloads.items(), results):
+            evicted.extend(victim.decode() for victim in victims)
+            prefix = key_prefix(key)
+            prefix_metrics.increment(prefix, "writes")
+            if admitted:
+                cache_stats["admitted"] += 1
+                prefix_metrics.increment(prefix, "bytes_written", len(payload))
+                if local_cache is not None:
+                    local_cache.set(key, payload, ttl_seconds)
+            else:
+                cache_stats["rejected"] += 1
+                prefix_metrics.increment(prefix, "rejections")
+                if local_cache is not None:
+                    local_cache.pop(key)
+        if evicted:
+            cache_stats["evicted"] += len(evicted)
+            for victim in evicted:
+                prefix_metrics.increment(key_prefix(victim), "evictions")
+            await _evict_everywhere(evicted)
+
+        # Checked after the write: an invalidation that ran before this check
+        # shows in the versions, and one that runs after it finds the keys in
+        # the tag sets and deletes them itself
+        if unchanged_since is not None and tags:
+            versions = await async_redis_client.mget([_tag_version_key(tag) for tag in tags])
+            if any(_version_seq(version) > unchanged_since for version in versions):
+                cache_stats["stale_writes_discarded"] += 1
+                await _delete_entries(list(payloads))
+    except redis.exceptions.RedisError as e:
+        print(f"Error setting cache for keys {list(payloads)}: {e}")
+
+
+async def _delete_entries(keys: List[str]):
+    await async_redis_client.delete(*keys)
+    await _untrack_script(keys=[CACHE_SIZES_KEY, CACHE_LRU_KEY, CACHE_BYTES_KEY], args=keys)
+    await _evict_everywhere(keys)
+
+
+def _version_seq(version: Optional[str]) -> int:
+    """The sequence value of a version token. Tokens from before the sequence existed count as 0."""
+    try:
+        return int(version)
+    except (TypeError, ValueError):
+        return 0
+
+
+async def get_invalidation_seq() -> Optional[int]:
+    """
+    The current value of the invalidation sequence; pass it to
+    set_many_cache_bytes_async as `unchanged_since`. None if Redis is unavailable.
+    """
+    try:
+        return _version_seq(await async_redis_client.get(CACHE_INVALIDATION_SEQ_KEY))
+    except redis.exceptions.RedisError as e:
+        print(f"Error reading cache invalidation sequence: {e}")
+        return None
+
+
+async def invalidate_cache_tags(tags: Iterable[str]):
+    """
+    Deletes every cache entry carrying any of the given tags, plus the tag sets themselves.
+    """
+    tags = list(tags)
+    tag_keys = [_tag_key(tag) for tag in tags]
+    if not tag_keys:
+        return
+    try:
+        # Versions move before the tag sets are read, so a concurrent
+        # conditional write either sees the new versions or lands in a set
+        pipe = async_redis_client.pipeline(transaction=True)
+        await _bump_tag_versions_script(
+            keys=[CACHE_INVALIDATION_SEQ_KEY] + [_tag_version_key(tag) for tag in tags],
+            args=[TAG_VERSION_TTL_SECONDS],
+            client=pipe,
+        )
+        for tag_key in tag_keys:
+            pipe.smembers(tag_key)
+        members = (await pipe.execute())[1:]
+
+        keys_to_delete = set(tag_keys)
+        for tagged_keys in members:
+            keys_to_delete.update(tagged_keys)
+        entry_keys = list(keys_to_delete - set(tag_keys))
+        await async_redis_client.delete(*keys_to_delete)
+        if entry_keys:
+            await _untrack_script(keys=[CACHE_SIZES_KEY, CACHE_LRU_KEY, CACHE_BYTES_KEY], args=entry_keys)
+        await _evict_everywhere(entry_keys)
+    except redis.exceptions.RedisError as e:
+        print(f"Error invalidating cache tags {tag_keys}: {e}")
+
+
+async def get_tag_versions(tags: List[str]) -> Optional[List[str]]:
+    """
+    Returns the current version token of each tag, seeding tags that don't
+    have one yet with the current invalidation sequence value. The sequence
+    only grows, so a re-seeded tag never repeats a token from before a change.
+    Returns None if Redis is unavailable.
+    """
+    version_keys = [_tag_version_key(tag) for tag in tags]
+    if not version_keys:
+        return []
+    try:
+        versions = await async_redis_client.mget(version_keys)
+        if any(version is None for version in versions):
+            versions = await _seed_tag_versions_script(
+                keys=[CACHE_INVALIDATION_SEQ_KEY] + version_keys, args=[TAG_VERSION_TTL_SECONDS]
+            )
+        return versions
+    except redis.exceptions.RedisError as e:
+        print(f"Error reading cache tag versions: {e}")
+        return None
+
+
+# --- Stampede protection ---
+# get_or_compute stores {"value", "expires_at", "delta"} envelopes. "delta" is how
+# long the value took to compute, which drives probabilistic early refresh.
+
+COMPUTE_LOCK_KEY_PREFIX = "cache_lock"
+
+# Deletes the lock only if we still hold it
+_release_lock_script = async_redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+""")
+
+# Computations running in this process, so concurrent local requests share one
+_inflight: Dict[str, asyncio.Task] = {}
+_refreshing: Set[str] = set()
+
+
+async def get_or_compute(
+    key: str,
+    compute: Callable[[], Awaitable[Any]],
+    ttl_seconds: int = 300,
+    tags: Iterable[str] = (),
+) -> Any:
+    """
+    Returns the cached value for `key`, computing it with `compute()` if needed.
+    - On a miss, only one worker across all nodes runs `compute()`; the rest wait for its result.
+    - Near expiry, a request may refresh the value early, in the background.
+    - Past expiry (within the stale window), the old value is served while one worker refreshes it.
+    `compute` must not depend on the calling request's DB session, since refreshes
+    can outlive the request.
+    """
+    tags = list(tags)
+    entry = await get_cache_async(key)
+    if entry is not None:
+        if _should_refresh_early(entry):
+            _schedule_refresh(key, compute, ttl_seconds, tags)
+        return entry["value"]
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_compute_single_flight(key, compute, ttl_seconds, tags))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+
+def _should_refresh_early(entry: Dict[str, Any]) -> bool:
+    """XFetch: always true once expired, increasingly likely as expiry approaches."""
+    jitter = -entry["delta"] * EARLY_REFRESH_BETA * math.log(1.0 - random.random())
+    return time.time() + jitter >= entry["expires_at"]
+
+
+async def _compute_and_store(key: str, compute: Callable[[], Awaitable[Any]], ttl_seconds: int, tags: List[str]) -> Any:
+    started = time.monotonic()
+    value = await compute()
+    entry = {"value": value, "expires_at": time.time() + ttl_seconds, "delta": time.monotonic() - started}
+    await set_cache_async(key, entry, ttl_seconds=ttl_seconds + STALE_WHILE_REVALIDATE_SECONDS, tags=tags)
+    return value
+
+
+async def _acquire_compute_lock(key: str) -> Optional[str]:
+    """Returns a lock token if we now own the recompute for `key`, otherwise None."""
+    token = uuid.uuid4().hex
+    acquired = await async_redis_client.set(
+        f"{COMPUTE_LOCK_KEY_PREFIX}:{key}", token, nx=True, ex=COMPUTE_LOCK_TIMEOUT_SECONDS
+    )
+    return token if acquired else None
+
+
+async def _release_compute_lock(key: str, token: str):
+    try:
+        await _release_lock_script(keys=[f"{COMPUTE_LOCK_KEY_PREFIX}:{key}"], args=[token])
+    except redis.exceptions.RedisError as e:
+        print(f"Error releasing compute lock for key {key}: {e}")
+
+
+async def _compute_single_flight(key: str, compute: Callable[[], Awaitable[Any]], ttl_seconds: int, tags: List[str]) -> Any:
+    try:
+        token = await _acquire_compute_lock(key)
+    except redis.exceptions.RedisError as e:
+        print(f"Error acquiring compute lock for key {key}: {e}")
+        return await compute()
+
+    if token:
+        try:
+            return await _compute_and_store(key, compute, ttl_seconds, tags)
+        finally:
+            await _release_compute_lock(key, token)
+
+    # Another node is computing this key; wait for its result to land. If it
+    # releases the lock without storing anything (its compute raised, or
+    # admission turned the value away), there is nothing left to wait for.
+    deadline = time.monotonic() + COMPUTE_LOCK_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        await asyncio.sleep(COMPUTE_LOCK_POLL_INTERVAL_SECONDS)
+        entry, locked = await _poll_computed_entry(key)
+        if entry is not None:
+            return entry["value"]
+        if not locked:
+            break
+
+    # The other worker failed, is too slow or died; don't make the caller wait any longer
+    return await _compute_and_store(key, compute, ttl_seconds, tags)
+
+
+async def _poll_computed_entry(key: str) -> Tuple[Optional[Any], bool]:
+    """
+    Returns the stored entry (or None) and whether the compute lock is still
+    held. A plain read: polling doesn't count towards the key's admission
+    frequency or metrics, since the waiting request was already counted.
+    """
+    try:
+        pipe = async_redis_bytes_client.pipeline(transaction=True)
+        pipe.get(key)
+        pipe.exists(f"{COMPUTE_LOCK_KEY_PREFIX}:{key}")
+        stored_value, locked = await pipe.execute()
+    except redis.exceptions.RedisError as e:
+        print(f"Error polling computed value for key {key}: {e}")
+        return None, True
+    if not stored_value:
+        return None, bool(locked)
+    return loads_json(decode_payload(stored_value)), bool(locked)
+
+
+def _schedule_refresh(key: str, compute: Callable[[], Awaitable[Any]], ttl_seconds: int, tags: List[str]):
+    """Refreshes `key` in the background unless this process or another node already is."""
+    if key in _refreshing:
+        return
+    _refreshing.add(key)
+
+    async def refresh():
+        try:
+            token = await _acquire_compute_lock(key)
+            if not token:
+                return
+            try:
+                await _compute_and_store(key, compute, ttl_seconds, tags)
+            finally:
+                await _release_compute_lock(key, token)
+        except Exception as e:
+            print(f"Error refreshing cache for key {key}: {e}")
+        finally:
+            _refreshing.discard(key)
+
+    asyncio.create_task(refresh())
+
+
+# --- Local tier invalidation over pub/sub ---
+
+async def _evict_everywhere(keys: Iterable[str]):
+    """Drops keys from this process's local tier and tells every other node to do the same."""
+    keys = list(keys)
+    if not keys:
+        return
+    if local_cache is not None:
+        for key in keys:
+            local_cache.pop(key)
+    await async_redis_client.publish(CACHE_INVALIDATION_CHANNEL, json.dumps(keys))
+
+
+async def evict_local_copies(keys: Iterable[str]):
+    """
+    Evicts keys from the local tier on every node, for callers that keep
+    their own values in it (e.g. the principal cache).
+    """
+    try:
+        await _evict_everywhere(keys)
+    except redis.exceptions.RedisError as e:
+        print(f"Error publishing local cache eviction: {e}")
+
+
+async def _invalidation_listener():
+    """Evicts local copies of keys that another node has invalidated."""
+    pubsub = async_redis_client.pubsub()
+    await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+
+    while True:
+        try:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if not message: continue
+            for key in json.loads(message["data"]):
+                local_cache.pop(key)
+        except (asyncio.CancelledError, ConnectionError):
+            break
+        except Exception as e:
+            print(f"Error in cache invalidation listener: {e}")
+            # We may have missed evictions; start the local tier over
+            local_cache.clear()
+            await asyncio.sleep(1)
+
+
+async def check_redis_memory():
+    """
+    Called on app startup. Refuses to run against a Redis that could evict
+    queued jobs, or whose maxmemory leaves less than CACHE_REDIS_HEADROOM_BYTES
+    beyond the cache budget for everything else. Skipped (with a warning) if
+    the server doesn't allow CONFIG GET, e.g. some managed offerings.
+    """
+    try:
+        config = await async_redis_client.config_get("maxmemory*")
+    except redis.exceptions.RedisError as e:
+        print(f"Could not read Redis memory settings, skipping the headroom check: {e}")
+        return
+
+    policy = config.get("maxmemory-policy")
+    if policy != "noeviction":
+        raise ValueError(f"Redis maxmemory-policy must be noeviction (the job queue can't be evicted), not {policy}")
+    maxmemory = int(config.get("maxmemory", 0))
+    required = CACHE_MAX_BYTES + CACHE_REDIS_HEADROOM_BYTES
+    # 0 means no limit
+    if maxmemory and maxmemory < required:
+        raise ValueError(
+            f"Redis maxmemory ({maxmemory} bytes) must be at least CACHE_MAX_BYTES + "
+            f"CACHE_REDIS_HEADROOM_BYTES ({required} bytes)"
+        )
+
+
+async def start_invalidation_listener():
+    """Called on app startup when the local tier is enabled."""
+    global invalidation_listener_task
+    if local_cache is not None:
+        invalidation_listener_task = asyncio.create_task(_invalidation_listener())
+
+
+async def stop_invalidation_listener():
+    if invalidation_listener_task:
+        invalidation_listener_task.cancel()
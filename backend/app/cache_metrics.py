@@ -0,0 +1,137 @@
+# File: apex/backend/app/cache_metrics.py
+
+# In-process cache metrics: counters and latency histograms per key prefix
+# (for cache_manager) and per route (for ResponseCacheMiddleware), plus a
+# sampled hot-key counter. Every API process keeps its own numbers.
+
+import heapq
+import random
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from .cache_config import CACHE_LATENCY_BUCKETS_MS, CACHE_HOT_KEY_SAMPLE_RATE, CACHE_HOT_KEY_CAPACITY
+
+# Key segments that identify one resource rather than a kind of resource
+ID_SEGMENT_PATTERN = re.compile(r"^(?=.*\d)[0-9a-fA-F-]{8,}$|^\d+$")
+
+
+def key_prefix(key: str) -> str:
+    """
+    Groups a cache key by its leading, non-ID segments, e.g.
+    "data_cache:user_stats:{user_id}" -> "data_cache:user_stats".
+    """
+    segments = []
+    for segment in key.split(":"):
+        if ID_SEGMENT_PATTERN.match(segment):
+            break
+        segments.append(segment)
+    return ":".join(segments) or key
+
+
+# Route label for requests that match no route (404s, probes), so they can't
+# grow the per-route metrics without bound
+UNMATCHED_ROUTE_LABEL = "<unmatched>"
+
+
+class LatencyHistogram:
+    """Counts observations into fixed millisecond buckets."""
+
+    def __init__(self):
+        self.counts = [0] * (len(CACHE_LATENCY_BUCKETS_MS) + 1)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, duration_ms: float):
+        self.counts[bisect_left(CACHE_LATENCY_BUCKETS_MS, duration_ms)] += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """The upper bound of the bucket holding the given percentile (the maximum, past the last bucket)."""
+        total = sum(self.counts)
+        if not total:
+            return None
+        threshold = fraction * total
+        seen = 0
+        for bound, count in zip(CACHE_LATENCY_BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= threshold:
+                return bound
+        return round(self.max_ms, 3)
+
+    def snapshot(self) -> Dict[str, Any]:
+        total = sum(self.counts)
+        return {
+            "count": total,
+            "mean_ms": round(self.total_ms / total, 3) if total else None,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max_ms, 3),
+            "buckets": {
+                **{f"le_{bound}": count for bound, count in zip(CACHE_LATENCY_BUCKETS_MS, self.counts)},
+                "overflow": self.counts[-1],
+            },
+        }
+
+
+class MetricGroup:
+    """Named counters and named latency histograms per label."""
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.latencies: Dict[str, Dict[str, LatencyHistogram]] = defaultdict(lambda: defaultdict(LatencyHistogram))
+
+    def increment(self, label: str, counter: str, amount: int = 1):
+        self.counters[label][counter] += amount
+
+    def observe(self, label: str, histogram: str, duration_ms: float):
+        self.latencies[label][histogram].observe(duration_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        report = {}
+        for label in sorted(set(self.counters) | set(self.latencies)):
+            counters = dict(self.counters.get(label, {}))
+            hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+            report[label] = {
+                **counters,
+                "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None,
+                "latency": {
+                    name: histogram.snapshot() for name, histogram in self.latencies.get(label, {}).items()
+                },
+            }
+        return report
+
+
+class HotKeyCounter:
+    """
+    Approximate counts of the most-read keys, from a random sample of reads.
+    When it holds twice its capacity, it keeps the top half and halves their
+    counts, so the cost is amortized and old hot keys fade out.
+    """
+
+    def __init__(self, sample_rate: float, capacity: int):
+        self.sample_rate = sample_rate
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+
+    def record(self, key: str):
+        if random.random() >= self.sample_rate:
+            return
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if len(self.counts) > 2 * self.capacity:
+            top = heapq.nlargest(self.capacity, self.counts.items(), key=lambda item: item[1])
+            self.counts = {key: count // 2 for key, count in top if count > 1}
+
+    def top(self, n: int) -> List[Dict[str, Any]]:
+        """The n hottest keys, with their estimated read counts."""
+        top = heapq.nlargest(n, self.counts.items(), key=lambda item: item[1])
+        return [{"key": key, "estimated_reads": round(count / self.sample_rate)} for key, count in top]
+
+
+# cache_manager records per key prefix, ResponseCacheMiddleware per route
+prefix_metrics = MetricGroup()
+route_metrics = MetricGroup()
+hot_keys = HotKeyCounter(CACHE_HOT_KEY_SAMPLE_RATE, CACHE_HOT_KEY_CAPACITY)
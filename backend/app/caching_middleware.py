@@ -1,10 +1,25 @@
-import json
+import asyncio
+import gzip
+import re
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
 from fastapi import Request, Response
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import StreamingResponse
+from starlette.routing import Match
+from jose import JWTError, jwt
 import hashlib
 
-from .cache_manager import get_cache, set_cache
+from . import security, etags
+from .cache_manager import get_cache_bytes_async, set_many_cache_bytes_async, get_invalidation_seq, project_tag, user_tag
+from .cache_codecs import loads_json
+from .cache_config import RESPONSE_COMPRESSION_MIN_BYTES, RESPONSE_GZIP_LEVEL, RESPONSE_BROTLI_QUALITY
+from .cache_metrics import route_metrics, UNMATCHED_ROUTE_LABEL
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Define which URL paths we want to apply caching to.
 CACHEABLE_PATHS = [
@@ -12,6 +27,120 @@ CACHEABLE_PATHS = [
     "/users/me/stats",
 ]
 
+# Matches project-scoped paths like /projects/{id} and /projects/{id}/members
+PROJECT_PATH_PATTERN = re.compile(r"^/projects/([0-9a-fA-F-]{36})(/|$)")
+
+CACHE_TTL_SECONDS = 300
+
+# Each response is cached once per content encoding, under
+# "<key>:<encoding>", as b"<etag>\n<content-encoding>\n<body>". A hit is
+# served straight from the stored bytes, with no JSON or compression work.
+# Bodies too small to compress are only stored under "<key>:identity", which
+# also answers requests for the other encodings.
+ENTRY_SEPARATOR = b"\n"
+
+IDENTITY = "identity"
+# Encodings we cache variants for, most preferred first
+RESPONSE_ENCODINGS = (["br"] if brotli is not None else []) + ["gzip"]
+
+
+def _get_principal_id(request: Request) -> Optional[uuid.UUID]:
+    """
+    Returns the user ID from the request's bearer token, or None if there isn't
+    a valid one. Requests without a principal are never cached.
+    """
+    authorization = request.headers.get("Authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
+        return uuid.UUID(payload["user_id"])
+    except (JWTError, KeyError, ValueError, TypeError):
+        return None
+
+
+def _get_cache_tags(request: Request, user_id: uuid.UUID, body: bytes) -> List[str]:
+    """
+    Works out which tags a cached response depends on, so writes to those
+    resources invalidate it.
+    """
+    tags = [user_tag(user_id)]
+    match = PROJECT_PATH_PATTERN.match(request.url.path)
+    if match:
+        tags.append(project_tag(match.group(1)))
+    elif request.url.path.startswith("/projects"):
+        # A project listing depends on every project it contains
+        data = loads_json(body)
+        if isinstance(data, dict):
+            data = data.get("items")
+        if isinstance(data, list):
+            tags.extend(project_tag(item["id"]) for item in data if isinstance(item, dict) and "id" in item)
+    return tags
+
+
+def _route_label(request: Request) -> str:
+    """
+    The template of the route a request matches, e.g. "/projects/{project_id}".
+    Matched here rather than read from the scope after routing, since cache
+    hits never reach the router.
+    """
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return UNMATCHED_ROUTE_LABEL
+
+
+def _negotiate_encoding(request: Request) -> str:
+    """Picks the cached variant to serve, based on the request's Accept-Encoding."""
+    accepted = {}
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    for encoding in RESPONSE_ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return IDENTITY
+
+
+def _build_variants(body: bytes) -> Dict[str, Tuple[str, bytes]]:
+    """
+    Compresses a response body once for every encoding we serve. Small bodies
+    aren't compressed, so they only get the identity variant.
+    Returns a mapping of encoding -> (content-encoding, body). Compressing is
+    CPU-bound, so callers run it off the event loop for large bodies.
+    """
+    variants = {IDENTITY: (IDENTITY, body)}
+    if len(body) < RESPONSE_COMPRESSION_MIN_BYTES:
+        return variants
+    for encoding in RESPONSE_ENCODINGS:
+        if encoding == "br":
+            variants[encoding] = (encoding, brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY))
+        else:
+            variants[encoding] = (encoding, gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL))
+    return variants
+
+
+def _build_response(body: bytes, content_encoding: str, etag: Optional[str], headers: Dict[str, str], cache_status: str) -> Response:
+    headers = dict(headers)
+    headers["Vary"] = "Accept-Encoding"
+    headers["X-Cache-Status"] = cache_status
+    if content_encoding != IDENTITY:
+        headers["Content-Encoding"] = content_encoding
+    if etag:
+        headers["ETag"] = etag
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 class ResponseCacheMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
         # We only cache safe GET requests
@@ -22,39 +151,81 @@ class ResponseCacheMiddleware(BaseHTTPMiddleware):
         if not any(request.url.path.startswith(path) for path in CACHEABLE_PATHS):
             return await call_next(request)
 
-        # Create a unique cache key based on the full URL path and query params
+        # Responses are per-user, so the key includes the authenticated principal
+        user_id = _get_principal_id(request)
+        if user_id is None:
+            return await call_next(request)
+
+        # Create a unique cache key based on the user and the full URL path and query params
         # This ensures that /projects/1 and /projects/2 have different cache keys
-        cache_key = f"api_cache:{hashlib.md5(str(request.url).encode()).hexdigest()}"
-
-        # 1. Check if the response is already in the cache
-        cached_response = get_cache(cache_key)
-        if cached_response:
-            print(f"CACHE HIT for key: {cache_key}")
-            # If found, return the cached response immediately
-            return Response(
-                content=json.dumps(cached_response),
-                media_type="application/json",
-                headers={"X-Cache-Status": "HIT"}
-            )
+        cache_key = f"api_cache:{user_id}:{hashlib.md5(str(request.url).encode()).hexdigest()}"
+        encoding = _negotiate_encoding(request)
+        route = _route_label(request)
+        started = time.perf_counter()
+
+        # 1. Check if the response is already in the cache, in the encoding the client wants.
+        # Small responses are only stored uncompressed, which suits any client.
+        cached_entry = await get_cache_bytes_async(f"{cache_key}:{encoding}")
+        if cached_entry is None and encoding != IDENTITY:
+            cached_entry = await get_cache_bytes_async(f"{cache_key}:{IDENTITY}")
+        if cached_entry is not None:
+            route_metrics.increment(route, "hits")
+            route_metrics.increment(route, f"served_{encoding}")
+            route_metrics.observe(route, "hit", (time.perf_counter() - started) * 1000)
+            stored_etag, _, rest = cached_entry.partition(ENTRY_SEPARATOR)
+            content_encoding, _, body = rest.partition(ENTRY_SEPARATOR)
+            # Entries are invalidated by the same writes that rotate ETags, so the
+            # stored ETag is still valid and can answer a conditional GET directly
+            etag = stored_etag.decode() or None
+            if etags.etag_matches(request, etag):
+                route_metrics.increment(route, "not_modified")
+                return etags.not_modified(etag)
+            # If found, return the cached bytes immediately
+            return _build_response(body, content_encoding.decode(), etag, {}, "HIT")
 
-        print(f"CACHE MISS for key: {cache_key}")
-        
-        # 2. If not in cache, proceed with the request
+        route_metrics.increment(route, "misses")
+
+        # 2. If not in cache, proceed with the request. Note where the invalidation
+        # sequence stood first: if a write invalidates any of the response's tags
+        # while the handler runs, the response is already stale and isn't cached.
+        unchanged_since = await get_invalidation_seq()
         response = await call_next(request)
-        
+
         # 3. Cache the new response if it was successful
-        if response.status_code == 200 and isinstance(response, StreamingResponse):
-            response_body = b""
+        if response.status_code == 200 and hasattr(response, "body_iterator"):
+            chunks = []
             async for chunk in response.body_iterator:
-                response_body += chunk
-            
-            try:
-                data_to_cache = json.loads(response_body)
+                chunks.append(chunk)
+            response_body = b"".join(chunks)
+            route_metrics.observe(route, "miss", (time.perf_counter() - started) * 1000)
+
+            # Don't cache non-JSON responses
+            if response.headers.get("content-type", "").startswith("application/json"):
+                etag = response.headers.get("etag")
+                if len(response_body) < RESPONSE_COMPRESSION_MIN_BYTES:
+                    variants = _build_variants(response_body)
+                else:
+                    # Keep compression from stalling every other request on this loop
+                    variants = await asyncio.get_running_loop().run_in_executor(None, _build_variants, response_body)
+                stored_etag = (etag or "").encode()
                 # Cache with a 5-minute TTL
-                set_cache(cache_key, data_to_cache, ttl_seconds=300)
-            except json.JSONDecodeError:
-                pass # Don't cache non-JSON responses
-            
+                await set_many_cache_bytes_async(
+                    {
+                        f"{cache_key}:{variant}": ENTRY_SEPARATOR.join([stored_etag, content_encoding.encode(), body])
+                        for variant, (content_encoding, body) in variants.items()
+                    },
+                    ttl_seconds=CACHE_TTL_SECONDS,
+                    tags=_get_cache_tags(request, user_id, response_body),
+                    unchanged_since=unchanged_since,
+                )
+                # Serve the variant we just built, so GZipMiddleware doesn't compress it again
+                content_encoding, body = variants.get(encoding, variants[IDENTITY])
+                headers = {
+                    name: value for name, value in response.headers.items()
+                    if name not in ("content-length", "content-type", "etag")
+                }
+                return _build_response(body, content_encoding, etag, headers, "MISS")
+
             # Re-create the response to send to the client
             new_response = Response(
                 content=response_body,
@@ -65,5 +236,6 @@ class ResponseCacheMiddleware(BaseHTTPMiddleware):
             new_response.headers["X-Cache-Status"] = "MISS"
             return new_response
 
+        route_metrics.observe(route, "miss", (time.perf_counter() - started) * 1000)
         response.headers["X-Cache-Status"] = "MISS"
         return response
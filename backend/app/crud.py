@@ -11,6 +11,7 @@
 # from .user_roles import UserRole
 # from . import models, schemas, security
 # from .security import REFRESH_TOKEN_EXPIRE_DAYS
+from .prompt_templates import PROMPT_VERSION
 # from .project_roles import ProjectRole
 # from sqlalchemy.orm import selectinload
 # from fastapi import Request
@@ -25,15 +26,15 @@
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
-from sqlalchemy import func, delete
-from typing import Optional, List, Dict, Any
+from sqlalchemy.orm import selectinload, aliased
+from sqlalchemy import func, delete, tuple_
+from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime, timedelta, timezone
 import uuid
 import hashlib
 from fastapi import Request
 
-from . import models, schemas, security
+from . import models, schemas, security, membership_cache, cache_manager, principal_cache
 from .security import REFRESH_TOKEN_EXPIRE_DAYS
 from .user_roles import UserRole
 from .project_roles import ProjectRole
@@ -43,13 +44,25 @@ from .project_roles import ProjectRole
 PASSWORD_RESET_TOKEN_EXPIRE_MINUTES = 30
 
 
+async def _invalidate_project_activity_caches(db: AsyncSession, project_id: uuid.UUID):
+    """
+    Snippet and review counts feed the project's own responses and every
+    member's /users/me/stats, so drop the cached copies of all of them.
+    """
+    member_ids_query = select(models.ProjectMember.user_id).where(models.ProjectMember.project_id == project_id)
+    member_ids = (await db.execute(member_ids_query)).scalars().all()
+    await cache_manager.invalidate_cache_tags(
+        [cache_manager.project_tag(project_id)] + [cache_manager.user_tag(user_id) for user_id in member_ids]
+    )
+
+
 async def get_user_by_email(db: AsyncSession, email: str) -> Optional[models.User]:
     result = await db.execute(select(models.User).filter(models.User.email == email))
     return result.scalars().first()
 
 
 async def create_user(db: AsyncSession, user: schemas.UserCreate) -> models.User:
-    hashed_pass = security.hash_password(user.password)
+    hashed_pass = await security.hash_password_async(user.password)
     db_user = models.User(
         email=user.email,
         password_hash=hashed_pass
@@ -61,7 +74,7 @@ async def create_user(db: AsyncSession, user: schemas.UserCreate) -> models.User
 
 
 async def create_refresh_token(db: AsyncSession, user_id: int, token: str) -> models.RefreshToken:
-    token_hash = security.hash_password(token)
+    token_hash = security.hash_token(token)
     expires_at = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     db_refresh_token = models.RefreshToken(
         user_id=user_id,
@@ -76,7 +89,7 @@ async def create_refresh_token(db: AsyncSession, user_id: int, token: str) -> mo
 
 async def create_password_reset_token(db: AsyncSession, user_id: int) -> str:
     plain_token = security.generate_secure_token()
-    token_hash = security.hash_password(plain_token)
+    token_hash = security.hash_token(plain_token)
     expires_at = datetime.now(timezone.utc) + timedelta(minutes=PASSWORD_RESET_TOKEN_EXPIRE_MINUTES)
     db_token = models.PasswordResetToken(
         user_id=user_id,
@@ -88,26 +101,44 @@ async def create_password_reset_token(db: AsyncSession, user_id: int) -> str:
     return plain_token
 
 
-# --- THIS FUNCTION IS NOW CORRECTED FOR PYTHON 3.9 ---
+async def get_valid_refresh_token(db: AsyncSession, token: str) -> Optional[models.RefreshToken]:
+    """
+    Finds a non-expired refresh token by its digest (one lookup on the
+    unique token_hash index).
+    """
+    token_hash = security.hash_token(token)
+    query = (
+        select(models.RefreshToken)
+        .where(models.RefreshToken.token_hash == token_hash)
+        .where(models.RefreshToken.expires_at > datetime.now(timezone.utc))
+    )
+    db_token = (await db.execute(query)).scalars().first()
+    if db_token and security.verify_token_hash(token, db_token.token_hash):
+        return db_token
+    return None
+
+
 async def get_user_by_password_reset_token(db: AsyncSession, token: str) -> Optional[models.User]:
     """
     Finds a valid, non-expired password reset token and returns the associated user.
+    The token is looked up by its digest, so the cost doesn't depend on how
+    many resets are pending.
     """
+    token_hash = security.hash_token(token)
     query = (
         select(models.PasswordResetToken)
+        .where(models.PasswordResetToken.token_hash == token_hash)
         .where(models.PasswordResetToken.expires_at > datetime.now(timezone.utc))
         .options(selectinload(models.PasswordResetToken.user))
     )
-    
-    async for db_token in await db.stream_scalars(query):
-        if security.verify_password(token, db_token.token_hash):
-            return db_token.user
-            
+    db_token = (await db.execute(query)).scalars().first()
+    if db_token and security.verify_token_hash(token, db_token.token_hash):
+        return db_token.user
     return None
 
 
 async def update_user_password(db: AsyncSession, user: models.User, new_password: str) -> None:
-    user.password_hash = security.hash_password(new_password)
+    user.password_hash = await security.hash_password_async(new_password)
     
     # Invalidate all existing password reset tokens for this user for security
     # This requires the relationship to be loaded. We'll handle this in the endpoint.
@@ -117,6 +148,7 @@ async def update_user_password(db: AsyncSession, user: models.User, new_password
         
     db.add(user)
     await db.commit()
+    await principal_cache.invalidate_principal(user.id)
 
 async def get_all_users(db: AsyncSession, skip: int = 0, limit: int = 100) -> List[models.User]:
     """
@@ -140,6 +172,7 @@ async def update_user_role(db: AsyncSession, user: models.User, new_role: UserRo
     user.role = new_role
     db.add(user)
     await db.commit()
+    await principal_cache.invalidate_principal(user.id)
     await db.refresh(user)
     return user
 
@@ -170,21 +203,42 @@ async def create_project_with_owner(db: AsyncSession, project_in: schemas.Projec
     
     await db.commit()
     await db.refresh(db_project)
+    await cache_manager.invalidate_cache_tags([cache_manager.user_tag(owner_id)])
     return db_project
 
-async def get_projects_for_user(db: AsyncSession, user_id: uuid.UUID) -> List[models.Project]:
-    """
-    Fetches all projects that a user is a member of.
-    """
+async def get_project_page_for_user(
+    db: AsyncSession,
+    user_id: uuid.UUID,
+    limit: int,
+    after: Optional[Tuple[datetime, uuid.UUID]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Fetches one page of the projects a user is a member of, newest first, with
+    the user's role and a member count instead of the member list.
+    Keyset pagination on (created_at, id): pass the last row's pair as `after`.
+    """
+    other_members = aliased(models.ProjectMember)
+    member_count = (
+        select(func.count())
+        .select_from(other_members)
+        .where(other_members.project_id == models.Project.id)
+        .scalar_subquery()
+    )
     query = (
-        select(models.Project)
-        .join(models.ProjectMember)
+        select(
+            models.Project.id, models.Project.name, models.Project.description,
+            models.Project.created_at, models.Project.updated_at,
+            models.ProjectMember.role, member_count.label("member_count"),
+        )
+        .join(models.ProjectMember, models.ProjectMember.project_id == models.Project.id)
         .where(models.ProjectMember.user_id == user_id)
-        .order_by(models.Project.created_at.desc())
-        .options(selectinload(models.Project.member_associations).selectinload(models.ProjectMember.user))
+        .order_by(models.Project.created_at.desc(), models.Project.id.desc())
+        .limit(limit)
     )
+    if after is not None:
+        query = query.where(tuple_(models.Project.created_at, models.Project.id) < tuple_(*after))
     result = await db.execute(query)
-    return result.scalars().all()
+    return [dict(row) for row in result.mappings().all()]
 
 
 async def get_project_by_id(db: AsyncSession, project_id: uuid.UUID) -> Optional[models.Project]:
@@ -199,6 +253,47 @@ async def get_project_by_id(db: AsyncSession, project_id: uuid.UUID) -> Optional
     result = await db.execute(query)
     return result.scalars().first()
 
+async def get_project_without_members(db: AsyncSession, project_id: uuid.UUID) -> Optional[models.Project]:
+    """
+    Fetches a single project row by its ID. Its members are not loaded.
+    """
+    return await db.get(models.Project, project_id)
+
+
+async def project_exists(db: AsyncSession, project_id: uuid.UUID) -> bool:
+    """
+    Checks whether a project exists with a primary key lookup, without loading the row.
+    """
+    query = select(models.Project.id).where(models.Project.id == project_id)
+    return (await db.execute(query)).scalar_one_or_none() is not None
+
+
+async def get_project_member(db: AsyncSession, project_id: uuid.UUID, user_id: uuid.UUID) -> Optional[models.ProjectMember]:
+    """
+    Fetches one membership (with its user) by the (project_id, user_id) primary key.
+    """
+    query = (
+        select(models.ProjectMember)
+        .where(models.ProjectMember.project_id == project_id)
+        .where(models.ProjectMember.user_id == user_id)
+        .options(selectinload(models.ProjectMember.user))
+    )
+    result = await db.execute(query)
+    return result.scalars().first()
+
+
+async def get_project_members(db: AsyncSession, project_id: uuid.UUID) -> List[models.ProjectMember]:
+    """
+    Fetches a project's members with their users, without loading the project.
+    """
+    query = (
+        select(models.ProjectMember)
+        .where(models.ProjectMember.project_id == project_id)
+        .options(selectinload(models.ProjectMember.user))
+    )
+    result = await db.execute(query)
+    return result.scalars().all()
+
 async def create_audit_log(
     db: AsyncSession,
     action: str,
@@ -260,13 +355,22 @@ async def update_user_subscription(db: AsyncSession, user: models.User, tier: st
     user.subscription_tier = tier
     db.add(user)
     await db.commit()
+    await principal_cache.invalidate_principal(user.id)
     await db.refresh(user)
     return user
 
 async def delete_user(db: AsyncSession, user: models.User):
     """Deletes a user and all their associated data via cascading."""
+    project_ids_query = select(models.ProjectMember.project_id).where(models.ProjectMember.user_id == user.id)
+    project_ids = (await db.execute(project_ids_query)).scalars().all()
     await db.delete(user)
     await db.commit()
+    await principal_cache.invalidate_principal(user.id)
+    for project_id in project_ids:
+        await membership_cache.invalidate_membership(project_id, user.id)
+    await cache_manager.invalidate_cache_tags(
+        [cache_manager.user_tag(user.id)] + [cache_manager.project_tag(project_id) for project_id in project_ids]
+    )
 
 # (Add these new functions to the end of your existing crud.py file)
 
@@ -289,6 +393,7 @@ async def update_project(db: AsyncSession, project: models.Project, project_in:
     db.add(project)
     await db.commit()
     await db.refresh(project)
+    await cache_manager.invalidate_cache_tags([cache_manager.project_tag(project.id)])
     return project
 
 
@@ -298,6 +403,8 @@ async def delete_project(db: AsyncSession, project: models.Project):
     """
     await db.delete(project)
     await db.commit()
+    await membership_cache.invalidate_project_memberships([project.id])
+    await cache_manager.invalidate_cache_tags([cache_manager.project_tag(project.id)])
 
 from sqlalchemy import func, select
 from sqlalchemy.orm import selectinload
@@ -312,6 +419,8 @@ async def add_project_member(db: AsyncSession, project: models.Project, user: mo
     db_member = models.ProjectMember(project_id=project.id, user_id=user.id, role=role)
     db.add(db_member)
     await db.commit()
+    await membership_cache.invalidate_membership(project.id, user.id)
+    await cache_manager.invalidate_cache_tags([cache_manager.project_tag(project.id), cache_manager.user_tag(user.id)])
     # Eagerly load the 'user' relationship for the response
     await db.refresh(db_member, attribute_names=['user'])
     return db_member
@@ -321,6 +430,8 @@ async def update_project_member_role(db: AsyncSession, member: models.ProjectMem
     member.role = new_role
     db.add(member)
     await db.commit()
+    await membership_cache.invalidate_membership(member.project_id, member.user_id)
+    await cache_manager.invalidate_cache_tags([cache_manager.project_tag(member.project_id), cache_manager.user_tag(member.user_id)])
     await db.refresh(member)
     return member
 
@@ -328,6 +439,8 @@ async def remove_project_member(db: AsyncSession, member: models.ProjectMember):
     """Removes a member from a project."""
     await db.delete(member)
     await db.commit()
+    await membership_cache.invalidate_membership(member.project_id, member.user_id)
+    await cache_manager.invalidate_cache_tags([cache_manager.project_tag(member.project_id), cache_manager.user_tag(member.user_id)])
 
 # --- Settings Function ---
 
@@ -337,6 +450,7 @@ async def update_project_settings(db: AsyncSession, project: models.Project, set
     db.add(project)
     await db.commit()
     await db.refresh(project)
+    await cache_manager.invalidate_cache_tags([cache_manager.project_tag(project.id)])
     return project
 
 # --- Stats/Analytics Function ---
@@ -389,6 +503,7 @@ async def create_project_from_template(db: AsyncSession, template_project: model
         
     await db.commit()
     await db.refresh(new_project)
+    await cache_manager.invalidate_cache_tags([cache_manager.user_tag(owner.id)])
     return new_project
 
 # Helper function for templates
@@ -400,6 +515,8 @@ async def add_project_member(db: AsyncSession, project: models.Project, user: mo
     db_member = models.ProjectMember(project_id=project.id, user_id=user.id, role=role)
     db.add(db_member)
     await db.commit()
+    await membership_cache.invalidate_membership(project.id, user.id)
+    await cache_manager.invalidate_cache_tags([cache_manager.project_tag(project.id), cache_manager.user_tag(user.id)])
     await db.refresh(db_member)
     return db_member
 
@@ -407,12 +524,16 @@ async def update_project_member_role(db: AsyncSession, member: models.ProjectMem
     member.role = new_role
     db.add(member)
     await db.commit()
+    await membership_cache.invalidate_membership(member.project_id, member.user_id)
+    await cache_manager.invalidate_cache_tags([cache_manager.project_tag(member.project_id), cache_manager.user_tag(member.user_id)])
     await db.refresh(member)
     return member
 
 async def remove_project_member(db: AsyncSession, member: models.ProjectMember):
     await db.delete(member)
     await db.commit()
+    await membership_cache.invalidate_membership(member.project_id, member.user_id)
+    await cache_manager.invalidate_cache_tags([cache_manager.project_tag(member.project_id), cache_manager.user_tag(member.user_id)])
 
 # --- Settings Function ---
 
@@ -421,6 +542,7 @@ async def update_project_settings(db: AsyncSession, project: models.Project, set
     db.add(project)
     await db.commit()
     await db.refresh(project)
+    await cache_manager.invalidate_cache_tags([cache_manager.project_tag(project.id)])
     return project
 
 # --- Stats/Analytics Function ---
@@ -471,6 +593,7 @@ async def create_project_from_template(db: AsyncSession, template_project: model
         
     await db.commit()
     await db.refresh(new_project)
+    await cache_manager.invalidate_cache_tags([cache_manager.user_tag(owner.id)])
     return new_project
 
 # Helper function for templates
@@ -503,6 +626,7 @@ async def create_code_snippet(
     db.add(db_snippet)
     await db.commit()
     await db.refresh(db_snippet)
+    await _invalidate_project_activity_caches(db, project_id)
     return db_snippet
 
 async def create_review_for_snippet(db: AsyncSession, snippet: models.CodeSnippet, priority: int = 0) -> models.Review:
@@ -517,6 +641,7 @@ async def create_review_for_snippet(db: AsyncSession, snippet: models.CodeSnippe
     db.add(db_review)
     await db.commit()
     await db.refresh(db_review)
+    await _invalidate_project_activity_caches(db, snippet.project_id)
     return db_review
 
 async def get_snippet_by_id(db: AsyncSession, snippet_id: uuid.UUID) -> Optional[models.CodeSnippet]:
@@ -541,22 +666,87 @@ async def update_snippet_metrics(db: AsyncSession, snippet: models.CodeSnippet,
     await db.refresh(snippet)
     return snippet
 
-async def find_cached_review_by_normalized_hash(db: AsyncSession, normalized_hash: str) -> Optional[models.Review]:
+# Stamp stored with every review's results. Results are only reused for code
+# analyzed with the same stamp, so bump ANALYZER_VERSION whenever the static
+# analyzers change; a new PROMPT_VERSION changes it too.
+ANALYZER_VERSION = "1"
+ANALYSIS_VERSION = f"{ANALYZER_VERSION}:{PROMPT_VERSION}"
+
+async def find_cached_review_by_normalized_hash(db: AsyncSession, project_id: uuid.UUID, normalized_hash: str) -> Optional[models.Review]:
     """
-    Finds a recent, completed review for a code snippet with an identical
-    normalized hash. This is our cache lookup.
+    Finds the latest completed review of a snippet in the same project with an
+    identical normalized hash, analyzed with the current ANALYSIS_VERSION.
+    This is our cache lookup.
     """
     query = (
         select(models.Review)
         .join(models.CodeSnippet)
+        .where(models.CodeSnippet.project_id == project_id)
         .where(models.CodeSnippet.normalized_hash == normalized_hash)
         .where(models.Review.status == "completed")
+        .where(models.Review.results["analysis_version"].as_string() == ANALYSIS_VERSION)
         .order_by(models.Review.completed_at.desc())
         .limit(1)
     )
     result = await db.execute(query)
     return result.scalars().first()
 
+# Results of a completed review, keyed by project, analysis version and the
+# snippet's normalized hash, so identical code within a project isn't analyzed
+# twice by the same analyzers. Results never cross projects. Read by the
+# worker and filled by scripts/warm_cache.py.
+REVIEW_RESULTS_CACHE_TTL_SECONDS = 60 * 60 * 24
+
+def review_results_cache_key(project_id: uuid.UUID, normalized_hash: str) -> str:
+    return f"data_cache:review_results:{project_id}:{ANALYSIS_VERSION}:{normalized_hash}"
+
+async def get_cached_review_results(db: AsyncSession, project_id: uuid.UUID, normalized_hash: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns the results of a completed review of identical code in the same
+    project, from Redis when possible, falling back to the latest matching
+    review in the database (and caching it). Returns None if there isn't one.
+    """
+    key = review_results_cache_key(project_id, normalized_hash)
+    results = await cache_manager.get_cache_async(key)
+    if results is not None:
+        return results
+    return await fill_review_results_cache(db, project_id, normalized_hash)
+
+async def fill_review_results_cache(db: AsyncSession, project_id: uuid.UUID, normalized_hash: str) -> Optional[Dict[str, Any]]:
+    """
+    Caches the results of the latest matching review from the database,
+    without reading Redis first. Returns them, or None if there aren't any.
+    """
+    review = await find_cached_review_by_normalized_hash(db, project_id, normalized_hash)
+    if review is None or review.results is None:
+        return None
+    await cache_review_results(project_id, normalized_hash, review.results)
+    return review.results
+
+async def cache_review_results(project_id: uuid.UUID, normalized_hash: str, results: Dict[str, Any]):
+    await cache_manager.set_cache_async(
+        review_results_cache_key(project_id, normalized_hash), results, ttl_seconds=REVIEW_RESULTS_CACHE_TTL_SECONDS
+    )
+
+async def get_top_normalized_hashes(db: AsyncSession, since: datetime, limit: int) -> List[Tuple[uuid.UUID, str]]:
+    """
+    Returns the (project ID, normalized hash) pairs with the most completed
+    reviews at the current ANALYSIS_VERSION since `since`, most frequent first.
+    """
+    query = (
+        select(models.CodeSnippet.project_id, models.CodeSnippet.normalized_hash)
+        .join(models.Review, models.Review.code_snippet_id == models.CodeSnippet.id)
+        .where(models.CodeSnippet.normalized_hash.is_not(None))
+        .where(models.Review.status == "completed")
+        .where(models.Review.completed_at >= since)
+        .where(models.Review.results["analysis_version"].as_string() == ANALYSIS_VERSION)
+        .group_by(models.CodeSnippet.project_id, models.CodeSnippet.normalized_hash)
+        .order_by(func.count(models.Review.id).desc())
+        .limit(limit)
+    )
+    result = await db.execute(query)
+    return [tuple(row) for row in result.all()]
+
 async def delete_snippets_in_bulk(db: AsyncSession, project_id: uuid.UUID, snippet_ids: List[uuid.UUID]) -> int:
     """
     Deletes multiple code snippets from a project in a single database query.
@@ -573,6 +763,7 @@ async def delete_snippets_in_bulk(db: AsyncSession, project_id: uuid.UUID, snipp
     
     result = await db.execute(stmt)
     await db.commit()
+    await _invalidate_project_activity_caches(db, project_id)
     
     # The 'rowcount' attribute tells us how many rows were affected by the delete operation.
     return result.rowcount
@@ -603,5 +794,6 @@ async def update_user_role(db: AsyncSession, user: models.User, new_role: UserRo
     user.role = new_role
     db.add(user)
     await db.commit()
+    await principal_cache.invalidate_principal(user.id)
     await db.refresh(user)
     return user
\ No newline at end of file
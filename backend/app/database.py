@@ -3,6 +3,8 @@ from dotenv import load_dotenv
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 
+from .db_metrics import instrument_engine
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -19,14 +21,18 @@ if not DATABASE_URL:
 # - pool_timeout: The number of seconds to wait before giving up on getting a connection
 #   from the pool. (Default is 30)
 # - echo=True: A useful debugging setting that logs all SQL queries generated by SQLAlchemy.
-#   Keep this False in production to avoid logging sensitive data.
+#   It logs synchronously on every statement, so it is off unless SQL_ECHO=true;
+#   per-route statement counts and timings come from db_metrics instead.
 
 engine = create_async_engine(
     DATABASE_URL,
     pool_size=10,
     max_overflow=20,
-    echo=True  # <-- CHANGE THIS TO TRUE
+    echo=os.getenv("SQL_ECHO", "false").lower() == "true"
 )
+# Counts statements, database time and rows per request or job
+instrument_engine(engine.sync_engine)
+
 # The AsyncSession sessionmaker is configured to use our engine's connection pool.
 AsyncSessionLocal = sessionmaker(
     bind=engine,
@@ -0,0 +1,199 @@
+# File: apex/backend/app/db_metrics.py
+
+# Per-request and per-job SQL instrumentation, built on SQLAlchemy's cursor
+# events: how many statements ran, how long they spent in the database and
+# how many rows they touched, aggregated per route. A statement that runs many
+# times within one request is flagged as a likely N+1. Every API process keeps
+# its own numbers.
+
+import functools
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+
+from .cache_metrics import LatencyHistogram, UNMATCHED_ROUTE_LABEL
+
+# Adds a Server-Timing header with the request's database time and statement
+# count, for browser dev tools. Debug only: it reveals backend timings.
+DB_SERVER_TIMING_ENABLED = os.getenv("DB_SERVER_TIMING_ENABLED", "false").lower() == "true"
+
+# A statement shape run at least this many times in one request or job is
+# reported as a likely N+1.
+DB_N_PLUS_ONE_THRESHOLD = 5
+
+# Repeated shapes remembered per route, and how much of each statement is kept
+DB_REPEATED_SHAPES_PER_ROUTE = 10
+DB_SHAPE_MAX_LENGTH = 300
+
+# Bind parameter lists, e.g. "IN ($1::UUID, $2::UUID)", whose length varies with the input
+PARAMETER_LIST_PATTERN = re.compile(r"\(\s*(?:(?:\$\d+|\?|%s|%\(\w+\)s)(?:::[\w\[\]]+)?\s*,?\s*)+\)")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """Normalizes a statement so executions that differ only in parameter list length compare equal."""
+    shape = PARAMETER_LIST_PATTERN.sub("(...)", WHITESPACE_PATTERN.sub(" ", statement).strip())
+    return shape[:DB_SHAPE_MAX_LENGTH]
+
+
+class QueryScope:
+    """The statements run on behalf of one request or job."""
+
+    __slots__ = ("label", "statements", "db_ms", "rows", "executions")
+
+    def __init__(self, label: str):
+        self.label = label
+        self.statements = 0
+        self.db_ms = 0.0
+        self.rows = 0
+        # Raw statement text -> executions; SQLAlchemy caches compiled SQL, so
+        # identical shapes usually arrive as the identical string
+        self.executions: Counter = Counter()
+
+    def record(self, statement: str, duration_ms: float, rows: int):
+        self.statements += 1
+        self.db_ms += duration_ms
+        # Drivers report -1 when the count isn't known (e.g. before fetching)
+        self.rows += max(rows, 0)
+        self.executions[statement] += 1
+
+    def repeated_shapes(self) -> Dict[str, int]:
+        shapes: Counter = Counter()
+        for statement, count in self.executions.items():
+            shapes[statement_shape(statement)] += count
+        return {shape: count for shape, count in shapes.items() if count >= DB_N_PLUS_ONE_THRESHOLD}
+
+
+_current_scope: ContextVar[Optional[QueryScope]] = ContextVar("db_query_scope", default=None)
+
+
+class RouteQueryStats:
+    """Aggregates of every request (or job) recorded under one label."""
+
+    def __init__(self):
+        self.requests = 0
+        self.statements = 0
+        self.rows = 0
+        self.max_statements = 0
+        self.n_plus_one_requests = 0
+        self.db_time = LatencyHistogram()
+        self.repeated_shapes: Counter = Counter()
+
+    def record(self, scope: QueryScope, repeated: Dict[str, int]):
+        self.requests += 1
+        self.statements += scope.statements
+        self.rows += scope.rows
+        self.max_statements = max(self.max_statements, scope.statements)
+        self.db_time.observe(scope.db_ms)
+        if repeated:
+            self.n_plus_one_requests += 1
+            self.repeated_shapes.update(repeated)
+            if len(self.repeated_shapes) > 2 * DB_REPEATED_SHAPES_PER_ROUTE:
+                self.repeated_shapes = Counter(dict(self.repeated_shapes.most_common(DB_REPEATED_SHAPES_PER_ROUTE)))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "statements": self.statements,
+            "statements_per_request": round(self.statements / self.requests, 2) if self.requests else None,
+            "max_statements": self.max_statements,
+            "rows": self.rows,
+            "n_plus_one_requests": self.n_plus_one_requests,
+            "db_time": self.db_time.snapshot(),
+            "repeated_shapes": [
+                {"statement": shape, "executions": count}
+                for shape, count in self.repeated_shapes.most_common(DB_REPEATED_SHAPES_PER_ROUTE)
+            ],
+        }
+
+
+route_query_stats: Dict[str, RouteQueryStats] = defaultdict(RouteQueryStats)
+
+
+def instrument_engine(engine: Engine):
+    """Attaches the cursor event listeners. For an AsyncEngine, pass `engine.sync_engine`."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._db_metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        scope = _current_scope.get()
+        started = getattr(context, "_db_metrics_started", None)
+        if scope is None or started is None:
+            return
+        scope.record(statement, (time.perf_counter() - started) * 1000, cursor.rowcount)
+
+
+def finish_scope(scope: QueryScope) -> Dict[str, int]:
+    """Adds a finished scope to its route's aggregates. Returns its likely N+1 shapes."""
+    repeated = scope.repeated_shapes()
+    route_query_stats[scope.label].record(scope, repeated)
+    return repeated
+
+
+def get_query_report(top_n: int = 20) -> Dict[str, Any]:
+    """Per-route aggregates, the `top_n` routes by total database time first."""
+    ranked = sorted(route_query_stats.items(), key=lambda item: item[1].db_time.total_ms, reverse=True)
+    return {
+        "n_plus_one_threshold": DB_N_PLUS_ONE_THRESHOLD,
+        "routes": {label: stats.snapshot() for label, stats in ranked[:top_n]},
+    }
+
+
+class QueryMetricsMiddleware(BaseHTTPMiddleware):
+    """
+    Opens a query scope around each request and records it under the matched
+    route's template, e.g. "GET /projects/{project_id}". Requests that match
+    no route share a single label, so scanners can't grow the stats without bound.
+    """
+
+    async def dispatch(self, request: Request, call_next):
+        scope = QueryScope(f"{request.method} {UNMATCHED_ROUTE_LABEL}")
+        token = _current_scope.set(scope)
+        try:
+            response = await call_next(request)
+        finally:
+            _current_scope.reset(token)
+
+        # The router records the matched route in the shared ASGI scope
+        route = request.scope.get("route")
+        if route is not None:
+            scope.label = f"{request.method} {route.path}"
+        repeated = finish_scope(scope)
+        if DB_SERVER_TIMING_ENABLED:
+            response.headers.append("Server-Timing", f'db;dur={scope.db_ms:.1f};desc="{scope.statements} statements"')
+            if repeated:
+                response.headers.append("Server-Timing", f'db-repeated;desc="{len(repeated)} likely N+1 statements"')
+        return response
+
+
+def track_job(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """Wraps an arq job so its statements are recorded under "job:{name}"."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        scope = QueryScope(f"job:{func.__name__}")
+        token = _current_scope.set(scope)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _current_scope.reset(token)
+            repeated = finish_scope(scope)
+            if repeated:
+                print(
+                    f"   -> ⚠️ Likely N+1 in {scope.label} ({scope.statements} statements, {scope.db_ms:.1f} ms): "
+                    + "; ".join(f"{count}x {shape[:120]}" for shape, count in repeated.items())
+                )
+
+    return wrapper
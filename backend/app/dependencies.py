@@ -7,6 +7,7 @@ import uuid
 
 from . import crud, models, security
 from .database import get_db
+from .principal_cache import Principal, get_principal
 
 # This tells FastAPI where to look for the token (in the Authorization header)
 # The tokenUrl is the endpoint the API docs will use to get a token.
@@ -43,13 +44,42 @@ async def get_current_user(
     return user
 
 
-async def get_current_user_from_websocket(
-    token: Optional[str] = Query(None),
+async def get_current_principal(
+    token: str = Depends(oauth2_scheme),
     db: AsyncSession = Depends(get_db)
-) -> models.User:
+) -> Principal:
     """
-    Dependency to get the current user from a JWT token passed as a
-    query parameter in a WebSocket connection.
+    Dependency to get the current user's principal (id, email, role, status,
+    tier) from a JWT bearer token. Served from the principal cache, so most
+    requests authenticate without a query. Use get_current_user instead when
+    the endpoint needs the full users row.
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
+        user_id_str: Optional[str] = payload.get("user_id")
+        if user_id_str is None:
+            raise credentials_exception
+        user_id = uuid.UUID(user_id_str)
+    except (JWTError, ValueError):
+        raise credentials_exception
+
+    principal = await get_principal(db, user_id)
+    if principal is None:
+        raise credentials_exception
+    return principal
+
+
+async def get_user_id_from_websocket(token: Optional[str] = Query(None)) -> uuid.UUID:
+    """
+    Dependency to get the user ID from a JWT token passed as a query parameter
+    in a WebSocket connection, without touching the database.
+    Access checks that follow (e.g. the membership cache) decide whether the
+    user may actually see anything.
     """
     if not token:
         raise WebSocketDisconnect(code=1008, reason="Token not provided")
@@ -61,10 +91,20 @@ async def get_current_user_from_websocket(
         user_id_str: Optional[str] = payload.get("user_id")
         if user_id_str is None:
             raise credentials_exception
-        user_id = uuid.UUID(user_id_str)
+        return uuid.UUID(user_id_str)
     except (JWTError, ValueError):
         raise credentials_exception
-    
+
+
+async def get_current_user_from_websocket(
+    user_id: uuid.UUID = Depends(get_user_id_from_websocket),
+    db: AsyncSession = Depends(get_db)
+) -> models.User:
+    """
+    Dependency to get the current user from a JWT token passed as a
+    query parameter in a WebSocket connection.
+    """
+    credentials_exception = WebSocketDisconnect(code=1008, reason="Could not validate credentials")
     user = await db.get(models.User, user_id)
     if user is None:
         raise credentials_exception
@@ -74,7 +114,7 @@ async def get_current_user_from_websocket(
 async def verify_csrf_token(
     request: Request,
     x_csrf_token: Optional[str] = Header(None, alias="X-CSRF-Token"),
-    current_user: models.User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """
     Dependency to verify the double-submit CSRF token.
@@ -0,0 +1,40 @@
+# File: apex/backend/app/etags.py
+
+import hashlib
+from typing import List, Optional
+from fastapi import Request, Response, status
+
+from .cache_manager import get_tag_versions
+
+
+def build_etag(*parts: str) -> str:
+    """Builds a strong ETag from the values a representation depends on."""
+    digest = hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+async def build_etag_from_tags(request: Request, tags: List[str]) -> Optional[str]:
+    """
+    Builds an ETag from the version tokens of the cache tags a response depends
+    on. This costs one Redis round trip and never touches the database.
+    Returns None if the versions can't be read, in which case no ETag is sent.
+    """
+    versions = await get_tag_versions(tags)
+    if versions is None:
+        return None
+    return build_etag(request.url.path, *tags, *versions)
+
+
+def etag_matches(request: Request, etag: Optional[str]) -> bool:
+    """True if the client's If-None-Match already covers this ETag."""
+    if not etag:
+        return False
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
@@ -1,21 +1,37 @@
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from .caching_middleware import ResponseCacheMiddleware
+from .db_metrics import QueryMetricsMiddleware
 from . import api_auth, api_admin, api_projects, api_users, api_websockets, api_reviews
 from .redis_manager import startup_redis_pool, shutdown_redis_pool
 from .websocket_manager import manager as ws_manager # Import the WebSocket manager
+from . import cache_manager
+from . import rate_limiter, quotas, audit_logger
+from .cache_config import RESPONSE_COMPRESSION_MIN_BYTES
 from starlette.middleware.gzip import GZipMiddleware
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Handles application startup and shutdown events."""
+    # Fail fast if Redis could evict queued jobs or lacks room beyond the cache budget
+    await cache_manager.check_redis_memory()
     # Start the Redis pool for the job queue
     await startup_redis_pool()
     # Start the WebSocket manager's Redis listener
     await ws_manager.startup()
+    # Keep every node's in-process cache tier in sync
+    await cache_manager.start_invalidation_listener()
+    # Persist quota usage in periodic batches
+    await quotas.start_quota_flusher()
+    # Audit events are written in batches
+    await audit_logger.start_audit_log_writer()
     
     yield # The application is now running
     
     # Clean up on shutdown
+    await quotas.stop_quota_flusher()
+    await audit_logger.stop_audit_log_writer()
+    await rate_limiter.release_leases()
+    await cache_manager.stop_invalidation_listener()
     await ws_manager.shutdown()
     await shutdown_redis_pool()
 
@@ -27,7 +43,10 @@ app = FastAPI(
 )
 
 app.add_middleware(ResponseCacheMiddleware)
-app.add_middleware(GZipMiddleware, minimum_size=1000)
+# Cached responses already carry a Content-Encoding, which GZipMiddleware leaves alone
+app.add_middleware(GZipMiddleware, minimum_size=RESPONSE_COMPRESSION_MIN_BYTES)
+# Outermost, so requests answered from the response cache count as zero statements
+app.add_middleware(QueryMetricsMiddleware)
 # Include all the API routers
 app.include_router(api_auth.router, prefix="/auth", tags=["Authentication"])
 app.include_router(api_admin.router, prefix="/admin", tags=["Admin"])
@@ -38,4 +57,16 @@ app.include_router(api_websockets.router, tags=["WebSockets"])
 
 @app.get("/", tags=["Root"])
 async def read_root():
-    return {"message": "Welcome to the Apex API!"}
\ No newline at end of file
+    return {"message": "Welcome to the Apex API!"}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    from .websocket_config import WS_PER_MESSAGE_DEFLATE, WS_PING_INTERVAL_SECONDS, WS_PING_TIMEOUT_SECONDS
+
+    # Run with `python -m app.main`. The "websockets" implementation negotiates
+    # permessage-deflate with clients that offer it, compressing large result frames.
+    uvicorn.run(
+        "app.main:app", host="0.0.0.0", port=8000, ws="websockets", ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE,
+        ws_ping_interval=WS_PING_INTERVAL_SECONDS, ws_ping_timeout=WS_PING_TIMEOUT_SECONDS,
+    )
@@ -0,0 +1,113 @@
+# File: apex/backend/app/membership_cache.py
+
+import uuid
+from typing import Optional, Iterable
+import redis
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from . import models
+from .cache_manager import async_redis_client
+from .project_roles import ProjectRole
+
+# --- Cache layout ---
+# authz:members:{project_id}   hash of user_id -> project role ("-" = not a member)
+# authz:review_project:{review_id}   the project a review belongs to
+MEMBERSHIP_KEY_PREFIX = "authz:members"
+REVIEW_PROJECT_KEY_PREFIX = "authz:review_project"
+
+# Membership can change, so keep it short. The TTL is only set when a project's
+# hash is first created, which bounds how stale any field can get.
+MEMBERSHIP_TTL_SECONDS = 60
+# A review never moves to another project, so this can live longer.
+REVIEW_PROJECT_TTL_SECONDS = 60 * 10
+
+NOT_A_MEMBER = "-"
+
+
+def _membership_key(project_id: uuid.UUID) -> str:
+    return f"{MEMBERSHIP_KEY_PREFIX}:{project_id}"
+
+
+def _review_project_key(review_id: uuid.UUID) -> str:
+    return f"{REVIEW_PROJECT_KEY_PREFIX}:{review_id}"
+
+
+async def get_project_role(db: AsyncSession, project_id: uuid.UUID, user_id: uuid.UUID) -> Optional[ProjectRole]:
+    """
+    Returns the user's role on a project, or None if they are not a member.
+    Served from Redis when possible; falls back to a single indexed
+    (project_id, user_id) lookup and caches the answer, including "not a member".
+    """
+    key = _membership_key(project_id)
+    try:
+        cached_role = await async_redis_client.hget(key, str(user_id))
+        if cached_role is not None:
+            return None if cached_role == NOT_A_MEMBER else ProjectRole(cached_role)
+    except redis.exceptions.RedisError as e:
+        print(f"Error reading membership cache for project {project_id}: {e}")
+
+    query = (
+        select(models.ProjectMember.role)
+        .where(models.ProjectMember.project_id == project_id)
+        .where(models.ProjectMember.user_id == user_id)
+    )
+    role = (await db.execute(query)).scalar_one_or_none()
+
+    try:
+        pipe = async_redis_client.pipeline(transaction=False)
+        pipe.hset(key, str(user_id), role.value if role else NOT_A_MEMBER)
+        pipe.expire(key, MEMBERSHIP_TTL_SECONDS, nx=True)
+        await pipe.execute()
+    except redis.exceptions.RedisError as e:
+        print(f"Error writing membership cache for project {project_id}: {e}")
+
+    return role
+
+
+async def get_review_project_id(db: AsyncSession, review_id: uuid.UUID) -> Optional[uuid.UUID]:
+    """
+    Returns the ID of the project a review belongs to, or None if the review
+    doesn't exist. Missing reviews are not cached.
+    """
+    key = _review_project_key(review_id)
+    try:
+        cached_project_id = await async_redis_client.get(key)
+        if cached_project_id:
+            return uuid.UUID(cached_project_id)
+    except redis.exceptions.RedisError as e:
+        print(f"Error reading review->project cache for review {review_id}: {e}")
+
+    query = (
+        select(models.CodeSnippet.project_id)
+        .join(models.Review, models.Review.code_snippet_id == models.CodeSnippet.id)
+        .where(models.Review.id == review_id)
+    )
+    project_id = (await db.execute(query)).scalar_one_or_none()
+
+    if project_id is not None:
+        try:
+            await async_redis_client.set(key, str(project_id), ex=REVIEW_PROJECT_TTL_SECONDS)
+        except redis.exceptions.RedisError as e:
+            print(f"Error writing review->project cache for review {review_id}: {e}")
+
+    return project_id
+
+
+async def invalidate_membership(project_id: uuid.UUID, user_id: uuid.UUID):
+    """Drops the cached role for one user on one project."""
+    try:
+        await async_redis_client.hdel(_membership_key(project_id), str(user_id))
+    except redis.exceptions.RedisError as e:
+        print(f"Error invalidating membership cache for project {project_id}: {e}")
+
+
+async def invalidate_project_memberships(project_ids: Iterable[uuid.UUID]):
+    """Drops every cached role for the given projects."""
+    keys = [_membership_key(project_id) for project_id in project_ids]
+    if not keys:
+        return
+    try:
+        await async_redis_client.delete(*keys)
+    except redis.exceptions.RedisError as e:
+        print(f"Error invalidating membership cache for projects: {e}")
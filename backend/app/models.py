@@ -3,7 +3,8 @@ from datetime import datetime
 from typing import List, Dict, Any, Optional
 
 from sqlalchemy import (
-    Boolean, DateTime, Enum, ForeignKey, Integer, JSON, String, Text, Float
+    BigInteger, Boolean, DateTime, Enum, ForeignKey, Identity, Index, Integer, JSON, String, Text, Float,
+    UniqueConstraint
 )
 from sqlalchemy.orm import declarative_base, Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
@@ -16,7 +17,8 @@ Base = declarative_base()
 class ProjectMember(Base):
     __tablename__ = "project_members"
     project_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("projects.id"), primary_key=True)
-    user_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    # The primary key leads with project_id; this serves "projects of a user"
+    user_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("users.id"), primary_key=True, index=True)
     role: Mapped[ProjectRole] = mapped_column(Enum(ProjectRole), nullable=False, default=ProjectRole.VIEWER)
     user: Mapped["User"] = relationship(back_populates="project_associations")
     project: Mapped["Project"] = relationship(back_populates="member_associations")
@@ -52,6 +54,8 @@ class User(Base):
 
 class Project(Base):
     __tablename__ = "projects"
+    # Keyset pagination order of the project listing
+    __table_args__ = (Index("ix_projects_created_at_id", "created_at", "id"),)
     id: Mapped[uuid.UUID] = mapped_column(primary_key=True, default=uuid.uuid4)
     name: Mapped[str] = mapped_column(String, index=True)
     description: Mapped[Optional[str]] = mapped_column(Text)
@@ -104,15 +108,55 @@ class RefreshToken(Base):
     user: Mapped["User"] = relationship(back_populates="refresh_tokens")
 
 class AuditLog(Base):
+    """
+    Range-partitioned by day on `timestamp` (see audit_maintenance.py), so the
+    partition key is part of the primary key.
+    """
     __tablename__ = "audit_logs"
-    id: Mapped[int] = mapped_column(primary_key=True)
+    __table_args__ = (
+        Index("ix_audit_logs_action_timestamp", "action", "timestamp"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+    id: Mapped[int] = mapped_column(BigInteger, Identity(), primary_key=True)
     user_id: Mapped[Optional[uuid.UUID]] = mapped_column(ForeignKey("users.id"), index=True)
-    action: Mapped[str] = mapped_column(String, index=True)
+    action: Mapped[str] = mapped_column(String)
     resource_type: Mapped[Optional[str]] = mapped_column(String)
     resource_id: Mapped[Optional[uuid.UUID]] = mapped_column()
     details: Mapped[Optional[Dict[str, Any]]] = mapped_column(JSON)
     ip_address: Mapped[Optional[str]] = mapped_column(String)
-    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True, server_default=func.now(), index=True)
+
+class AuditActionRollup(Base):
+    """Audit events per action per hour, maintained by audit_maintenance.refresh_rollups."""
+    __tablename__ = "audit_action_rollups"
+    bucket_start: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
+    action: Mapped[str] = mapped_column(String, primary_key=True)
+    event_count: Mapped[int] = mapped_column(Integer)
+
+class AuditIpFailureRollup(Base):
+    """Failure events (failed logins, denials) per source IP per hour."""
+    __tablename__ = "audit_ip_failure_rollups"
+    bucket_start: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
+    action: Mapped[str] = mapped_column(String, primary_key=True)
+    ip_address: Mapped[str] = mapped_column(String, primary_key=True)
+    failure_count: Mapped[int] = mapped_column(Integer)
+
+class RateLimit(Base):
+    """
+    Long-window quota usage (e.g. reviews per month), flushed in batches from
+    the Redis counters that enforce it. One row per user, endpoint and window.
+    """
+    __tablename__ = "rate_limits"
+    __table_args__ = (
+        UniqueConstraint("user_id", "endpoint", "period", "window_start", name="uq_rate_limits_user_endpoint_window"),
+    )
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    user_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
+    endpoint: Mapped[str] = mapped_column(String(255))
+    period: Mapped[str] = mapped_column(String(10))
+    request_count: Mapped[int] = mapped_column(Integer, default=1)
+    window_start: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    tier_limit: Mapped[int] = mapped_column(Integer)
 
 # alembic revision --autogenerate -m "Add preferences column to users table"
 
@@ -3,13 +3,15 @@ from typing import List
 from fastapi import Depends, HTTPException, status, Path, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from . import models, dependencies, crud
+from . import models, dependencies, crud, membership_cache
+from .audit_logger import log_event
 from .database import get_db
+from .principal_cache import Principal
 from .user_roles import UserRole
 from .project_roles import ProjectRole
 
 
-def is_admin(current_user: models.User = Depends(dependencies.get_current_user)) -> models.User:
+def is_admin(current_user: Principal = Depends(dependencies.get_current_principal)) -> Principal:
     """
     A dependency that checks if the current user is an admin.
     """
@@ -21,57 +23,103 @@ def is_admin(current_user: models.User = Depends(dependencies.get_current_user))
     return current_user
 
 
+async def _check_project_role(
+    request: Request,
+    db: AsyncSession,
+    project_id: uuid.UUID,
+    current_user: Principal,
+    required_roles: List[ProjectRole],
+    check_exists: bool = False
+) -> ProjectRole:
+    """
+    Checks the user's role on a project through the membership cache (one
+    indexed (project_id, user_id) lookup on a miss), whatever the team size.
+    Creates an audit log and raises a 403 on failure.
+    With `check_exists`, a user who isn't a member gets a 404 instead if the
+    project doesn't exist; members never pay for the extra lookup.
+    """
+    role = await membership_cache.get_project_role(db, project_id=project_id, user_id=current_user.id)
+
+    if role is None and check_exists and not await crud.project_exists(db, project_id=project_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Project not found.",
+        )
+
+    if role is None or role not in required_roles:
+        await log_event(
+            action="PROJECT_ACCESS_DENIED",
+            user=current_user,
+            request=request,
+            resource_type="project",
+            resource_id=project_id,
+            details={
+                "reason": "User is not a member or lacks required role.",
+                "required_roles": [required_role.value for required_role in required_roles],
+                "user_role": role.value if role else "not_a_member"
+            }
+        )
+
+        if role is None:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="You are not a member of this project.",
+            )
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"You do not have the required permissions.",
+            )
+
+    return role
+
+
 def require_project_role(required_roles: List[ProjectRole]):
     """
     A dependency factory that checks if the current user has a specific role
     on a project and creates an audit log on failure.
+    Returns the project row without its members; endpoints that return or
+    walk the member list load it themselves.
     """
-    
+
     async def project_role_checker(
         request: Request,
         project_id: uuid.UUID = Path(...),
-        current_user: models.User = Depends(dependencies.get_current_user),
+        current_user: Principal = Depends(dependencies.get_current_principal),
         db: AsyncSession = Depends(get_db)
     ) -> models.Project:
-        
-        project = await crud.get_project_by_id(db, project_id=project_id)
+
+        project = await crud.get_project_without_members(db, project_id=project_id)
         if not project:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Project not found.",
             )
-            
-        membership = next(
-            (m for m in project.member_associations if m.user_id == current_user.id),
-            None
-        )
-        
-        if not membership or membership.role not in required_roles:
-            await crud.create_audit_log(
-                db=db,
-                action="PROJECT_ACCESS_DENIED",
-                user_id=current_user.id,
-                request=request,
-                resource_type="project",
-                resource_id=project_id,
-                details={
-                    "reason": "User is not a member or lacks required role.",
-                    "required_roles": [role.value for role in required_roles],
-                    "user_role": membership.role.value if membership else "not_a_member"
-                }
-            )
-            
-            if not membership:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="You are not a member of this project.",
-                )
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail=f"You do not have the required permissions.",
-                )
-        
+
+        await _check_project_role(request, db, project_id, current_user, required_roles)
         return project
 
-    return project_role_checker
\ No newline at end of file
+    return project_role_checker
+
+
+def require_project_access(required_roles: List[ProjectRole]):
+    """
+    A lighter version of require_project_role for endpoints that want to decide
+    what to load themselves (e.g. to answer a conditional GET with a 304).
+    Checks the membership through the membership cache and returns the
+    project ID, without loading the project or its members. The project's
+    existence is only checked when the membership lookup misses, so a
+    missing project is still a 404.
+    """
+
+    async def project_access_checker(
+        request: Request,
+        project_id: uuid.UUID = Path(...),
+        current_user: Principal = Depends(dependencies.get_current_principal),
+        db: AsyncSession = Depends(get_db)
+    ) -> uuid.UUID:
+
+        await _check_project_role(request, db, project_id, current_user, required_roles, check_exists=True)
+        return project_id
+
+    return project_access_checker
@@ -0,0 +1,110 @@
+# File: apex/backend/app/principal_cache.py
+
+import uuid
+from typing import Optional
+import redis
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from . import models
+from . import cache_manager
+from .cache_codecs import dumps_json, loads_json
+from .cache_manager import async_redis_bytes_client
+from .user_roles import UserRole
+
+# --- Cache layout ---
+# authz:principal:{user_id}   JSON of the fields authorization needs
+# The same key is kept in cache_manager's in-process tier, so an invalidation
+# reaches every API process over the existing pub/sub channel.
+PRINCIPAL_KEY_PREFIX = "authz:principal"
+
+# Every change to these fields invalidates explicitly (see crud), so the TTL
+# only bounds staleness if an invalidation is lost.
+PRINCIPAL_TTL_SECONDS = 60
+
+
+class Principal:
+    """
+    The authenticated user as authorization sees it: enough to check roles,
+    tiers and ownership without loading the users row.
+    """
+
+    __slots__ = ("id", "email", "role", "status", "subscription_tier")
+
+    def __init__(self, id: uuid.UUID, email: str, role: UserRole, status: str, subscription_tier: str):
+        self.id = id
+        self.email = email
+        self.role = role
+        self.status = status
+        self.subscription_tier = subscription_tier
+
+    @classmethod
+    def from_user(cls, user: models.User) -> "Principal":
+        return cls(user.id, user.email, user.role, user.status, user.subscription_tier)
+
+    def to_bytes(self) -> bytes:
+        return dumps_json({
+            "id": str(self.id), "email": self.email, "role": self.role.value,
+            "status": self.status, "subscription_tier": self.subscription_tier,
+        })
+
+    @classmethod
+    def from_bytes(cls, payload: bytes) -> "Principal":
+        data = loads_json(payload)
+        return cls(uuid.UUID(data["id"]), data["email"], UserRole(data["role"]), data["status"], data["subscription_tier"])
+
+
+def _principal_key(user_id: uuid.UUID) -> str:
+    return f"{PRINCIPAL_KEY_PREFIX}:{user_id}"
+
+
+async def get_principal(db: AsyncSession, user_id: uuid.UUID) -> Optional[Principal]:
+    """
+    Returns the principal for a user ID, or None if the user doesn't exist.
+    Served from process memory, then Redis; falls back to one primary key
+    lookup and caches the answer. Missing users are not cached.
+    """
+    key = _principal_key(user_id)
+    local_cache = cache_manager.local_cache
+    if local_cache is not None:
+        cached_principal = local_cache.get(key)
+        if cached_principal is not None:
+            return Principal.from_bytes(cached_principal)
+
+    try:
+        cached_principal = await async_redis_bytes_client.get(key)
+        if cached_principal is not None:
+            if local_cache is not None:
+                local_cache.set(key, cached_principal, PRINCIPAL_TTL_SECONDS)
+            return Principal.from_bytes(cached_principal)
+    except redis.exceptions.RedisError as e:
+        print(f"Error reading principal cache for user {user_id}: {e}")
+
+    query = (
+        select(models.User.id, models.User.email, models.User.role, models.User.status, models.User.subscription_tier)
+        .where(models.User.id == user_id)
+    )
+    row = (await db.execute(query)).one_or_none()
+    if row is None:
+        return None
+    principal = Principal(*row)
+
+    payload = principal.to_bytes()
+    if local_cache is not None:
+        local_cache.set(key, payload, PRINCIPAL_TTL_SECONDS)
+    try:
+        await async_redis_bytes_client.set(key, payload, ex=PRINCIPAL_TTL_SECONDS)
+    except redis.exceptions.RedisError as e:
+        print(f"Error writing principal cache for user {user_id}: {e}")
+
+    return principal
+
+
+async def invalidate_principal(user_id: uuid.UUID):
+    """Drops the cached principal from Redis and from every process's local tier."""
+    key = _principal_key(user_id)
+    try:
+        await async_redis_bytes_client.delete(key)
+    except redis.exceptions.RedisError as e:
+        print(f"Error invalidating principal cache for user {user_id}: {e}")
+    await cache_manager.evict_local_copies([key])
@@ -0,0 +1,302 @@
+# File: apex/backend/app/quotas.py
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+import uuid
+
+import redis
+from fastapi import Depends, HTTPException, status, Request
+from sqlalchemy import select, func, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, dependencies
+from .audit_logger import log_event
+from .cache_manager import async_redis_client
+from .database import AsyncSessionLocal
+from .principal_cache import Principal
+from .rate_limit_config import QUOTA_LIMITS, QUOTA_FLUSH_INTERVAL_SECONDS, QUOTA_FLUSH_BATCH_SIZE
+from .user_roles import UserRole
+
+# --- Redis layout ---
+# quota:{user_id}:{endpoint}:{period}:{window start, YYYYMMDD}   request count
+# quota:dirty   keys of the counters changed since the last flush
+QUOTA_KEY_PREFIX = "quota"
+QUOTA_DIRTY_KEY = f"{QUOTA_KEY_PREFIX}:dirty"
+
+# Counters outlive their window by this much, so the final count is flushed.
+QUOTA_KEY_GRACE_SECONDS = 60 * 60 * 24
+
+# Checks every window's counter and increments all of them only if none is
+# at its limit, so a rejected request never counts.
+# KEYS: counters..., dirty set   ARGV: limits..., ttls...
+# Returns {allowed, index of the exhausted window (1-based) or 0}.
+_check_and_count_script = async_redis_client.register_script("""
+local n = #KEYS - 1
+for i = 1, n do
+    if tonumber(redis.call('get', KEYS[i]) or 0) >= tonumber(ARGV[i]) then
+        return {0, i}
+    end
+end
+for i = 1, n do
+    redis.call('incr', KEYS[i])
+    redis.call('expire', KEYS[i], ARGV[n + i])
+    redis.call('sadd', KEYS[n + 1], KEYS[i])
+end
+return {1, 0}
+""")
+
+# Takes back one request from every window's counter, for a request that
+# failed after it was counted. Never takes a counter below zero.
+# KEYS: counters...
+_refund_script = async_redis_client.register_script("""
+for i = 1, #KEYS do
+    if tonumber(redis.call('get', KEYS[i]) or 0) > 0 then
+        redis.call('decr', KEYS[i])
+    end
+end
+return 1
+""")
+
+PERIOD_NAMES = {"day": "daily", "month": "monthly"}
+
+flush_task: Optional[asyncio.Task] = None
+
+
+def window_bounds(period: str, now: datetime) -> Tuple[datetime, datetime]:
+    """The UTC start and end of the day or calendar month containing `now`."""
+    if period == "day":
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        return start, start + timedelta(days=1)
+    start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def _counter_key(user_id: uuid.UUID, endpoint: str, period: str, window_start: datetime) -> str:
+    return f"{QUOTA_KEY_PREFIX}:{user_id}:{endpoint}:{period}:{window_start:%Y%m%d}"
+
+
+def _quota_windows(user: Principal, endpoint: str, now: datetime) -> List[Dict]:
+    """Every quota window that applies to this user and endpoint right now."""
+    limits = QUOTA_LIMITS.get(user.role, QUOTA_LIMITS[UserRole.FREE_USER]).get(endpoint, {})
+    windows = []
+    for period, limit in limits.items():
+        start, end = window_bounds(period, now)
+        windows.append({
+            "period": period, "limit": limit, "start": start, "end": end,
+            "key": _counter_key(user.id, endpoint, period, start),
+        })
+    return windows
+
+
+def quota(endpoint: str):
+    """
+    A dependency factory that enforces the daily/monthly quotas for an
+    endpoint with a single Redis round trip. Nothing is written to the
+    database per request; usage is flushed in batches.
+
+    The request is counted up front, so concurrent requests can't overshoot
+    the limit, and refunded if anything after this dependency fails: a later
+    dependency (e.g. a 403 from the membership check), the endpoint itself
+    (e.g. a 404) or whatever it enqueues. Only requests that succeed count.
+    """
+
+    async def quota_dependency(
+        request: Request,
+        current_user: Principal = Depends(dependencies.get_current_principal),
+    ):
+        now = datetime.now(timezone.utc)
+        windows = [] if current_user.role == UserRole.ADMIN else _quota_windows(current_user, endpoint, now)
+        if not windows:
+            yield
+            return
+
+        try:
+            allowed, exhausted = await _check_and_count_script(
+                keys=[window["key"] for window in windows] + [QUOTA_DIRTY_KEY],
+                args=(
+                    [window["limit"] for window in windows]
+                    + [int((window["end"] - now).total_seconds()) + QUOTA_KEY_GRACE_SECONDS for window in windows]
+                ),
+            )
+        except redis.exceptions.RedisError as e:
+            # Fail open, like the rate limiter
+            print(f"Error checking quota for {endpoint}: {e}")
+            yield
+            return
+
+        if not allowed:
+            window = windows[int(exhausted) - 1]
+            await log_event(
+                action="QUOTA_EXCEEDED",
+                user=current_user,
+                request=request,
+                details={"endpoint": endpoint, "period": window["period"], "limit": window["limit"]}
+            )
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=f"Your {PERIOD_NAMES[window['period']]} quota for {endpoint} ({window['limit']}) has been used up.",
+                headers={"Retry-After": str(int((window["end"] - now).total_seconds()) + 1)},
+            )
+
+        try:
+            yield
+        except Exception:
+            await _refund(endpoint, windows)
+            raise
+
+    return quota_dependency
+
+
+async def _refund(endpoint: str, windows: List[Dict]):
+    try:
+        await _refund_script(keys=[window["key"] for window in windows])
+    except redis.exceptions.RedisError as e:
+        print(f"Error refunding quota for {endpoint}: {e}")
+
+
+async def get_usage(db: AsyncSession, user: Principal) -> Dict[str, Dict[str, Dict]]:
+    """
+    Current usage of every quota that applies to the user, from the Redis
+    counters. Windows whose counter is gone (e.g. after a Redis restart) fall
+    back to the last flushed count in rate_limits.
+    """
+    now = datetime.now(timezone.utc)
+    windows = [
+        (endpoint, window)
+        for endpoint in QUOTA_LIMITS.get(user.role, QUOTA_LIMITS[UserRole.FREE_USER])
+        for window in _quota_windows(user, endpoint, now)
+    ]
+    if not windows:
+        return {}
+
+    try:
+        counts = await async_redis_client.mget([window["key"] for _, window in windows])
+    except redis.exceptions.RedisError as e:
+        print(f"Error reading quota counters: {e}")
+        counts = [None] * len(windows)
+
+    missing = [(endpoint, window) for (endpoint, window), count in zip(windows, counts) if count is None]
+    flushed = {}
+    if missing:
+        query = (
+            select(models.RateLimit.endpoint, models.RateLimit.period, models.RateLimit.request_count)
+            .where(models.RateLimit.user_id == user.id)
+            .where(tuple_(models.RateLimit.endpoint, models.RateLimit.period, models.RateLimit.window_start).in_(
+                [(endpoint, window["period"], window["start"]) for endpoint, window in missing]
+            ))
+        )
+        flushed = {(endpoint, period): count for endpoint, period, count in (await db.execute(query)).all()}
+
+    usage: Dict[str, Dict[str, Dict]] = {}
+    for (endpoint, window), count in zip(windows, counts):
+        used = int(count) if count is not None else flushed.get((endpoint, window["period"]), 0)
+        usage.setdefault(endpoint, {})[window["period"]] = {
+            "used": used, "limit": window["limit"], "resets_at": window["end"],
+        }
+    return usage
+
+
+# --- Batched persistence ---
+
+def _parse_counter_key(key: str) -> Dict:
+    _, user_id, endpoint, period, window_start = key.split(":")
+    return {
+        "user_id": uuid.UUID(user_id),
+        "endpoint": endpoint,
+        "period": period,
+        "window_start": datetime.strptime(window_start, "%Y%m%d").replace(tzinfo=timezone.utc),
+    }
+
+
+async def flush_quota_counters() -> int:
+    """
+    Writes every counter changed since the last flush to rate_limits in one
+    batched upsert. SPOP hands each changed counter to exactly one node.
+    Each row's tier_limit is the user's current limit, looked up here, so a
+    tier change mid-window still yields one row per counter.
+    Returns the number of rows written.
+    """
+    members = await async_redis_client.spop(QUOTA_DIRTY_KEY, QUOTA_FLUSH_BATCH_SIZE)
+    if not members:
+        return 0
+
+    # Members written before the set held bare keys look like "{key}|{limit}";
+    # deduplicate, since the upsert can't touch the same row twice
+    keys = list(dict.fromkeys(member.partition("|")[0] for member in members))
+    parsed = [_parse_counter_key(key) for key in keys]
+    counts = await async_redis_client.mget(keys)
+
+    try:
+        async with AsyncSessionLocal() as session:
+            user_ids = {row["user_id"] for row in parsed}
+            roles = dict((await session.execute(
+                select(models.User.id, models.User.role).where(models.User.id.in_(user_ids))
+            )).all())
+
+            rows = []
+            for row, count in zip(parsed, counts):
+                if count is None or row["user_id"] not in roles:
+                    continue
+                limits = QUOTA_LIMITS.get(roles[row["user_id"]], QUOTA_LIMITS[UserRole.FREE_USER])
+                # The user's current tier may not have this quota at all (e.g. now an admin)
+                tier_limit = limits.get(row["endpoint"], {}).get(row["period"])
+                if tier_limit is not None:
+                    rows.append({**row, "request_count": int(count), "tier_limit": tier_limit})
+            if not rows:
+                return 0
+
+            statement = insert(models.RateLimit).values(rows)
+            statement = statement.on_conflict_do_update(
+                constraint="uq_rate_limits_user_endpoint_window",
+                set_={
+                    # Never move a count backwards, e.g. if Redis lost a counter mid-window.
+                    # Intended consequence: a refund (see quota) that lands after its
+                    # count was flushed isn't reflected here until the Redis counter
+                    # passes the stored count again. Redis stays authoritative while
+                    # its counter exists, so this only matters once it is gone.
+                    "request_count": func.greatest(models.RateLimit.request_count, statement.excluded.request_count),
+                    "tier_limit": statement.excluded.tier_limit,
+                },
+            )
+            await session.execute(statement)
+            await session.commit()
+    except Exception:
+        # Put them back so the next flush retries
+        await async_redis_client.sadd(QUOTA_DIRTY_KEY, *keys)
+        raise
+    return len(rows)
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(QUOTA_FLUSH_INTERVAL_SECONDS)
+        try:
+            # Keep going while full batches come back, so a backlog drains in one tick
+            while await flush_quota_counters() >= QUOTA_FLUSH_BATCH_SIZE:
+                pass
+        except Exception as e:
+            print(f"Error flushing quota counters: {e}")
+
+
+async def start_quota_flusher():
+    global flush_task
+    if flush_task is None:
+        flush_task = asyncio.create_task(_flush_loop())
+
+
+async def stop_quota_flusher():
+    global flush_task
+    if flush_task is not None:
+        flush_task.cancel()
+        try:
+            await flush_task
+        except asyncio.CancelledError:
+            pass
+        flush_task = None
+    try:
+        await flush_quota_counters()
+    except Exception as e:
+        print(f"Error flushing quota counters on shutdown: {e}")
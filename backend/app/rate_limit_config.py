@@ -1,5 +1,6 @@
 # File: apex/backend/app/rate_limit_config.py
 
+import os
 from .user_roles import UserRole
 
 # Default rate limits per user tier
@@ -22,4 +23,49 @@ ENDPOINT_LIMITS = {
         "bucket_size": 10,
         "refill_rate_per_minute": 5
     }
-}
\ No newline at end of file
+}
+# --- Local token leasing ---
+# For large buckets, each API process takes a small batch of tokens from the
+# central Redis bucket and spends them in memory, topping the batch up in the
+# background before it runs out. This takes the Redis round trip off almost
+# every request for high-rate users.
+RATE_LIMIT_LEASING_ENABLED = os.getenv("RATE_LIMIT_LEASING_ENABLED", "true").lower() == "true"
+
+# Only buckets at least this large are leased; smaller ones (free tier, login)
+# keep exact per-request accounting.
+RATE_LIMIT_LEASE_MIN_BUCKET_SIZE = 50
+
+# A lease holds at most this fraction of the bucket. Leased tokens were already
+# taken from the central bucket, so the total spent never exceeds the limit;
+# the overshoot is only in timing: a burst can spend up to one lease per
+# process on top of what the central bucket would allow at that instant.
+RATE_LIMIT_LEASE_FRACTION = 0.1
+
+# Unspent leased tokens are returned to the central bucket after this long
+# (capped at its capacity), which bounds how late a token can be spent
+# relative to when it was taken without losing the tokens a quiet process held.
+RATE_LIMIT_LEASE_MAX_AGE_SECONDS = 5
+
+# A background top-up starts once a lease falls to this fraction of its size.
+RATE_LIMIT_LEASE_REFILL_THRESHOLD = 0.5
+
+# Expired leases are pruned once this many are held in a process.
+RATE_LIMIT_MAX_LEASES = 10_000
+
+# --- Long-window quotas ---
+# Plan limits per tier and endpoint, per UTC day and UTC calendar month.
+# Counted in Redis on every request and flushed to the rate_limits table in
+# periodic batches.
+QUOTA_LIMITS = {
+    UserRole.FREE_USER: {
+        "reviews": {"day": 20, "month": 200},
+    },
+    UserRole.PREMIUM_USER: {
+        "reviews": {"day": 500, "month": 5000},
+    },
+}
+
+# How often each API process flushes changed counters to the database, and
+# the most rows written in one upsert.
+QUOTA_FLUSH_INTERVAL_SECONDS = 60
+QUOTA_FLUSH_BATCH_SIZE = 500
@@ -1,18 +1,250 @@
 # File: apex/backend/app/rate_limiter.py
 
+import asyncio
 import time
 import redis
-import os
 from fastapi import Depends, HTTPException, status, Response, Request # <-- ADD Request
-from dotenv import load_dotenv
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
 from . import models, dependencies, crud # <-- ADD crud
 from .user_roles import UserRole
-from .rate_limit_config import TIER_LIMITS, ENDPOINT_LIMITS
+from .rate_limit_config import (
+    TIER_LIMITS, ENDPOINT_LIMITS,
+    RATE_LIMIT_LEASING_ENABLED, RATE_LIMIT_LEASE_MIN_BUCKET_SIZE, RATE_LIMIT_LEASE_FRACTION,
+    RATE_LIMIT_LEASE_MAX_AGE_SECONDS, RATE_LIMIT_LEASE_REFILL_THRESHOLD, RATE_LIMIT_MAX_LEASES,
+)
 from .audit_logger import log_event # <-- ADD THIS IMPORT
-from .database import get_db # <-- ADD THIS IMPORT
-from sqlalchemy.ext.asyncio import AsyncSession # <-- ADD THIS IMPORT
+from .cache_manager import async_redis_client
+from .principal_cache import Principal
+
+RATE_LIMIT_KEY_PREFIX = "rate_limit"
+
+# Refills and spends a token bucket in one atomic step, on Redis's clock, so
+# concurrent requests (on any node) can never overspend it.
+# Grants between `minimum` and `requested` tokens, as many as are available.
+# KEYS: bucket   ARGV: bucket size, refill rate per second, tokens requested, minimum
+# Returns {granted, tokens left, seconds until the minimum could be granted}.
+_token_bucket_script = async_redis_client.register_script("""
+local now = redis.call('time')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local bucket_size, refill_rate = tonumber(ARGV[1]), tonumber(ARGV[2])
+local requested, minimum = tonumber(ARGV[3]), tonumber(ARGV[4])
+
+local bucket = redis.call('hmget', KEYS[1], 'tokens', 'last_refilled_at')
+local tokens, last_refilled_at = tonumber(bucket[1]), tonumber(bucket[2])
+if tokens == nil or last_refilled_at == nil then
+    tokens, last_refilled_at = bucket_size, now
+end
+tokens = math.min(bucket_size, tokens + math.max(0, now - last_refilled_at) * refill_rate)
+
+local granted = math.min(requested, math.floor(tokens))
+if granted < minimum then
+    granted = 0
+end
+tokens = tokens - granted
+redis.call('hset', KEYS[1], 'tokens', tostring(tokens), 'last_refilled_at', tostring(now))
+-- Once the bucket would be full again, the key carries no information
+redis.call('expire', KEYS[1], math.ceil((bucket_size - tokens) / refill_rate) + 1)
+
+local retry_after = 0
+if granted == 0 then
+    retry_after = math.ceil((minimum - tokens) / refill_rate)
+end
+return {granted, tostring(tokens), retry_after}
+""")
+
+# Gives unspent tokens back to a bucket, up to its size.
+# KEYS: bucket   ARGV: bucket size, tokens returned
+_return_tokens_script = async_redis_client.register_script("""
+local tokens = tonumber(redis.call('hget', KEYS[1], 'tokens'))
+if tokens == nil then
+    return 0
+end
+redis.call('hset', KEYS[1], 'tokens', tostring(math.min(tonumber(ARGV[1]), tokens + tonumber(ARGV[2]))))
+return 1
+""")
+
+
+async def take_tokens(
+    redis_key: str, bucket_size: int, refill_rate_per_minute: float, requested: int = 1, minimum: Optional[int] = None
+) -> Tuple[int, float, int]:
+    """
+    Takes `requested` tokens from a bucket in one round trip, or as many as
+    are available if that is at least `minimum` (by default, all or nothing).
+    Returns (tokens granted, tokens left, seconds to wait before retrying).
+    """
+    granted, tokens_left, retry_after = await _token_bucket_script(
+        keys=[redis_key], args=[bucket_size, refill_rate_per_minute / 60, requested, minimum or requested]
+    )
+    return int(granted), float(tokens_left), int(retry_after)
+
+
+class TokenLease:
+    """
+    Tokens this process has taken from one central bucket and not yet spent.
+    Requests spend them without touching Redis; a background top-up keeps the
+    lease from running dry while the bucket has tokens to give. Tokens still
+    unspent when the lease expires go back to the bucket.
+    """
+
+    def __init__(self, redis_key: str, bucket_size: int, refill_rate_per_minute: float):
+        self.redis_key = redis_key
+        self.bucket_size = bucket_size
+        self.refill_rate_per_minute = refill_rate_per_minute
+        self.size = max(1, int(bucket_size * RATE_LIMIT_LEASE_FRACTION))
+        self.tokens = 0
+        self.central_tokens = 0.0
+        self.expires_at = 0.0
+        self.refill_task: Optional[asyncio.Task] = None
+        # The one lease request in flight; concurrent callers wait for it
+        # instead of each taking a batch of their own
+        self.acquire_task: Optional[asyncio.Task] = None
+        self.expiry_handle: Optional[asyncio.TimerHandle] = None
+
+    def is_expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def is_idle(self) -> bool:
+        return self.is_expired() and self.tokens <= 0 and self.refill_task is None and self.acquire_task is None
+
+    def remaining(self) -> int:
+        """Approximate tokens left across the central bucket and this lease."""
+        return int(self.central_tokens) + self.tokens
+
+    def try_spend(self) -> bool:
+        """Spends a leased token if there is one, starting a top-up when the lease runs low."""
+        if self.is_expired():
+            self._expire()
+        if self.tokens <= 0:
+            return False
+        self.tokens -= 1
+        if self.tokens <= self.size * RATE_LIMIT_LEASE_REFILL_THRESHOLD and self.refill_task is None:
+            self.refill_task = asyncio.ensure_future(self._top_up())
+        return True
+
+    async def acquire(self) -> Tuple[bool, int]:
+        """
+        Spends a token once the lease has been refilled from Redis. Only one
+        refill runs at a time; callers that find it running wait for it.
+        Returns (allowed, seconds to wait before retrying).
+        """
+        while True:
+            if self.try_spend():
+                return True, 0
+            if self.acquire_task is None:
+                self.acquire_task = asyncio.ensure_future(self._lease_batch())
+            granted, retry_after = await asyncio.shield(self.acquire_task)
+            if not granted:
+                return False, retry_after
+
+    async def _lease_batch(self) -> Tuple[int, int]:
+        try:
+            granted, tokens_left, retry_after = await take_tokens(
+                self.redis_key, self.bucket_size, self.refill_rate_per_minute, requested=self.size, minimum=1
+            )
+            if granted:
+                self._add(granted, tokens_left)
+            return granted, retry_after
+        finally:
+            self.acquire_task = None
+
+    async def _top_up(self):
+        try:
+            granted, tokens_left, _ = await take_tokens(
+                self.redis_key, self.bucket_size, self.refill_rate_per_minute,
+                requested=self.size - max(self.tokens, 0), minimum=1,
+            )
+            if granted:
+                self._add(granted, tokens_left)
+        except redis.exceptions.RedisError as e:
+            print(f"Error topping up rate limit lease for key {self.redis_key}: {e}")
+        finally:
+            self.refill_task = None
+
+    def _add(self, tokens: int, central_tokens: float):
+        if self.is_expired():
+            self._expire()
+        self.tokens += tokens
+        self.central_tokens = central_tokens
+        self.expires_at = time.monotonic() + RATE_LIMIT_LEASE_MAX_AGE_SECONDS
+        if self.expiry_handle is None:
+            self.expiry_handle = asyncio.get_running_loop().call_later(RATE_LIMIT_LEASE_MAX_AGE_SECONDS, self._on_expiry)
+
+    def _on_expiry(self):
+        self.expiry_handle = None
+        delay = self.expires_at - time.monotonic()
+        if delay > 0:
+            # Extended since the timer was set
+            self.expiry_handle = asyncio.get_running_loop().call_later(delay, self._on_expiry)
+            return
+        self._expire()
+
+    def _expire(self):
+        """Hands the unspent tokens of an expired lease back to the central bucket."""
+        tokens, self.tokens = self.tokens, 0
+        if tokens > 0:
+            asyncio.ensure_future(self._return_tokens(tokens))
+
+    async def _return_tokens(self, tokens: int):
+        try:
+            await _return_tokens_script(keys=[self.redis_key], args=[self.bucket_size, tokens])
+        except redis.exceptions.RedisError as e:
+            print(f"Error returning leased tokens for key {self.redis_key}: {e}")
+
+    async def release(self):
+        """Gives unspent tokens back to the central bucket."""
+        if self.expiry_handle is not None:
+            self.expiry_handle.cancel()
+            self.expiry_handle = None
+        for task in (self.acquire_task, self.refill_task):
+            if task is not None:
+                try:
+                    await task
+                except redis.exceptions.RedisError:
+                    pass
+        if self.tokens > 0:
+            await _return_tokens_script(keys=[self.redis_key], args=[self.bucket_size, self.tokens])
+        self.tokens = 0
+
+
+# This process's leases, by bucket key
+_leases: Dict[str, TokenLease] = {}
+
+
+def _get_lease(redis_key: str, bucket_size: int, refill_rate_per_minute: float) -> TokenLease:
+    lease = _leases.get(redis_key)
+    if lease is None:
+        if len(_leases) >= RATE_LIMIT_MAX_LEASES:
+            for key in [key for key, held in _leases.items() if held.is_idle()]:
+                del _leases[key]
+        lease = _leases[redis_key] = TokenLease(redis_key, bucket_size, refill_rate_per_minute)
+    return lease
+
+
+async def release_leases():
+    """Returns every unspent leased token to Redis. Called on shutdown."""
+    leases = list(_leases.values())
+    _leases.clear()
+    for lease in leases:
+        try:
+            await lease.release()
+        except redis.exceptions.RedisError as e:
+            print(f"Error returning leased tokens for key {lease.redis_key}: {e}")
+
+
+async def _check_bucket(redis_key: str, limits: Dict[str, int]) -> Tuple[bool, int, int]:
+    """
+    Spends one token for a request, from a local lease for large buckets and
+    directly from Redis otherwise. Returns (allowed, remaining, retry after).
+    """
+    bucket_size = limits["bucket_size"]
+    if RATE_LIMIT_LEASING_ENABLED and bucket_size >= RATE_LIMIT_LEASE_MIN_BUCKET_SIZE:
+        lease = _get_lease(redis_key, bucket_size, limits["refill_rate_per_minute"])
+        allowed, retry_after = (True, 0) if lease.try_spend() else await lease.acquire()
+        return allowed, lease.remaining(), retry_after
+
+    granted, tokens_left, retry_after = await take_tokens(redis_key, bucket_size, limits["refill_rate_per_minute"])
+    return bool(granted), int(tokens_left), retry_after
 
 
 def rate_limit(endpoint_name: Optional[str] = None):
@@ -23,47 +255,34 @@ def rate_limit(endpoint_name: Optional[str] = None):
     async def rate_limit_dependency(
         response: Response,
         request: Request, # <-- ADD request
-        current_user: models.User = Depends(dependencies.get_current_user),
-        db: AsyncSession = Depends(get_db) # <-- ADD db session
+        current_user: Principal = Depends(dependencies.get_current_principal),
     ):
         if current_user.role == UserRole.ADMIN:
             return
 
         if endpoint_name and endpoint_name in ENDPOINT_LIMITS:
             limits = ENDPOINT_LIMITS[endpoint_name]
-            redis_key = f"rate_limit:{current_user.id}:{endpoint_name}"
+            redis_key = f"{RATE_LIMIT_KEY_PREFIX}:{current_user.id}:{endpoint_name}"
         else:
             limits = TIER_LIMITS.get(current_user.role, TIER_LIMITS[UserRole.FREE_USER])
-            redis_key = f"rate_limit:{current_user.id}:general"
+            redis_key = f"{RATE_LIMIT_KEY_PREFIX}:{current_user.id}:general"
 
         bucket_size = limits["bucket_size"]
-        refill_rate = limits["refill_rate_per_minute"] / 60
-
-        current_time = time.time()
-        user_bucket = redis_client.hgetall(redis_key)
-        
-        if not user_bucket:
-            tokens = float(bucket_size - 1)
-            last_refilled_at = current_time
-        else:
-            tokens = float(user_bucket[b'tokens'])
-            last_refilled_at = float(user_bucket[b'last_refilled_at'])
 
-        time_delta = current_time - last_refilled_at
-        tokens_to_add = time_delta * refill_rate
-        tokens = min(tokens + tokens_to_add, bucket_size)
-        last_refilled_at = current_time
+        try:
+            allowed, remaining, retry_after = await _check_bucket(redis_key, limits)
+        except redis.exceptions.RedisError as e:
+            # Fail open: an unavailable limiter shouldn't take the API down with it
+            print(f"Error checking rate limit for key {redis_key}: {e}")
+            return
 
-        if tokens >= 1:
-            tokens -= 1
-            redis_client.hmset(redis_key, {"tokens": tokens, "last_refilled_at": last_refilled_at})
+        if allowed:
             response.headers["X-RateLimit-Limit"] = str(bucket_size)
-            response.headers["X-RateLimit-Remaining"] = str(int(tokens))
+            response.headers["X-RateLimit-Remaining"] = str(remaining)
         else:
             # --- MONITORING AND ALERTING LOGIC ---
             # Before we block the user, we log the event.
             await log_event(
-                db=db,
                 action="RATE_LIMIT_EXCEEDED",
                 user=current_user,
                 request=request,
@@ -78,7 +297,7 @@ def rate_limit(endpoint_name: Optional[str] = None):
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail=f"Rate limit exceeded.",
-                headers={"Retry-After": "60"},
+                headers={"Retry-After": str(max(retry_after, 1))},
             )
 
     return rate_limit_dependency
\ No newline at end of file
@@ -63,6 +63,23 @@ class ProjectRead(BaseModel):
     member_associations: List[ProjectMemberRead]
     class Config: from_attributes = True
 
+class ProjectListItem(BaseModel):
+    """A project in the listing: the caller's role and a member count instead of the members."""
+    id: uuid.UUID
+    name: str
+    description: Optional[str]
+    role: ProjectRole
+    member_count: int
+    created_at: datetime
+    updated_at: datetime
+    class Config: from_attributes = True
+
+class ProjectPage(BaseModel):
+    # ProjectListItem fields, possibly narrowed by `fields=`
+    items: List[Dict[str, Any]]
+    # Pass as `cursor` to get the next page; None on the last page
+    next_cursor: Optional[str] = None
+
 # ======================================================================================
 # Other Schemas (Unchanged)
 # ======================================================================================
@@ -84,6 +101,11 @@ class UserStats(BaseModel):
     review_count: int
     snippets_analyzed: int
 
+class QuotaWindowUsage(BaseModel):
+    used: int
+    limit: int
+    resets_at: datetime
+
 class SubscriptionUpdate(BaseModel):
     subscription_tier: str
 
@@ -1,16 +1,32 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Any, Callable, Dict, Optional
 import os
+import time
 from dotenv import load_dotenv
 from jose import JWTError, jwt
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
+import hashlib
+import hmac
 import secrets
 
 load_dotenv()
 
+from .cache_metrics import LatencyHistogram
+
 # --- Password Hashing Setup ---
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt takes tens to hundreds of milliseconds of CPU per call, so the async
+# variants run it on a small dedicated thread pool (bcrypt releases the GIL)
+# instead of the event loop. At most PASSWORD_HASH_MAX_PENDING calls may be
+# queued or running; past that, requests get a 503 instead of piling up.
+PASSWORD_HASH_WORKERS = max(2, (os.cpu_count() or 2) // 2)
+PASSWORD_HASH_MAX_PENDING = 64
+PASSWORD_HASH_RETRY_AFTER_SECONDS = 1
+
 # --- JWT Configuration ---
 SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 ALGORITHM = "HS256"
@@ -23,6 +39,12 @@ CSRF_SECRET_KEY = os.getenv("CSRF_SECRET_KEY")
 if not SECRET_KEY or not CSRF_SECRET_KEY:
     raise ValueError("Missing JWT_SECRET_KEY or CSRF_SECRET_KEY in environment!")
 
+# --- Token Digest Configuration ---
+# Refresh and password reset tokens are random, high-entropy strings, so they
+# are stored as a keyed HMAC-SHA256 digest instead of a bcrypt hash: the digest
+# is deterministic, which lets a token be found with one indexed lookup.
+TOKEN_HASH_SECRET_KEY = os.getenv("TOKEN_HASH_SECRET_KEY", SECRET_KEY)
+
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -30,6 +52,77 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+
+# --- Async Password Hashing ---
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_pending_password_operations = 0
+
+# Per operation ("hash", "verify"): time spent queued for a worker, time
+# spent hashing, and how many calls completed or were shed, for this process
+password_hash_latencies: Dict[str, Dict[str, LatencyHistogram]] = {
+    operation: {"queue_wait": LatencyHistogram(), "run": LatencyHistogram()}
+    for operation in ("hash", "verify")
+}
+password_hash_stats: Dict[str, Dict[str, int]] = {
+    operation: {"completed": 0, "rejected": 0} for operation in ("hash", "verify")
+}
+
+
+async def _run_password_operation(operation: str, func: Callable, *args) -> Any:
+    global _pending_password_operations
+    if _pending_password_operations >= PASSWORD_HASH_MAX_PENDING:
+        password_hash_stats[operation]["rejected"] += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The server is busy. Please try again shortly.",
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER_SECONDS)},
+        )
+
+    def timed_call():
+        started = time.perf_counter()
+        return func(*args), started, time.perf_counter()
+
+    _pending_password_operations += 1
+    queued = time.perf_counter()
+    try:
+        result, started, finished = await asyncio.get_running_loop().run_in_executor(_password_executor, timed_call)
+    finally:
+        _pending_password_operations -= 1
+    password_hash_latencies[operation]["queue_wait"].observe((started - queued) * 1000)
+    password_hash_latencies[operation]["run"].observe((finished - started) * 1000)
+    password_hash_stats[operation]["completed"] += 1
+    return result
+
+
+async def hash_password_async(password: str) -> str:
+    """hash_password on the password hashing pool. Raises a 503 HTTPException when the pool is saturated."""
+    return await _run_password_operation("hash", pwd_context.hash, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the password hashing pool. Raises a 503 HTTPException when the pool is saturated."""
+    return await _run_password_operation("verify", pwd_context.verify, plain_password, hashed_password)
+
+
+def get_password_hash_report() -> Dict[str, Any]:
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "max_pending": PASSWORD_HASH_MAX_PENDING,
+        "pending": _pending_password_operations,
+        "operations": {
+            operation: {
+                **password_hash_stats[operation],
+                "latency": {name: histogram.snapshot() for name, histogram in histograms.items()},
+            }
+            for operation, histograms in password_hash_latencies.items()
+        },
+    }
+
+def hash_token(token: str) -> str:
+    return hmac.new(TOKEN_HASH_SECRET_KEY.encode(), token.encode(), hashlib.sha256).hexdigest()
+
+def verify_token_hash(token: str, token_hash: str) -> bool:
+    return hmac.compare_digest(hash_token(token), token_hash)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -43,7 +136,9 @@ def create_refresh_token(data: dict) -> str:
     expires_delta = timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     expire = datetime.now(timezone.utc) + expires_delta
     to_encode = data.copy()
-    to_encode.update({"exp": expire})
+    # A random ID makes every refresh token unique, even for two logins in the
+    # same second; it is stored by its (deterministic) digest under a unique index
+    to_encode.update({"exp": expire, "jti": secrets.token_urlsafe()})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def generate_secure_token(length: int = 32) -> str:
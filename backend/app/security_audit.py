@@ -7,74 +7,87 @@ import asyncio
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
 
 from sqlalchemy import select, func
-from sqlalchemy.ext.asyncio import AsyncSession
 
 # It's important to import these after setting the path
-from app.database import get_db, engine
-from app.models import AuditLog
+from app.database import AsyncSessionLocal, engine
+from app.models import AuditActionRollup, AuditIpFailureRollup
+from app.audit_maintenance import current_hour, refresh_recent_rollups
+
+SUSPICIOUS_ACTIONS = ['LOGIN_FAILURE', 'PROJECT_ACCESS_DENIED', 'RATE_LIMIT_EXCEEDED']
+
+
+async def _fetch(query):
+    # Each query gets its own session so they can run concurrently
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(query)).all()
 
 
 async def generate_daily_security_report():
     """
-    Connects to the database and generates a security report from the audit logs
-    of the last 24 hours.
+    Generates a security report for the last 24 hours from the hourly audit
+    rollups. It reads at most 24 buckets per query, so it takes the same time
+    however much history audit_logs holds.
     """
     print("--- Generating Daily Security Audit Report ---")
-    
-    # We need to manage the DB session manually in a script
-    db: AsyncSession = await anext(get_db())
-    
+
     try:
-        # Define the time window for the report
+        # Make sure the most recent hours include everything logged so far
+        await refresh_recent_rollups()
+
+        # The last 24 hourly buckets, including the current one
+        start_time = current_hour() - timedelta(hours=23)
         end_time = datetime.now(timezone.utc)
-        start_time = end_time - timedelta(days=1)
-        
+
         print(f"Report for period: {start_time.isoformat()} to {end_time.isoformat()}\n")
-        
+
         # 1. Count total events
-        total_events_query = select(func.count(AuditLog.id)).where(AuditLog.timestamp.between(start_time, end_time))
-        total_events = (await db.execute(total_events_query)).scalar_one()
-        print(f"Total Security-Related Events Logged: {total_events}")
-        
+        total_events_query = (
+            select(func.coalesce(func.sum(AuditActionRollup.event_count), 0))
+            .where(AuditActionRollup.bucket_start >= start_time)
+        )
         # 2. Find most common suspicious actions
         action_query = (
-            select(AuditLog.action, func.count(AuditLog.action).label("count"))
-            .where(AuditLog.timestamp.between(start_time, end_time))
-            .where(AuditLog.action.in_(['LOGIN_FAILURE', 'PROJECT_ACCESS_DENIED', 'RATE_LIMIT_EXCEEDED']))
-            .group_by(AuditLog.action)
-            .order_by(func.count(AuditLog.action).desc())
+            select(AuditActionRollup.action, func.sum(AuditActionRollup.event_count).label("count"))
+            .where(AuditActionRollup.bucket_start >= start_time)
+            .where(AuditActionRollup.action.in_(SUSPICIOUS_ACTIONS))
+            .group_by(AuditActionRollup.action)
+            .order_by(func.sum(AuditActionRollup.event_count).desc())
         )
+        # 3. Identify IPs with the most failed logins (potential brute-force)
+        failed_login_ips_query = (
+            select(AuditIpFailureRollup.ip_address, func.sum(AuditIpFailureRollup.failure_count).label("count"))
+            .where(AuditIpFailureRollup.bucket_start >= start_time)
+            .where(AuditIpFailureRollup.action == 'LOGIN_FAILURE')
+            .group_by(AuditIpFailureRollup.ip_address)
+            .order_by(func.sum(AuditIpFailureRollup.failure_count).desc())
+            .limit(5)
+        )
+
+        total_rows, suspicious_actions, top_ips = await asyncio.gather(
+            _fetch(total_events_query), _fetch(action_query), _fetch(failed_login_ips_query)
+        )
+
+        print(f"Total Security-Related Events Logged: {total_rows[0][0]}")
+
         print("\n--- Suspicious Activity Breakdown ---")
-        suspicious_actions = (await db.execute(action_query)).all()
         if not suspicious_actions:
             print("No suspicious activity detected in the last 24 hours.")
         else:
             for action, count in suspicious_actions:
                 print(f"- {action}: {count} occurrences")
 
-        # 3. Identify IPs with the most failed logins (potential brute-force)
-        failed_login_ips_query = (
-            select(AuditLog.ip_address, func.count(AuditLog.id).label("count"))
-            .where(AuditLog.timestamp.between(start_time, end_time))
-            .where(AuditLog.action == 'LOGIN_FAILURE')
-            .group_by(AuditLog.ip_address)
-            .order_by(func.count(AuditLog.id).desc())
-            .limit(5)
-        )
         print("\n--- Top 5 IPs with Failed Logins ---")
-        top_ips = (await db.execute(failed_login_ips_query)).all()
         if not top_ips:
             print("No failed logins recorded.")
         else:
             for ip, count in top_ips:
                 print(f"- IP: {ip}, Attempts: {count}")
-        
+
     finally:
-        await db.close()
         # It's crucial to dispose of the engine in a standalone script
         await engine.dispose()
 
 if __name__ == "__main__":
     print("Starting security audit report generation...")
     asyncio.run(generate_daily_security_report())
-    print("Report generation complete.")
\ No newline at end of file
+    print("Report generation complete.")
@@ -11,6 +11,7 @@ from .security_analyzer import run_security_analysis
 from .performance_analyzer import run_performance_analysis
 from .code_quality_analyzer import run_code_quality_analysis
 from .openai_client import get_ai_analysis
+from .audit_maintenance import run_audit_maintenance
 
 async def analyze_code_task(ctx, review_id: uuid.UUID):
     """
@@ -31,6 +32,15 @@ async def analyze_code_task(ctx, review_id: uuid.UUID):
         await crud.update_snippet_metrics(db, snippet, metrics)
         print("   -> (1/5) Preprocessing complete.")
 
+        # Identical code (after normalization) was already reviewed in this project,
+        # by the current analyzers and prompt: reuse its results
+        cached_results = await crud.get_cached_review_results(db, snippet.project_id, metrics["normalized_hash"])
+        if cached_results is not None:
+            await crud.update_review_status_and_results(db=db, review=review, new_status="completed", results=cached_results)
+            await manager.broadcast_to_review(review_id, {"status": "completed", "progress": 100, "stage": "Done!", "results": cached_results})
+            print(f"-> ✅ Reused cached results for review: {review_id}.")
+            return
+
         await manager.broadcast_to_review(review_id, {"status": "processing", "progress": 30, "stage": "Scanning for security vulnerabilities..."})
         security_report = run_security_analysis(snippet.content)
         print("   -> (2/5) Security scan complete.")
@@ -53,9 +63,10 @@ async def analyze_code_task(ctx, review_id: uuid.UUID):
         )
         print("   -> (5/5) Received summary from AI.")
 
-        final_results = {**static_analysis_results, "ai_summary": ai_summary}
+        final_results = {**static_analysis_results, "ai_summary": ai_summary, "analysis_version": crud.ANALYSIS_VERSION}
         await crud.update_review_status_and_results(db=db, review=review, new_status="completed", results=final_results)
         print(f"   -> (6/6) Saved all analysis results to the database.")
+        await crud.cache_review_results(snippet.project_id, metrics["normalized_hash"], final_results)
 
         await manager.broadcast_to_review(review_id, {"status": "completed", "progress": 100, "stage": "Done!", "results": final_results})
         print(f"-> ✅ Analysis pipeline complete for review: {review_id}.")
@@ -66,4 +77,14 @@ async def analyze_code_task(ctx, review_id: uuid.UUID):
         if 'review' in locals() and review:
             await crud.update_review_status_and_results(db=db, review=review, new_status="failed", error_message=str(e))
     finally:
-        await db.close()
\ No newline at end of file
+        await db.close()
+
+
+async def maintain_audit_logs_task(ctx):
+    """
+    Hourly cron job: keeps audit_logs partitions ahead of time, drops expired
+    ones, and refreshes the hourly rollups the security report reads.
+    """
+    print("-> Running audit log maintenance...")
+    await run_audit_maintenance()
+    print("-> ✅ Audit log maintenance complete.")
@@ -0,0 +1,83 @@
+# File: apex/backend/app/websocket_config.py
+
+# This file contains the tuning knobs for our WebSocket delivery layer.
+
+# ==============================================================================
+# 1. Per-Connection Send Queues
+# ==============================================================================
+# Every connected client gets its own bounded outbound queue and writer task,
+# so one slow socket can never hold up delivery to everybody else.
+
+# Maximum number of messages waiting to be written to a single client.
+SEND_QUEUE_MAX_SIZE = 64
+
+# If a single send to a client takes longer than this, the client is treated
+# as a slow consumer and disconnected.
+SEND_TIMEOUT_SECONDS = 10
+
+# Close code used when we drop a slow consumer (1013 = "Try Again Later").
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+# ==============================================================================
+# 2. Resumable Review Progress (Redis Streams)
+# ==============================================================================
+# Every review update is appended to a capped Redis Stream so clients that
+# connect late, or reconnect after a blip, can replay what they missed.
+
+# Key prefix for the per-review event stream.
+REVIEW_STREAM_PREFIX = "review_events"
+
+# Approximate cap on the number of events kept per review.
+REVIEW_STREAM_MAXLEN = 100
+
+# While a review is running, the stream expires after this long (safety net
+# for jobs that die without reporting a final state).
+REVIEW_STREAM_ACTIVE_TTL_SECONDS = 60 * 60 * 24
+
+# Once a review has completed or failed, the stream is kept this long.
+REVIEW_STREAM_FINISHED_TTL_SECONDS = 60 * 60
+
+
+# ==============================================================================
+# 3. Heartbeats
+# ==============================================================================
+# A single sweeper per process pings idle connections in batches instead of
+# every socket running its own timer.
+
+# Every connection is visited once per interval. Connections that were sent
+# real traffic during the last interval are not pinged.
+HEARTBEAT_INTERVAL_SECONDS = 15
+
+# Connections are spread over this many buckets; one bucket is swept per tick
+# (HEARTBEAT_INTERVAL_SECONDS / HEARTBEAT_BUCKETS seconds).
+HEARTBEAT_BUCKETS = 15
+
+# Clients don't have to answer the "ping" text frame. A dead peer shows up as
+# a heartbeat send that fails or exceeds SEND_TIMEOUT_SECONDS, and as a missed
+# protocol-level ping (answered by every WebSocket client library), which the
+# server sends at this interval and gives up on after this timeout.
+WS_PING_INTERVAL_SECONDS = 20.0
+WS_PING_TIMEOUT_SECONDS = 20.0
+
+# Close code used when a send to a peer fails (1001 = "Going Away").
+DEAD_PEER_CLOSE_CODE = 1001
+
+
+# ==============================================================================
+# 4. Frame Coalescing and Compression
+# ==============================================================================
+# When the writer wakes up it waits this long for more updates to arrive, then
+# sends everything pending as a single frame:
+#   {"type": "batch", "messages": [<update>, <update>, ...]}
+# A lone update is still sent as-is.
+COALESCE_WINDOW_SECONDS = 0.005
+
+# Upper bound on the number of updates merged into one batch frame.
+COALESCE_MAX_MESSAGES = 32
+
+# permessage-deflate is negotiated by the ASGI server's websockets
+# implementation (see app/main.py). It compresses every data frame once agreed,
+# so large final-result frames go out compressed, while coalescing keeps the
+# number of tiny frames down.
+WS_PER_MESSAGE_DEFLATE = True
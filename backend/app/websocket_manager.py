@@ -1,81 +1,360 @@
 from fastapi import WebSocket
-from typing import Dict, List, Set
+from typing import Dict, List, Set, Optional, Tuple
+from collections import OrderedDict
+import itertools
 import uuid
 import json
 import asyncio
 from arq.connections import ArqRedis
 
 from .redis_manager import get_redis_pool
+from .websocket_config import (
+    SEND_QUEUE_MAX_SIZE, SEND_TIMEOUT_SECONDS, SLOW_CONSUMER_CLOSE_CODE,
+    REVIEW_STREAM_PREFIX, REVIEW_STREAM_MAXLEN,
+    REVIEW_STREAM_ACTIVE_TTL_SECONDS, REVIEW_STREAM_FINISHED_TTL_SECONDS,
+    HEARTBEAT_INTERVAL_SECONDS, HEARTBEAT_BUCKETS, DEAD_PEER_CLOSE_CODE,
+    COALESCE_WINDOW_SECONDS, COALESCE_MAX_MESSAGES,
+)
 
 WEBSOCKET_PUBLISH_CHANNEL = "ws_broadcast"
 
+HEARTBEAT_MESSAGE = "ping"
+
+# Review statuses after which no more events will be appended to the stream
+FINAL_REVIEW_STATUSES = {"completed", "failed"}
+
+
+def review_stream_key(review_id: uuid.UUID) -> str:
+    return f"{REVIEW_STREAM_PREFIX}:{review_id}"
+
+
+def _stream_id_order(event_id: str) -> Tuple[int, int]:
+    """Turns a Redis Stream ID like '1700000000000-3' into a sortable tuple."""
+    millis, _, sequence = event_id.partition("-")
+    return int(millis), int(sequence or 0)
+
+
+def _review_coalesce_key(review_id: uuid.UUID, message: dict) -> Optional[str]:
+    """In-flight progress updates for the same review coalesce to the latest one."""
+    return f"progress:{review_id}" if message.get("status") == "processing" else None
+
+
+class ClientConnection:
+    """
+    A single connected client with its own bounded outbound queue and writer task.
+    Producers only enqueue; the writer task is the only thing that awaits the network.
+    """
+
+    # Tens of thousands of these live per node, so skip the per-instance __dict__
+    __slots__ = (
+        "websocket", "user_id", "review_id", "pending", "coalescable", "wakeup",
+        "writer_task", "closed", "replaying", "held_events", "last_event_id",
+        "heartbeat_bucket", "last_sent",
+    )
+
+    _sequence = itertools.count()
+
+    def __init__(self, websocket: WebSocket, user_id: uuid.UUID, review_id: uuid.UUID, heartbeat_bucket: int = 0):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.review_id = review_id
+        # Ordered map of coalesce key -> message. Progress updates share a key,
+        # so a newer one simply replaces the older one that hasn't been sent yet.
+        self.pending: "OrderedDict[str, str]" = OrderedDict()
+        self.coalescable: Set[str] = set()
+        self.wakeup = asyncio.Event()
+        self.writer_task: Optional[asyncio.Task] = None
+        self.closed = False
+
+        # Review stream replay state: live events are held back until the
+        # replay has been queued, and anything already replayed is skipped.
+        self.replaying = False
+        self.held_events: List[Tuple[str, str, Optional[str]]] = []
+        self.last_event_id: Optional[str] = None
+
+        # Heartbeat bookkeeping (event-loop clock)
+        self.heartbeat_bucket = heartbeat_bucket
+        self.last_sent = asyncio.get_running_loop().time()
+
+    def start(self):
+        self.writer_task = asyncio.create_task(self._writer())
+
+    def enqueue(self, message_json: str, coalesce_key: Optional[str] = None):
+        """Queues a message for this client without awaiting any network I/O."""
+        if self.closed:
+            return
+
+        if coalesce_key and coalesce_key in self.pending:
+            # Drop to the latest state: the client only needs the newest progress.
+            self.pending[coalesce_key] = message_json
+            return
+
+        if len(self.pending) >= SEND_QUEUE_MAX_SIZE:
+            # Make room by discarding the oldest progress update, if there is one.
+            droppable = next((key for key in self.pending if key in self.coalescable), None)
+            if droppable is None:
+                # Queue is full of messages we can't drop: this consumer is too slow.
+                self.close(SLOW_CONSUMER_CLOSE_CODE, "Slow consumer")
+                return
+            del self.pending[droppable]
+            self.coalescable.discard(droppable)
+
+        key = coalesce_key or f"msg:{next(self._sequence)}"
+        if coalesce_key:
+            self.coalescable.add(key)
+        self.pending[key] = message_json
+        self.wakeup.set()
+
+    def enqueue_event(self, event_id: str, message_json: str, coalesce_key: Optional[str] = None):
+        """Queues a review stream event, keeping events in order and free of duplicates."""
+        if self.replaying:
+            self.held_events.append((event_id, message_json, coalesce_key))
+            return
+        if self.last_event_id and _stream_id_order(event_id) <= _stream_id_order(self.last_event_id):
+            return
+        self.last_event_id = event_id
+        self.enqueue(message_json, coalesce_key=coalesce_key)
+
+    def finish_replay(self, events: List[Tuple[str, str, Optional[str]]]):
+        """Queues replayed events first, then any live events that arrived meanwhile."""
+        self.replaying = False
+        held, self.held_events = self.held_events, []
+        for event_id, message_json, coalesce_key in events + held:
+            self.enqueue_event(event_id, message_json, coalesce_key)
+
+    def _next_frame(self) -> str:
+        """
+        Pops up to COALESCE_MAX_MESSAGES pending updates and merges them into one
+        frame. Heartbeats are dropped when real updates are going out anyway,
+        and several heartbeats with nothing else go out as a single one.
+        """
+        messages = []
+        while self.pending and len(messages) < COALESCE_MAX_MESSAGES:
+            key, message_json = self.pending.popitem(last=False)
+            self.coalescable.discard(key)
+            messages.append(message_json)
+
+        if len(messages) > 1:
+            messages = [m for m in messages if m != HEARTBEAT_MESSAGE] or [HEARTBEAT_MESSAGE]
+        if len(messages) == 1:
+            return messages[0]
+        # Every queued update is already a JSON object, so join without re-encoding
+        return '{"type": "batch", "messages": [' + ", ".join(messages) + "]}"
+
+    async def _writer(self):
+        """Drains the queue to the socket, coalescing bursts of updates into one frame."""
+        try:
+            while True:
+                await self.wakeup.wait()
+                # Give closely-spaced updates a moment to pile up so they share a frame
+                await asyncio.sleep(COALESCE_WINDOW_SECONDS)
+                self.wakeup.clear()
+                while self.pending:
+                    frame = self._next_frame()
+                    await asyncio.wait_for(self.websocket.send_text(frame), timeout=SEND_TIMEOUT_SECONDS)
+                    self.last_sent = asyncio.get_running_loop().time()
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            print(f"Disconnecting slow WebSocket consumer for user {self.user_id}.")
+            self.close(SLOW_CONSUMER_CLOSE_CODE, "Slow consumer")
+        except Exception:
+            # The send failed, so the peer is gone; closing also ends the endpoint's receive loop
+            self.close(DEAD_PEER_CLOSE_CODE, "Peer unreachable")
+
+    def close(self, code: int, reason: str):
+        """Stops the writer and asks the socket to close, without blocking the caller."""
+        if self.closed:
+            return
+        self.closed = True
+        self.pending.clear()
+        self.coalescable.clear()
+        if self.writer_task and self.writer_task is not asyncio.current_task():
+            self.writer_task.cancel()
+        asyncio.create_task(self._close_socket(code, reason))
+
+    async def _close_socket(self, code: int, reason: str):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code, reason=reason), timeout=SEND_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+
+    def stop(self):
+        self.closed = True
+        self.pending.clear()
+        self.coalescable.clear()
+        if self.writer_task:
+            self.writer_task.cancel()
+
+
 class WebSocketManager:
     def __init__(self):
         # We now have THREE pools of connections
-        self.review_connections: Dict[uuid.UUID, Set[WebSocket]] = {}
-        self.user_connections: Dict[uuid.UUID, Set[WebSocket]] = {}
-        self.global_connections: Set[WebSocket] = set() # For all users
-        
+        self.review_connections: Dict[uuid.UUID, Set[ClientConnection]] = {}
+        self.user_connections: Dict[uuid.UUID, Set[ClientConnection]] = {}
+        self.global_connections: Set[ClientConnection] = set() # For all users
+
+        # Lookup from the raw socket to its queued connection wrapper
+        self.connections: Dict[WebSocket, ClientConnection] = {}
+
+        # Connections are spread across buckets; the heartbeat sweeper visits one per tick
+        self.heartbeat_buckets: List[Set[ClientConnection]] = [set() for _ in range(HEARTBEAT_BUCKETS)]
+        self._bucket_counter = itertools.count()
+
         self.redis: ArqRedis = None
         self.listener_task = None
+        self.heartbeat_task = None
 
     async def startup(self):
         """Initializes the manager and starts the Redis listener."""
         self.redis = await get_redis_pool()
         self.listener_task = asyncio.create_task(self._redis_listener())
+        self.heartbeat_task = asyncio.create_task(self._heartbeat_sweeper())
         print("Scalable WebSocket Manager started.")
 
     async def shutdown(self):
         if self.listener_task:
             self.listener_task.cancel()
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+        for connection in list(self.connections.values()):
+            connection.stop()
         print("WebSocket Manager shut down.")
 
-    async def connect(self, websocket: WebSocket, user_id: uuid.UUID, review_id: uuid.UUID):
-        """Accepts a connection and adds it to all relevant pools."""
+    async def connect(
+        self,
+        websocket: WebSocket,
+        user_id: uuid.UUID,
+        review_id: uuid.UUID,
+        last_event_id: Optional[str] = None,
+    ):
+        """
+        Accepts a connection and adds it to all relevant pools.
+        Any review events after `last_event_id` (or all of them, for a fresh
+        client) are replayed from the review's Redis Stream before live ones.
+        """
         await websocket.accept()
-        self.review_connections.setdefault(review_id, set()).add(websocket)
-        self.user_connections.setdefault(user_id, set()).add(websocket)
-        self.global_connections.add(websocket)
+        bucket = next(self._bucket_counter) % HEARTBEAT_BUCKETS
+        connection = ClientConnection(websocket, user_id=user_id, review_id=review_id, heartbeat_bucket=bucket)
+        connection.replaying = True
+        connection.start()
+        self.connections[websocket] = connection
+        self.heartbeat_buckets[bucket].add(connection)
+        self.review_connections.setdefault(review_id, set()).add(connection)
+        self.user_connections.setdefault(user_id, set()).add(connection)
+        self.global_connections.add(connection)
+
+        try:
+            replay = await self._read_review_events(review_id, after_event_id=last_event_id)
+        except Exception as e:
+            print(f"Error replaying review events for {review_id}: {e}")
+            replay = []
+        connection.finish_replay(replay)
+
+    async def _read_review_events(
+        self, review_id: uuid.UUID, after_event_id: Optional[str] = None
+    ) -> List[Tuple[str, str, Optional[str]]]:
+        """Reads stored events for a review, exclusive of `after_event_id`."""
+        start = f"({after_event_id}" if after_event_id else "-"
+        entries = await self.redis.xrange(review_stream_key(review_id), min=start, max="+")
+
+        events = []
+        for raw_id, fields in entries:
+            event_id = raw_id.decode() if isinstance(raw_id, bytes) else raw_id
+            raw_message = fields.get(b"message", fields.get("message"))
+            message = json.loads(raw_message)
+            message["event_id"] = event_id
+            events.append((event_id, json.dumps(message), _review_coalesce_key(review_id, message)))
+        return events
 
     def disconnect(self, websocket: WebSocket, user_id: uuid.UUID, review_id: uuid.UUID):
         """Removes a connection from all pools."""
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        connection.stop()
+        self.heartbeat_buckets[connection.heartbeat_bucket].discard(connection)
+
         if review_id in self.review_connections:
-            self.review_connections[review_id].remove(websocket)
+            self.review_connections[review_id].discard(connection)
             if not self.review_connections[review_id]:
                 del self.review_connections[review_id]
 
         if user_id in self.user_connections:
-            self.user_connections[user_id].remove(websocket)
+            self.user_connections[user_id].discard(connection)
             if not self.user_connections[user_id]:
                 del self.user_connections[user_id]
-        
-        self.global_connections.discard(websocket)
+
+        self.global_connections.discard(connection)
+
+    async def _heartbeat_sweeper(self):
+        """
+        A single timer for the whole process. Each tick sweeps one bucket, so every
+        connection is visited once per HEARTBEAT_INTERVAL_SECONDS: idle ones get a
+        "ping", and ones with recent traffic are skipped. Clients needn't reply; a
+        ping that can't be delivered closes the connection from the writer.
+        """
+        tick_seconds = HEARTBEAT_INTERVAL_SECONDS / HEARTBEAT_BUCKETS
+        bucket_index = 0
+        loop = asyncio.get_running_loop()
+
+        while True:
+            try:
+                await asyncio.sleep(tick_seconds)
+                now = loop.time()
+                for connection in list(self.heartbeat_buckets[bucket_index]):
+                    if not connection.closed and now - connection.last_sent >= HEARTBEAT_INTERVAL_SECONDS:
+                        connection.enqueue(HEARTBEAT_MESSAGE)
+                bucket_index = (bucket_index + 1) % HEARTBEAT_BUCKETS
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"Error in WebSocket heartbeat sweeper: {e}")
 
     async def broadcast_to_review(self, review_id: uuid.UUID, message: dict):
-        """Publishes a job progress update."""
-        payload = {"type": "review_update", "review_id": str(review_id), "message": message}
+        """
+        Appends a job progress update to the review's capped stream, then
+        publishes it for live delivery. The stream is what late or
+        reconnecting clients replay from.
+        """
+        stream_key = review_stream_key(review_id)
+        ttl = (
+            REVIEW_STREAM_FINISHED_TTL_SECONDS
+            if message.get("status") in FINAL_REVIEW_STATUSES
+            else REVIEW_STREAM_ACTIVE_TTL_SECONDS
+        )
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.xadd(stream_key, {"message": json.dumps(message)}, maxlen=REVIEW_STREAM_MAXLEN, approximate=True)
+        pipe.expire(stream_key, ttl)
+        raw_id, _ = await pipe.execute()
+        event_id = raw_id.decode() if isinstance(raw_id, bytes) else raw_id
+
+        payload = {"type": "review_update", "review_id": str(review_id), "event_id": event_id, "message": message}
         await self.redis.publish(WEBSOCKET_PUBLISH_CHANNEL, json.dumps(payload))
 
     async def broadcast_to_user(self, user_id: uuid.UUID, message: dict):
         """Publishes a user-specific notification."""
         payload = {"type": "user_notification", "user_id": str(user_id), "message": message}
         await self.redis.publish(WEBSOCKET_PUBLISH_CHANNEL, json.dumps(payload))
-        
+
     async def broadcast_to_all(self, message: dict):
         """Publishes a system-wide message to all servers."""
         payload = {"type": "system_broadcast", "message": message}
         await self.redis.publish(WEBSOCKET_PUBLISH_CHANNEL, json.dumps(payload))
 
-    async def _broadcast_locally(self, connections: Set[WebSocket], message_json: str):
-        """Sends a message to a set of locally connected clients."""
-        # Use asyncio.gather for concurrent sending
-        await asyncio.gather(*[conn.send_text(message_json) for conn in connections], return_exceptions=True)
+    def _broadcast_locally(self, connections: Set[ClientConnection], message_json: str, coalesce_key: Optional[str] = None):
+        """
+        Hands a message to each local client's send queue.
+        This never awaits the network, so a stalled client can't delay anyone else.
+        """
+        for connection in list(connections):
+            connection.enqueue(message_json, coalesce_key=coalesce_key)
 
     async def _redis_listener(self):
         """Listens to Redis and routes messages to the correct local clients."""
         pubsub = self.redis.pubsub()
         await pubsub.subscribe(WEBSOCKET_PUBLISH_CHANNEL)
-        
+
         while True:
             try:
                 message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
@@ -83,17 +362,21 @@ class WebSocketManager:
 
                 data = json.loads(message["data"])
                 message_type = data.get("type")
-                message_json = json.dumps(data["message"])
 
                 if message_type == "review_update":
                     review_id = uuid.UUID(data["review_id"])
-                    await self._broadcast_locally(self.review_connections.get(review_id, set()), message_json)
+                    event_id = data["event_id"]
+                    review_message = {**data["message"], "event_id": event_id}
+                    message_json = json.dumps(review_message)
+                    coalesce_key = _review_coalesce_key(review_id, review_message)
+                    for connection in list(self.review_connections.get(review_id, set())):
+                        connection.enqueue_event(event_id, message_json, coalesce_key)
                 elif message_type == "user_notification":
                     user_id = uuid.UUID(data["user_id"])
-                    await self._broadcast_locally(self.user_connections.get(user_id, set()), message_json)
+                    self._broadcast_locally(self.user_connections.get(user_id, set()), json.dumps(data["message"]))
                 elif message_type == "system_broadcast":
-                    await self._broadcast_locally(self.global_connections, message_json)
-                    
+                    self._broadcast_locally(self.global_connections, json.dumps(data["message"]))
+
             except (asyncio.CancelledError, ConnectionError):
                 break
             except Exception as e:
@@ -1,11 +1,13 @@
 import os
 from dotenv import load_dotenv
 from arq.connections import RedisSettings # <-- This import is correct
+from arq.cron import cron
 
 # Load environment variables
 load_dotenv()
 
 from . import tasks
+from .db_metrics import track_job
 
 class WorkerSettings:
     """
@@ -14,7 +16,12 @@ class WorkerSettings:
     queues = ['high_priority', 'default_priority']
 
     functions = [
-        tasks.analyze_code_task,
+        track_job(tasks.analyze_code_task),
+    ]
+
+    # Hourly, a few minutes past so the previous hour's rollups are complete
+    cron_jobs = [
+        cron(track_job(tasks.maintain_audit_logs_task), minute=5, run_at_startup=True),
     ]
     
     # --- THIS SECTION IS NOW CORRECTED ---
@@ -1,90 +1,68 @@
 import sys
 import os
-import hashlib
-import json
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
 
 # This allows the script to import modules from your backend app
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
 
-from app.cache_manager import set_cache, get_cache
+from app import crud
+from app.database import AsyncSessionLocal, engine
 
-# --- Mock Analysis Function ---
-# In the real application, this would be our actual OpenAI analysis service.
-# For now, it returns a fake, hardcoded review.
-def mock_analyze_code(code_content: str, language: str) -> dict:
-    """A mock function to simulate AI code analysis."""
-    print(f"   -> Running MOCK analysis for {language} snippet...")
-    # Simulate a delay
-    import time
-    time.sleep(2)
-    return {
-        "score": 85,
-        "language": language,
-        "suggestions": [
-            {
-                "type": "performance",
-                "line": 1,
-                "message": "This is a common boilerplate, no performance issues found."
-            }
-        ],
-        "vulnerabilities": []
-    }
+# --- Defaults ---
+# Warm the results of the most frequently reviewed code from the last week,
+# a few hashes at a time so the database pool isn't exhausted.
+DEFAULT_TOP_N = 500
+DEFAULT_LOOKBACK_DAYS = 7
+DEFAULT_CONCURRENCY = 8
 
-# --- Cache Key Generation (copied from our design) ---
-def create_review_cache_key(code_content: str, language: str, model_version="v1.0") -> str:
-    """Generates a consistent cache key for a code snippet."""
-    encoded_code = code_content.encode('utf-8')
-    code_hash = hashlib.sha256(encoded_code).hexdigest()
-    return f"apex:cache:review:{code_hash}:{language}:{model_version}"
 
-# --- List of common code snippets to pre-load into the cache ---
-COMMON_SNIPPETS = [
-    {
-        "language": "python",
-        "content": "print('Hello, World!')"
-    },
-    {
-        "language": "javascript",
-        "content": "console.log('Hello, World!');"
-    },
-    {
-        "language": "java",
-        "content": 'public class HelloWorld {\n    public static void main(String[] args) {\n        System.out.println("Hello, World!");\n    }\n}'
-    }
-]
+async def warm_review_results(project_id, normalized_hash: str, semaphore: asyncio.Semaphore, counts: dict):
+    """
+    Fills the review results cache for one project and normalized hash, under
+    the key the worker reads (crud.get_cached_review_results). Writes without
+    reading Redis first, so warming doesn't count as a request for the key in
+    the cache's admission frequencies.
+    """
+    async with semaphore:
+        try:
+            async with AsyncSessionLocal() as session:
+                results = await crud.fill_review_results_cache(session, project_id, normalized_hash)
+            counts["warmed" if results is not None else "missing"] += 1
+        except Exception as e:
+            print(f"   ❌ Failed to warm {normalized_hash[:12]}: {e}")
+            counts["failed"] += 1
 
-def run_cache_warmer():
+
+async def run_cache_warmer(top_n: int, lookback_days: int, concurrency: int):
     print("🔥 Starting Cache Warmer...")
-    warmed_count = 0
-    skipped_count = 0
+    since = datetime.now(timezone.utc) - timedelta(days=lookback_days)
+    counts = {"warmed": 0, "missing": 0, "failed": 0}
+    try:
+        async with AsyncSessionLocal() as session:
+            hashes = await crud.get_top_normalized_hashes(session, since=since, limit=top_n)
+        print(f"   Found {len(hashes)} frequently reviewed snippets from the last {lookback_days} days.")
 
-    for snippet in COMMON_SNIPPETS:
-        lang = snippet["language"]
-        code = snippet["content"]
-        
-        print(f"\nProcessing snippet for: {lang}")
-        
-        cache_key = create_review_cache_key(code, lang)
-        
-        # 1. Check if the cache key already exists
-        if get_cache(cache_key):
-            print("   ✅ Cache hit. Skipping.")
-            skipped_count += 1
-            continue
-        
-        # 2. If not, run the analysis
-        print("   ⚠️ Cache miss. Warming now...")
-        analysis_result = mock_analyze_code(code, lang)
-        
-        # 3. Store the result in the cache (TTL: 24 hours)
-        set_cache(cache_key, analysis_result, ttl_seconds=86400)
-        print("   ✅ Cache warmed successfully.")
-        warmed_count += 1
+        semaphore = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(
+            warm_review_results(project_id, normalized_hash, semaphore, counts)
+            for project_id, normalized_hash in hashes
+        ))
+    finally:
+        # Close pooled connections before the event loop goes away
+        await engine.dispose()
 
-    print(f"\n✨ Cache warming complete. Warmed: {warmed_count}, Skipped: {skipped_count}.")
+    print(
+        f"\n✨ Cache warming complete. Warmed: {counts['warmed']}, "
+        f"No results: {counts['missing']}, Failed: {counts['failed']}."
+    )
 
 
 if __name__ == "__main__":
-    run_cache_warmer()
-
-    
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Pre-load the review results cache from recent traffic.")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP_N, help="How many of the most reviewed snippets to warm.")
+    parser.add_argument("--days", type=int, default=DEFAULT_LOOKBACK_DAYS, help="How far back to look for reviews.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="How many snippets to warm at once.")
+    args = parser.parse_args()
+    asyncio.run(run_cache_warmer(args.top, args.days, args.concurrency))